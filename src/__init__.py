@@ -8,6 +8,7 @@ from pathlib import Path
 
 from flask import Flask, render_template, request
 from flask_login import user_logged_in
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 import src.routes.auth
 import src.routes.categoria
@@ -16,11 +17,17 @@ from src import utils
 from src.models.usuario import User, Role
 from src.models.categoria import Categoria
 from src.models.produto import Produto
-from src.modules import bootstrap, minify, db, csrf, login, mail
+from src.models.mensagem import Mensagem  # noqa: F401 (tabela da caixa de saída)
+from src.models.acesso import Acesso  # noqa: F401 (tabela do registro de acessos)
+from src.modules import bootstrap, minify, db, csrf, login, mail, thumbnail_cache, \
+    blobstore, busca, tarefas, identidades, hashing, caixa_de_saida, limites, versoes, \
+    relatorios, tokens, perfil_sqlite, replicas, registro_de_acessos, esquema
 
 
-def create_app(config_filename: str = 'config.dev.json') -> Flask:
-    app = Flask(__name__, instance_relative_config=True, static_folder='static', template_folder='templates')
+def create_app(config_filename: str = 'config.dev.json', instance_path: str | None = None) -> Flask:
+    # instance_path: pasta instance alternativa, usada pelos testes
+    app = Flask(__name__, instance_path=instance_path, instance_relative_config=True,
+                static_folder='static', template_folder='templates')
 
     # Desativar as mensagens do servidor HTTP
     # https://stackoverflow.com/a/18379764
@@ -60,14 +67,47 @@ def create_app(config_filename: str = 'config.dev.json') -> Flask:
             app.logger.fatal("Necessário definir a chave \"%s\" no arquivo %s" % (key, config_filename))
             exit(1)
 
+    # Atrás de proxy reverso, o REMOTE_ADDR é o IP do proxy, e os limites de taxa por
+    # IP valeriam para todos os clientes juntos. PROXIES_CONFIAVEIS é a quantidade de
+    # proxies na frente da aplicação, cujos cabeçalhos X-Forwarded-* são aceitos
+    proxies = int(app.config.get('PROXIES_CONFIAVEIS', 0))
+    if proxies > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+
     app.logger.debug("Inicializando módulos básicos")
     bootstrap.init_app(app)
     if 'MINIFY' in app.config:
         if app.config.get('MINIFY'):
             minify.init_app(app)
     db.init_app(app)
+    perfil_sqlite.init_app(app)
+    replicas.init_app(app)
+    esquema.init_app(app)
+
+    # Limites de upload específicos de alguns endpoints. Precisam ser aplicados
+    # antes que a verificação do CSRF leia o formulário
+    limites_de_upload = {'produto.compravenda': 'COMPRAVENDA_MAX_CONTENT_LENGTH'}
+
+    @app.before_request
+    def aplica_limite_de_upload():
+        chave = limites_de_upload.get(request.endpoint)
+        if chave and app.config.get(chave):
+            request.max_content_length = int(app.config.get(chave))
+
     csrf.init_app(app)
     mail.init_app(app)
+    blobstore.init_app(app)
+    thumbnail_cache.init_app(app)
+    busca.init_app(app)
+    tarefas.init_app(app)
+    identidades.init_app(app)
+    hashing.init_app(app)
+    caixa_de_saida.init_app(app)
+    registro_de_acessos.init_app(app)
+    limites.init_app(app)
+    versoes.init_app(app)
+    relatorios.init_app(app)
+    tokens.init_app(app)
     login.init_app(app)
     login.login_view = 'auth.login'
     login.login_message = "É necessário estar logado para acessar esta funcionalidade"
@@ -88,6 +128,11 @@ def create_app(config_filename: str = 'config.dev.json') -> Flask:
             app.logger.fatal("Necessário fazer a migração/upgrade do banco")
             sys.exit(1)
 
+        # Bancos criados por versões anteriores recebem as tabelas, colunas e índices novos
+        esquema.atualiza()
+        busca.cria_estrutura()
+        versoes.cria_estrutura()
+
         if Role.is_empty():
             papeis = ['Admin', 'Usuario']
             for nome_papel in papeis:
@@ -95,6 +140,9 @@ def create_app(config_filename: str = 'config.dev.json') -> Flask:
                 app.logger.info("Adicionando papel \"%s\"" % nome_papel)
             db.session.commit()
 
+        if Role.atribui_bits():
+            app.logger.info("Bits atribuídos aos papéis novos")
+
         if User.is_empty():
             usuarios = [
                 {'nome': "Administrador",
@@ -150,18 +198,14 @@ def create_app(config_filename: str = 'config.dev.json') -> Flask:
             app.logger.info("Semeadura das tabelas concluída")
             app.logger.info("Adicionados %d produtos em %d categorias" % (pc, cc))
 
+    # Emails gravados na caixa de saída são enviados em segundo plano
+    caixa_de_saida.inicia()
+    registro_de_acessos.inicia()
+
     @user_logged_in.connect_via(app)
     def update_login_details(sender_app, user):
-        remote_addr = request.remote_addr or None
-        timestamp = utils.timestamp()
-
-        login_anterior, login_atual = user.dta_acesso_atual, timestamp
-        ip_anterior, ip_atual = user.ip_acesso_atual, remote_addr
-
-        user.dta_ultimo_acesso = login_anterior or login_atual
-        user.dta_acesso_atual = login_atual
-        user.ip_ultimo_acesso = ip_anterior
-        user.ip_acesso_atual = ip_atual
+        # Só anota o acesso; a gravação é feita em lote pelo registro de acessos
+        registro_de_acessos.registra(user.id, request.remote_addr or None)
 
     @login.user_loader
     def load_user(user_id):
@@ -170,7 +214,7 @@ def create_app(config_filename: str = 'config.dev.json') -> Flask:
         except ValueError:
             return None
         else:
-            return User.get_by_id(auth_id)
+            return identidades.obtem(User, auth_id, perfil='identidade')
 
     @app.route('/')
     @app.route('/index')
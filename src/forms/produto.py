@@ -15,8 +15,8 @@ class NovoProdutoForm(FlaskForm):
                             validators=[InputRequired(message="É necessário escolher uma categoria "
                                                               "válida para o produto")])
     foto_raw = FileField("Foto do produto",
-                         validators=[FileAllowed(['jpg', 'png'],
-                                                 message="Apenas arquivos JPG ou PNG")])
+                         validators=[FileAllowed(['jpg', 'jpeg', 'png', 'webp'],
+                                                 message="Apenas arquivos JPG, PNG ou WebP")])
     ativo = BooleanField("Produto ativo?", default=True, validators=[AnyOf([True, False])])
     submit = SubmitField("Adicionar")
 
@@ -30,13 +30,14 @@ class EditProdutoForm(FlaskForm):
                             validators=[InputRequired(message="É necessário escolher uma categoria "
                                                               "válida para o produto")])
     foto_raw = FileField("Foto do produto",
-                         validators=[FileAllowed(['jpg', 'png'],
-                                                 message="Apenas arquivos JPG ou PNG")])
+                         validators=[FileAllowed(['jpg', 'jpeg', 'png', 'webp'],
+                                                 message="Apenas arquivos JPG, PNG ou WebP")])
     ativo = BooleanField("Produto ativo?", default=True, validators=[AnyOf([True, False])])
     remover_imagem = BooleanField("Remover imagem?", default=False, validators=[AnyOf([True, False])])
     submit = SubmitField("Alterar")
 
 class CompraVendaProdutoForm(FlaskForm):
     arquivo_transacoes = FileField("Arquivo com as transações",
-                                   validators=[FileAllowed(['json'], message="Apenas arquivos JSON")])
+                                   validators=[FileAllowed(['json', 'ndjson', 'jsonl'],
+                                                           message="Apenas arquivos JSON ou NDJSON")])
     submit = SubmitField("Enviar")
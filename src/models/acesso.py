@@ -0,0 +1,45 @@
+from typing import Optional
+
+import sqlalchemy as sa
+from sqlalchemy import ForeignKey, Index
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.types import Uuid, String, Integer, DateTime
+
+from src.modules import db, esquema
+
+
+class Acesso(db.Model):
+    """
+    Registro de um login. A tabela só recebe inserções, feitas em lote pelo
+    registro de acessos; o último acesso de cada usuário é o registro mais
+    recente dele
+    """
+    __tablename__ = 'acessos'
+    __table_args__ = (
+        Index('ix_acessos_usuario_dta', 'usuario_id', 'dta_acesso'),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    usuario_id: Mapped[Uuid] = mapped_column(Uuid(as_uuid=True), ForeignKey('usuarios.id', ondelete='CASCADE'),
+                                             nullable=False)
+    dta_acesso: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+    ip: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+
+
+@esquema.passo('acessos: último e penúltimo acesso das colunas antigas de usuarios')
+def _copia_acessos_antigos(conexao: sa.Connection) -> bool:
+    # Bancos anteriores à tabela acessos guardavam os dois últimos acessos em colunas de usuarios, que não
+    # fazem mais parte do modelo mas continuam no arquivo. Só copia para quem ainda não tem acessos
+    colunas = {coluna['name'] for coluna in sa.inspect(conexao).get_columns('usuarios')}
+    if not {'dta_acesso_atual', 'ip_acesso_atual', 'dta_ultimo_acesso', 'ip_ultimo_acesso'} <= colunas:
+        return False
+    resultado = conexao.exec_driver_sql(
+        "INSERT INTO acessos (usuario_id, dta_acesso, ip) "
+        "SELECT id, dta_acesso, ip FROM ("
+        "  SELECT id, dta_acesso_atual AS dta_acesso, ip_acesso_atual AS ip FROM usuarios "
+        "  UNION ALL "
+        "  SELECT id, dta_ultimo_acesso, ip_ultimo_acesso FROM usuarios"
+        ") AS antigos "
+        "WHERE dta_acesso IS NOT NULL "
+        "AND NOT EXISTS (SELECT 1 FROM acessos WHERE acessos.usuario_id = antigos.id)")
+    return resultado.rowcount > 0
@@ -4,9 +4,10 @@ from typing import Self, Optional
 import sqlalchemy as sa
 from sqlalchemy import func
 from sqlalchemy.orm import Mapped
+from sqlalchemy.sql.base import ExecutableOption
 from sqlalchemy.types import DateTime
 
-from src.modules import db
+from src.modules import db, versoes
 
 
 class TimestampMixin:
@@ -19,6 +20,25 @@ class TimestampMixin:
 
 
 class BasicRepositoryMixin:
+    @classmethod
+    def perfis_de_carga(cls) -> dict[str, list[ExecutableOption]]:
+        # Cada classe pode sobrescrever, associando um nome de perfil às opções
+        # de carga (defer, load_only, joinedload, selectinload...) da consulta
+        return dict()
+
+    @classmethod
+    def opcoes_de_carga(cls, perfil: str | None = None) -> list[ExecutableOption]:
+        if perfil is None:
+            return list()
+        perfis = cls.perfis_de_carga()
+        if perfil not in perfis:
+            raise ValueError(f"Perfil de carga \"{perfil}\" inexistente para {cls.__name__}")
+        return perfis.get(perfil)
+
+    @classmethod
+    def seleciona(cls, perfil: str | None = None) -> sa.Select:
+        return sa.select(cls).options(*cls.opcoes_de_carga(perfil))
+
     @classmethod
     def is_empty(cls) -> bool:
         return not (db.session.execute(sa.select(cls).
@@ -27,22 +47,24 @@ class BasicRepositoryMixin:
 
     @classmethod
     def get_tuples_id_atributo(cls, atributo: str = 'nome') -> list[tuple[str, str]] | None:
-        if hasattr(cls, atributo):
-            rset = (db.session.execute(sa.select(cls).
-                                       order_by(getattr(cls, atributo))).
-                    scalars())
-            rtuples = [(str(i.id), str(getattr(i, atributo))) for i in rset]
-        else:
-            rtuples = None
-        return rtuples
+        if not hasattr(cls, atributo):
+            return None
+
+        def consulta() -> list[tuple[str, str]]:
+            coluna = getattr(cls, atributo)
+            return [(str(registro_id), str(valor)) for registro_id, valor in
+                    db.session.execute(sa.select(cls.id, coluna).order_by(coluna))]
+
+        # Em cache enquanto a versão da tabela não mudar, se ela for monitorada (versoes.monitora_modelo)
+        return list(versoes.em_cache(cls.__tablename__, ('tuplas', atributo), consulta))
 
     @classmethod
-    def get_by_id(cls, cls_id) -> Self | None:
+    def get_by_id(cls, cls_id, perfil: str | None = None) -> Self | None:
         try:
             cls_id = uuid.UUID(str(cls_id))
         except ValueError:
             cls_id = cls_id
-        return db.session.get(cls, cls_id)
+        return db.session.get(cls, cls_id, options=cls.opcoes_de_carga(perfil))
 
     @classmethod
     def get_first_or_none_by(cls, atributo: str, valor: str | int | uuid.UUID,
@@ -1,14 +1,17 @@
 import uuid
+from typing import Optional
 
-from sqlalchemy.orm import mapped_column, Mapped, relationship
+import sqlalchemy as sa
+from sqlalchemy.orm import mapped_column, Mapped, relationship, query_expression, with_expression
 from sqlalchemy.types import Uuid, String
 
-from src.modules import db
+from src.modules import db, busca, versoes
 from .base_mixin import TimestampMixin, BasicRepositoryMixin
 
 
 class Categoria(db.Model, TimestampMixin, BasicRepositoryMixin):
     __tablename__ = 'categorias'
+    __table_args__ = (sa.Index('ix_categorias_nome_id', 'nome', 'id'),)
 
     id: Mapped[Uuid] = mapped_column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
     nome: Mapped[str] = mapped_column(String(60), nullable=False)
@@ -17,3 +20,20 @@ class Categoria(db.Model, TimestampMixin, BasicRepositoryMixin):
                                      back_populates='categoria',
                                      lazy='select',
                                      cascade='all, delete-orphan')
+
+    # Preenchido apenas pelas consultas feitas com seleciona_com_contagem()
+    qtd_produtos: Mapped[Optional[int]] = query_expression()
+
+    @classmethod
+    def seleciona_com_contagem(cls) -> sa.Select:
+        from .produto import Produto
+        contagem = (sa.select(Produto.categoria_id, sa.func.count(Produto.id).label('qtd')).
+                    group_by(Produto.categoria_id).
+                    subquery())
+        return (sa.select(cls).
+                outerjoin(contagem, contagem.c.categoria_id == cls.id).
+                options(with_expression(cls.qtd_produtos, sa.func.coalesce(contagem.c.qtd, 0))))
+
+
+busca.indexa(Categoria, 'nome')
+versoes.monitora_modelo('categorias', Categoria)
@@ -0,0 +1,41 @@
+import json
+import uuid
+from typing import Optional
+
+from sqlalchemy import ForeignKey
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.types import Uuid, String, Text, Integer, DateTime
+
+from src.modules import db
+from .base_mixin import TimestampMixin, BasicRepositoryMixin
+
+
+class Mensagem(db.Model, TimestampMixin, BasicRepositoryMixin):
+    """
+    Email na caixa de saída. É gravado na mesma transação que o originou e
+    enviado depois pelo despachante da caixa de saída
+    """
+    __tablename__ = 'caixa_de_saida'
+
+    id: Mapped[Uuid] = mapped_column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    usuario_id: Mapped[Optional[Uuid]] = mapped_column(Uuid(as_uuid=True), ForeignKey('usuarios.id',
+                                                                                      ondelete='SET NULL'),
+                                                       nullable=True, index=True)
+    destinatarios_json: Mapped[str] = mapped_column(Text, nullable=False)
+    assunto: Mapped[str] = mapped_column(String(256), nullable=False)
+    corpo: Mapped[str] = mapped_column(Text, nullable=False)
+    message_id: Mapped[str] = mapped_column(String(256), nullable=False)
+    # pendente, enviando, enviada ou falha
+    situacao: Mapped[str] = mapped_column(String(16), nullable=False, default='pendente', index=True)
+    tentativas: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    proxima_tentativa: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True, index=True)
+    ultimo_erro: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    dta_envio: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
+
+    @property
+    def destinatarios(self) -> list[str]:
+        return json.loads(self.destinatarios_json)
+
+    @destinatarios.setter
+    def destinatarios(self, value: list[str]) -> None:
+        self.destinatarios_json = json.dumps(list(value))
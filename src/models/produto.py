@@ -1,61 +1,181 @@
-import io
+import hashlib
 import uuid
 from base64 import b64decode
 from typing import Optional
 
-from PIL import Image
+import sqlalchemy as sa
 from sqlalchemy import ForeignKey
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.orm import Mapped, mapped_column, relationship, defer, joinedload, load_only
 from sqlalchemy.types import Uuid, String, DECIMAL, Integer, Boolean, Text
 
-from src.modules import db
+from src.modules import db, busca, thumbnail_cache, blobstore, versoes
+from src.services.imagens import miniatura, ImagemInvalida
 from .base_mixin import TimestampMixin, BasicRepositoryMixin
 
 
 class Produto(db.Model, TimestampMixin, BasicRepositoryMixin):
     __tablename__ = 'produtos'
+    __table_args__ = (sa.Index('ix_produtos_nome_id', 'nome', 'id'),
+                      # Índice parcial: contém apenas os produtos em falta, já na ordem da página
+                      sa.Index('ix_produtos_em_falta', 'estoque', 'nome',
+                               sqlite_where=sa.text('estoque <= 0'),
+                               postgresql_where=sa.text('estoque <= 0')),)
 
     id: Mapped[Uuid] = mapped_column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
     nome: Mapped[str] = mapped_column(String(100), nullable=False)
     preco: Mapped[DECIMAL] = mapped_column(DECIMAL(10, 2), default=0.00)
     estoque: Mapped[Integer] = mapped_column(Integer, default=0)
     ativo: Mapped[Boolean] = mapped_column(Boolean, default=True)
+    # Legado: fotos gravadas antes do armazém de blobs. Use 'flask produto migra-fotos'
     foto_base64: Mapped[Optional[Text]] = mapped_column(Text, nullable=True)
     foto_mime: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     possui_foto: Mapped[Boolean] = mapped_column(Boolean, default=False)
-    categoria_id: Mapped[Uuid] = mapped_column(Uuid(as_uuid=True), ForeignKey('categorias.id'))
+    # SHA-256 do conteúdo da foto, que é também a chave dela no armazém de blobs
+    foto_hash: Mapped[Optional[str]] = mapped_column(String(64), nullable=True, index=True)
+    # Número do último envio de foto. A tarefa de um envio mais antigo não grava a foto dela
+    foto_sequencia: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default=sa.text('0'))
+    categoria_id: Mapped[Uuid] = mapped_column(Uuid(as_uuid=True), ForeignKey('categorias.id'), index=True)
 
     categoria = relationship('Categoria',  # Type: Mapped[Categoria]
                              back_populates='lista_de_produtos')
 
-    def thumbnail(self, max_size: int = 64) -> (bytes, str):
-        saida = io.BytesIO()
-        max_size = min(max_size, 128)
-        if not self.foto_base64 or not self.possui_foto or not self.foto_mime:
-            entrada = Image.new('RGB', (max_size, max_size), (128, 128, 128))
-            formato = 'PNG'
-            mime_type = 'image/png'
-        else:
-            entrada = Image.open(io.BytesIO(b64decode(self.foto_base64)))
-            formato = entrada.format
-            (largura, altura) = entrada.size
-            fator_escala = max(max_size / largura, max_size / altura)
-            novo_tamanho = (int(largura * fator_escala), int(altura * fator_escala))
-            entrada.thumbnail(novo_tamanho)
-            mime_type = self.foto_mime
-        entrada.save(saida, format=formato)
-        return saida.getvalue(), mime_type
+    @classmethod
+    def perfis_de_carga(cls):
+        return {
+            # Páginas de listagem: sem a foto legada e com a categoria na mesma consulta
+            # (e na confirmação da remoção, que também mostra a categoria)
+            'listagem': [defer(cls.foto_base64), joinedload(cls.categoria)],
+            # Edição: sem a foto legada; a categoria vem só pelo categoria_id
+            'detalhe': [defer(cls.foto_base64)],
+            # Servir imagens: apenas o necessário para localizar a foto
+            'foto': [load_only(cls.id, cls.possui_foto, cls.foto_mime, cls.foto_hash, cls.dta_atualizacao)],
+        }
+
+    @classmethod
+    def seleciona_em_falta(cls) -> sa.Select:
+        from .categoria import Categoria
+        # O limite é um literal, e não um parâmetro, para que o SQLite possa usar o índice parcial
+        return (sa.select(cls.id, cls.nome, cls.preco, cls.estoque, cls.ativo,
+                          Categoria.nome.label('categoria_nome')).
+                outerjoin(Categoria, Categoria.id == cls.categoria_id).
+                where(cls.estoque <= sa.literal_column('0')).
+                order_by(cls.estoque.asc(), cls.nome.asc()))
+
+    @classmethod
+    def em_falta(cls) -> list[sa.Row]:
+        # Recalculada apenas quando a versão 'produtos_em_falta' muda
+        return versoes.em_cache('produtos_em_falta', 'lista',
+                                lambda: db.session.execute(cls.seleciona_em_falta()).all())
+
+    @classmethod
+    def quantidade_em_falta(cls) -> int:
+        return versoes.em_cache('produtos_em_falta', 'quantidade',
+                                lambda: db.session.execute(sa.select(sa.func.count()).
+                                                           select_from(cls).
+                                                           where(cls.estoque <= sa.literal_column('0'))).scalar_one())
 
     @property
-    def imagem(self) -> (bytes, str):
-        if not self.foto_base64 or not self.possui_foto or not self.foto_mime:
-            saida = io.BytesIO()
-            entrada = Image.new('RGB', (480, 480), (128, 128, 128))
-            formato = 'PNG'
-            entrada.save(saida, format=formato)
-            data = saida.getvalue()
-            mime_type = 'image/png'
+    def hash_da_foto(self) -> str | None:
+        if self.foto_hash:
+            return self.foto_hash
+        # Registros anteriores à coluna foto_hash não possuem o hash gravado
+        if not self.foto_base64:
+            return None
+        return hashlib.sha256(b64decode(self.foto_base64)).hexdigest()
+
+    @property
+    def dados_da_foto(self) -> bytes | None:
+        if not self.possui_foto:
+            return None
+        if self.foto_hash:
+            dados = blobstore.le(self.foto_hash)
+            if dados is not None:
+                return dados
+        if self.foto_base64:
+            return b64decode(self.foto_base64)
+        return None
+
+    def define_foto(self, dados: bytes | None, mime_type: str | None) -> None:
+        if dados:
+            self.possui_foto = True
+            self.foto_base64 = None
+            self.foto_mime = mime_type
+            self.foto_hash = blobstore.grava(dados)
         else:
-            data = b64decode(self.foto_base64)
-            mime_type = self.foto_mime
-        return data, mime_type
+            self.possui_foto = False
+            self.foto_base64 = None
+            self.foto_mime = None
+            self.foto_hash = None
+
+    @classmethod
+    def proxima_sequencia_de_foto(cls, produto_id) -> int:
+        """
+        Numera um novo envio (ou a remoção) da foto do produto, na transação
+        corrente. As tarefas dos envios anteriores deixam de gravar a foto
+        """
+        return db.session.execute(sa.update(cls).
+                                  where(cls.id == produto_id).
+                                  values(foto_sequencia=cls.foto_sequencia + 1).
+                                  returning(cls.foto_sequencia)).scalar_one()
+
+    @classmethod
+    def define_foto_do_envio(cls, produto_id, sequencia: int, dados: bytes, mime_type: str) -> str | None:
+        """
+        Grava a foto processada do envio sequencia, a menos que ela já tenha
+        sido substituída ou removida depois desse envio. A verificação e a
+        gravação são o mesmo UPDATE. Devolve o hash da foto, ou None se ela
+        não foi gravada
+        """
+        foto_hash = blobstore.grava(dados)
+        resultado = db.session.execute(sa.update(cls).
+                                       where(cls.id == produto_id, cls.foto_sequencia == sequencia).
+                                       values(possui_foto=True, foto_base64=None, foto_mime=mime_type,
+                                              foto_hash=foto_hash).
+                                       execution_options(synchronize_session=False))
+        return foto_hash if resultado.rowcount == 1 else None
+
+    @property
+    def versao_da_foto(self) -> str | None:
+        # Segmento de versão das URLs da foto. Fotos legadas (sem foto_hash) não têm
+        if not self.possui_foto or not self.foto_hash:
+            return None
+        return self.foto_hash[:16]
+
+    def thumbnail(self, max_size: int = 64) -> (bytes | None, str | None):
+        # Sem foto devolve (None, None); a imagem padrão é o arquivo estático img/sem-foto-thumbnail.png
+        max_size = min(max_size, 128)
+        if not self.possui_foto or not self.foto_mime or not self.hash_da_foto:
+            return None, None
+
+        foto_hash = self.hash_da_foto
+        dados = thumbnail_cache.obtem(self.id, max_size, foto_hash)
+        if dados is None:
+            try:
+                dados, _ = miniatura(self.dados_da_foto, max_size)
+            except ImagemInvalida:
+                return None, None
+            thumbnail_cache.grava(self.id, max_size, foto_hash, dados)
+        return dados, self.foto_mime
+
+    def migra_foto_legada(self) -> bool:
+        if not self.foto_base64:
+            return False
+        self.foto_hash = blobstore.grava(b64decode(self.foto_base64))
+        self.foto_base64 = None
+        return True
+
+    @property
+    def imagem(self) -> (bytes | None, str | None):
+        # Sem foto devolve (None, None); a imagem padrão é o arquivo estático img/sem-foto.png
+        data = self.dados_da_foto
+        if not data or not self.foto_mime:
+            return None, None
+        return data, self.foto_mime
+
+
+busca.indexa(Produto, 'nome')
+# Qualquer alteração nos produtos, inclusive por UPDATE em lote: versão usada pela exportação do catálogo
+versoes.monitora('produtos', 'produtos')
+# Qualquer alteração em um produto que está (ou estava) em falta muda a lista de produtos em falta
+versoes.monitora('produtos_em_falta', 'produtos', '{linha}.estoque <= 0')
+versoes.monitora('produtos_em_falta', 'categorias')
@@ -1,27 +1,27 @@
-import datetime
+import hashlib
+import hmac
 import random
-import smtplib
 import uuid
 from base64 import b64encode
+from functools import lru_cache
 from hashlib import md5
-from io import BytesIO
-from time import time
 from typing import Optional, Self, List
 
 import email_validator
-import jwt
 import pyotp
+import sqlalchemy as sa
 from flask import current_app
 from flask_login import UserMixin
-from flask_mailman import EmailMessage
+from qrcode.constants import ERROR_CORRECT_L
+from qrcode.exceptions import DataOverflowError
+from qrcode.image.svg import SvgPathImage
 from qrcode.main import QRCode
-from sqlalchemy import Table, Column, ForeignKey
-from sqlalchemy.orm import mapped_column, Mapped, relationship
+from sqlalchemy import Table, Column, ForeignKey, event, select
+from sqlalchemy.orm import mapped_column, Mapped, relationship, selectinload
 from sqlalchemy.types import Uuid, String, DateTime, Boolean, Integer
-# noinspection PyPackageRequirements
-from werkzeug.security import generate_password_hash, check_password_hash
-
-from src.modules import db
+from src.modules import db, identidades, hashing, caixa_de_saida, tokens, registro_de_acessos, esquema
+from src.role_management import compila_requisito, papeis_alterados
+from src.services.tokens import TokenValido
 from .base_mixin import TimestampMixin, BasicRepositoryMixin
 
 users_roles = Table('usersroles',
@@ -30,6 +30,32 @@ users_roles = Table('usersroles',
                     Column('role_id', ForeignKey('roles.id'), primary_key=True))
 
 
+# Versão fixa do código QR: comporta a URI de provisionamento com emails de até ~80 caracteres, sem a
+# busca pela menor versão que make(fit=True) faz a cada geração
+VERSAO_QR = 8
+# Máscara fixa: sem ela, make() gera o código com as 8 máscaras para escolher a de menor penalidade,
+# o que custa mais que todo o resto da geração. Qualquer máscara é lida pelos aplicativos
+MASCARA_QR = 0
+
+
+@lru_cache(maxsize=1024)
+def _totp(otp_secret: str) -> pyotp.TOTP:
+    # O objeto TOTP não guarda estado além do segredo, então é reaproveitado entre requisições
+    return pyotp.TOTP(otp_secret)
+
+
+@lru_cache(maxsize=256)
+def _qr_svg_b64(uri: str) -> str:
+    qr = QRCode(version=VERSAO_QR, error_correction=ERROR_CORRECT_L, box_size=10, border=5,
+                image_factory=SvgPathImage, mask_pattern=MASCARA_QR)
+    qr.add_data(uri, optimize=0)
+    try:
+        qr.make(fit=False)
+    except DataOverflowError:
+        qr.make(fit=True)
+    return b64encode(qr.make_image().to_string()).decode('utf-8')
+
+
 class User(db.Model, TimestampMixin, BasicRepositoryMixin, UserMixin):
     __tablename__ = 'usuarios'
 
@@ -42,11 +68,6 @@ class User(db.Model, TimestampMixin, BasicRepositoryMixin, UserMixin):
 
     ativo: Mapped[Boolean] = mapped_column(Boolean, default=False)
 
-    dta_ultimo_acesso: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
-    dta_acesso_atual: Mapped[Optional[DateTime]] = mapped_column(DateTime, nullable=True)
-    ip_ultimo_acesso: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
-    ip_acesso_atual: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
-
     usa_2fa: Mapped[Boolean] = mapped_column(Boolean, default=False)
     otp_secret: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
     ultimo_otp: Mapped[Optional[str]] = mapped_column(String(6), nullable=True)
@@ -62,6 +83,17 @@ class User(db.Model, TimestampMixin, BasicRepositoryMixin, UserMixin):
                                                              back_populates='usuarios_no_papel',
                                                              cascade='all, delete')
 
+    # Papéis do cache de identidades, preenchidos pelo load_user. Não são colunas
+    papeis_em_cache = None
+    mascara_em_cache = None
+
+    @classmethod
+    def perfis_de_carga(cls):
+        return {
+            # Usuário autenticado: os papéis vêm na mesma ida ao banco
+            'identidade': [selectinload(cls.pertence_aos_papeis)],
+        }
+
     @property
     def is_active(self):
         return self.ativo
@@ -72,13 +104,8 @@ class User(db.Model, TimestampMixin, BasicRepositoryMixin, UserMixin):
 
     @property
     def get_b64encoded_qr_totp_uri(self) -> str:
-        qr = QRCode(version=1, box_size=10, border=5)
-        qr.add_data(self.get_totp_uri, optimize=0)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color='black', back_color='white')
-        buffered = BytesIO()
-        img.save(buffered)
-        return b64encode(buffered.getvalue()).decode('utf-8')
+        # SVG em base64; gerado uma vez por URI, isto é, até o segredo (ou o email) mudar
+        return _qr_svg_b64(self.get_totp_uri)
 
     @property
     def email(self) -> str:
@@ -90,12 +117,31 @@ class User(db.Model, TimestampMixin, BasicRepositoryMixin, UserMixin):
         self.email_normalizado = email_validator.validate_email(value, check_deliverability=False).normalized.lower()
 
     @property
-    def nomes_dos_papeis(self) -> list[str]:
-        r = list()
+    def papeis(self) -> frozenset[str]:
+        if self.papeis_em_cache is not None:
+            return self.papeis_em_cache
+        return frozenset(papel.nome for papel in self.pertence_aos_papeis)
+
+    @property
+    def mascara_de_papeis(self) -> int:
+        # Um bit (Role.bit) para cada papel do usuário
+        if self.mascara_em_cache is not None:
+            return self.mascara_em_cache
+        mascara = 0
         for papel in self.pertence_aos_papeis:
-            r.append(papel.nome)
-        r.sort()
-        return r
+            if papel.bit is not None:
+                mascara |= 1 << papel.bit
+        return mascara
+
+    @property
+    def dta_ultimo_acesso(self):
+        # Acesso anterior ao atual, do registro de acessos
+        acessos = registro_de_acessos.ultimos(self.id, 2)
+        return acessos[1].dta_acesso if len(acessos) > 1 else None
+
+    @property
+    def nomes_dos_papeis(self) -> list[str]:
+        return sorted(self.papeis)
 
     @classmethod
     def get_by_email(cls, user_email) -> Self | None:
@@ -104,24 +150,15 @@ class User(db.Model, TimestampMixin, BasicRepositoryMixin, UserMixin):
 
     @property
     def get_totp_uri(self) -> str:
-        otp = pyotp.totp.TOTP(self.otp_secret)
-        return otp.provisioning_uri(name=self.email, issuer_name=current_app.config.get('APP_NAME'))
+        return _totp(self.otp_secret).provisioning_uri(name=self.email, issuer_name=current_app.config.get('APP_NAME'))
 
     @staticmethod
-    def verify_jwt_token(token):
-        try:
-            payload = jwt.decode(token,
-                                 key=current_app.config.get('SECRET_KEY'),
-                                 algorithms=['HS256'],
-                                 leeway=datetime.timedelta(seconds=10))
-        except jwt.exceptions.PyJWTError as e:
-            current_app.logger.error(f"JWT Token validation: {e}")
+    def verify_jwt_token(token, action: str) -> tuple[Self | None, TokenValido | None]:
+        # Tokens inválidos ou já consumidos são recusados antes de qualquer consulta ao banco
+        dados = tokens.verifica(token, action)
+        if dados is None:
             return None, None
-        else:
-            user_id = uuid.UUID(payload.get('user', None))
-            action = payload.get('action', None)
-
-        return User.get_by_id(user_id), action
+        return User.get_by_id(uuid.UUID(dados.usuario)), dados
 
     def url_gravatar(self, size: int = 32) -> str:
         digest = md5(self.email.lower().encode('utf-8')).hexdigest()
@@ -129,80 +166,71 @@ class User(db.Model, TimestampMixin, BasicRepositoryMixin, UserMixin):
 
     def set_password(self, password):
         # noinspection PyTypeChecker
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hashing.gera(password)
 
     def check_password(self, password) -> bool:
-        return check_password_hash(self.password_hash, password)
+        return hashing.verifica(self.password_hash, password)
 
     def create_jwt_token(self, action: str, expires_in: int = 600):
-        payload = {
-            'user': str(self.id),
-            'action': action.lower(),
-            'exp': time() + expires_in
-        }
-        return jwt.encode(payload=payload,
-                          key=current_app.config.get('SECRET_KEY'),
-                          algorithm='HS256')
+        return tokens.gera(str(self.id), action, expires_in)
 
     def verify_totp(self, token) -> bool:
-        totp = pyotp.TOTP(self.otp_secret)
-        return totp.verify(token, valid_window=1)
+        return _totp(self.otp_secret).verify(token, valid_window=1)
 
     def generate_2fa_backup(self, quantos: int = 5) -> list[str]:
         # Remove os codigos anteriores
         for codigo in self.lista_2fa_backup:
             db.session.delete(codigo)
-        # Gera novos códigos
+        # Gera novos códigos, com os hashes calculados em paralelo
         codigos = []
         for _ in range(quantos):
             codigo = "".join(random.choice('ABCDEFGHJKLMNPQRSTUVWXYZ23456789') for _ in range(6))
             codigos.append(codigo)
+        for codigo, hash_codigo in zip(codigos, hashing.gera_varios(codigos)):
             backup2fa = Backup2FA()
-            backup2fa.hash_codigo = generate_password_hash(codigo)
+            backup2fa.hash_codigo = hash_codigo
+            backup2fa.chave_busca = self.chave_de_busca_do_backup(codigo)
             self.lista_2fa_backup.append(backup2fa)
         return codigos
 
+    def chave_de_busca_do_backup(self, codigo: str) -> str:
+        # HMAC do código, para localizar o registro sem testar o hash lento de cada um
+        return hmac.new(current_app.config.get('SECRET_KEY').encode('utf-8'),
+                        f"{self.id}:{codigo}".encode('utf-8'),
+                        hashlib.sha256).hexdigest()
+
     def verify_totp_backup(self, token) -> bool:
-        for codigo in self.lista_2fa_backup:
-            if check_password_hash(codigo.hash_codigo, token):
+        candidato = db.session.execute(select(Backup2FA).
+                                       where(Backup2FA.usuario_id == self.id,
+                                             Backup2FA.chave_busca == self.chave_de_busca_do_backup(token)).
+                                       limit(1)).scalar_one_or_none()
+        if candidato is not None:
+            candidatos = [candidato]
+        else:
+            # Códigos gerados antes da chave de busca
+            candidatos = [codigo for codigo in self.lista_2fa_backup if codigo.chave_busca is None]
+        for codigo in candidatos:
+            if hashing.verifica(codigo.hash_codigo, token):
                 db.session.delete(codigo)
                 return True
         return False
 
-    def send_email(self, subject: str = "Mensagem do sistema", body: str = "") -> bool:
-        msg = EmailMessage()
-        msg.to = [self.email]
-        msg.subject = f"[{current_app.config.get('APP_NAME')}] {subject}"
-        msg.body = body
-        msg.extra_headers['Message-ID'] = f"{str(uuid.uuid4())}@{current_app.config.get('APP_MTA_MESSAGEID')}"
-        try:
-            msg.send()
-        except smtplib.SMTPException:
-            return False
-        else:
-            return True
+    def send_email(self, subject: str = "Mensagem do sistema", body: str = "") -> None:
+        # A mensagem vai para a caixa de saída na transação atual, e é enviada
+        # em segundo plano depois do commit; falhas no envio ficam registradas
+        # na própria mensagem (flask auth caixa-de-saida)
+        caixa_de_saida.enfileira(destinatarios=[self.email],
+                                 assunto=f"[{current_app.config.get('APP_NAME')}] {subject}",
+                                 corpo=body,
+                                 message_id=f"{str(uuid.uuid4())}@{current_app.config.get('APP_MTA_MESSAGEID')}",
+                                 usuario_id=self.id)
 
     # Based on Flask-user/flask_user/user_mixin.py#L59
-    def tem_papeis(self, *papeis_necessarios):
+    def tem_papeis(self, *papeis_necessarios) -> bool:
         # tem_papeis('a', ('b', 'c'), d)
         # traduz para:
         # usuario tem papel 'a' AND (papel 'b' OR papel 'c') AND papel 'd'
-        papeis_do_usuario = self.nomes_dos_papeis
-        for papel in papeis_necessarios:
-            if isinstance(papel, (list, tuple)):
-                tupla_de_nomes_de_papel = papel
-                autorizado = False
-                for nome_de_papel in tupla_de_nomes_de_papel:
-                    if nome_de_papel in papeis_do_usuario:
-                        autorizado = True
-                        break
-                if not autorizado:
-                    return False
-            else:
-                nome_de_papel = papeis_necessarios
-                if nome_de_papel not in papeis_do_usuario:
-                    return False
-        return True
+        return compila_requisito(*papeis_necessarios).atendido_por(self.mascara_de_papeis)
 
 
 class Backup2FA(db.Model):
@@ -210,6 +238,9 @@ class Backup2FA(db.Model):
 
     id: Mapped[Integer] = mapped_column(Integer, primary_key=True)
     hash_codigo: Mapped[str] = mapped_column(String(256), nullable=False)
+    # Nula nos códigos gerados antes da coluna existir: ela é o HMAC do código em
+    # claro, que não é guardado, e por isso não pode ser preenchida depois
+    chave_busca: Mapped[Optional[str]] = mapped_column(String(64), nullable=True, index=True)
     usuario_id: Mapped[Uuid] = mapped_column(Uuid(as_uuid=True), ForeignKey('usuarios.id'))
 
     usuario = relationship('User',  # Type: Mapped[User]
@@ -221,6 +252,8 @@ class Role(db.Model, BasicRepositoryMixin):
 
     id: Mapped[Uuid] = mapped_column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
     nome: Mapped[str] = mapped_column(String(60), nullable=False, unique=True, index=True)
+    # Posição do papel nas máscaras de bits dos usuários. Uma vez atribuída, não muda
+    bit: Mapped[Optional[int]] = mapped_column(Integer, nullable=True, unique=True)
 
     usuarios_no_papel: Mapped[List['User']] = relationship(secondary=users_roles,  # Type:
                                                            lazy='select',
@@ -230,3 +263,65 @@ class Role(db.Model, BasicRepositoryMixin):
     def __init__(self, _nome: str):
         # noinspection PyTypeChecker
         self.nome = _nome
+
+    @classmethod
+    def mapa_de_bits(cls) -> dict[str, int]:
+        return {nome: bit for nome, bit in db.session.execute(select(cls.nome, cls.bit).
+                                                              where(cls.bit.is_not(None)))}
+
+    @classmethod
+    def atribui_bits(cls, conexao: sa.Connection | None = None) -> int:
+        """
+        Atribui bits aos papéis que ainda não têm um, depois do maior já usado.
+        Sem conexao, usa a sessão e faz o commit
+        """
+        executa = db.session.execute if conexao is None else conexao.execute
+        maior = executa(select(db.func.max(cls.bit))).scalar_one_or_none()
+        proximo = -1 if maior is None else maior
+        novos = executa(select(cls.id).where(cls.bit.is_(None)).order_by(cls.nome)).scalars().all()
+        for papel_id in novos:
+            proximo += 1
+            executa(sa.update(cls).where(cls.id == papel_id).values(bit=proximo))
+        if novos:
+            if conexao is None:
+                db.session.commit()
+            papeis_alterados()
+        return len(novos)
+
+
+@event.listens_for(Role, 'after_insert')
+@event.listens_for(Role, 'after_update')
+@event.listens_for(Role, 'after_delete')
+def _papel_alterado(_mapper, _connection, _papel):
+    papeis_alterados()
+
+
+identidades.observa(User)
+identidades.observa(Role, invalida_tudo=True)
+
+
+@esquema.passo('roles.bit: índice único e bits dos papéis existentes')
+def _atualiza_bits_dos_papeis(conexao: sa.Connection) -> bool:
+    # A coluna acrescentada pelo ALTER TABLE não tem a restrição UNIQUE do modelo
+    inspetor = sa.inspect(conexao)
+    unicas = [restricao['column_names'] for restricao in inspetor.get_unique_constraints('roles')]
+    unicas += [indice['column_names'] for indice in inspetor.get_indexes('roles') if indice['unique']]
+    alterou = False
+    if ['bit'] not in unicas:
+        conexao.exec_driver_sql("CREATE UNIQUE INDEX uq_roles_bit ON roles (bit)")
+        alterou = True
+    return Role.atribui_bits(conexao) > 0 or alterou
+
+
+@esquema.passo('backup2fa.chave_busca: códigos sem chave de busca')
+def _relata_codigos_sem_chave(conexao: sa.Connection) -> bool:
+    # Sem preenchimento possível (ver Backup2FA.chave_busca); os códigos antigos
+    # continuam válidos pelo caminho lento de verify_totp_backup até serem usados
+    # ou regerados
+    quantidade = conexao.execute(select(db.func.count()).
+                                 select_from(Backup2FA).
+                                 where(Backup2FA.chave_busca.is_(None))).scalar_one()
+    if quantidade:
+        current_app.logger.warning(f"{quantidade} códigos de backup 2FA sem chave de busca, verificados pelo "
+                                   f"hash de cada código até que o usuário gere novos códigos")
+    return False
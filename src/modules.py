@@ -6,6 +6,22 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import CSRFProtect
 from sqlalchemy.orm import DeclarativeBase
 
+from src.services.blobstore import BlobStore
+from src.services.busca import IndiceDeBusca
+from src.services.caixa_de_saida import CaixaDeSaida
+from src.services.esquema import AtualizadorDeEsquema
+from src.services.hashing import ServicoDeHash
+from src.services.identidades import CacheDeIdentidades
+from src.services.limites import LimitadorDeTaxa
+from src.services.perfil_sqlite import PerfilSQLite
+from src.services.registro_de_acessos import RegistroDeAcessos
+from src.services.relatorios import RelatoriosEmCache
+from src.services.replicas import RoteadorDeReplicas, SessaoRoteada
+from src.services.tarefas import GerenciadorDeTarefas
+from src.services.thumbnail_cache import ThumbnailCache
+from src.services.tokens import ServicoDeTokens
+from src.services.versoes import VersoesDeDados
+
 
 class Base(DeclarativeBase):
     # Se houver atributo comum a todas as classes, pode adicionar aqui,
@@ -15,7 +31,22 @@ class Base(DeclarativeBase):
 
 minify = Minify()
 bootstrap = Bootstrap5()
-db = SQLAlchemy(model_class=Base, disable_autonaming=True)
+db = SQLAlchemy(model_class=Base, disable_autonaming=True, session_options={'class_': SessaoRoteada})
+perfil_sqlite = PerfilSQLite()
+replicas = RoteadorDeReplicas()
+esquema = AtualizadorDeEsquema()
 csrf = CSRFProtect()
 login = LoginManager()
 mail = Mail()
+blobstore = BlobStore()
+busca = IndiceDeBusca()
+identidades = CacheDeIdentidades()
+hashing = ServicoDeHash()
+caixa_de_saida = CaixaDeSaida()
+registro_de_acessos = RegistroDeAcessos()
+limites = LimitadorDeTaxa()
+tarefas = GerenciadorDeTarefas()
+thumbnail_cache = ThumbnailCache()
+versoes = VersoesDeDados()
+relatorios = RelatoriosEmCache()
+tokens = ServicoDeTokens()
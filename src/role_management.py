@@ -1,10 +1,87 @@
-from functools import wraps
+import threading
+from functools import wraps, lru_cache
 
 from flask import current_app, flash, redirect, url_for, request
 from flask_login import current_user
 
+# Incrementada sempre que algum papel é criado, alterado ou removido, para
+# que os requisitos já resolvidos voltem a consultar as posições dos bits
+_versao_dos_papeis = 0
+_lock = threading.Lock()
+
+
+def papeis_alterados() -> None:
+    global _versao_dos_papeis
+    with _lock:
+        _versao_dos_papeis += 1
+
+
+class RequisitoDePapeis:
+    """
+    Requisito de papéis compilado. RequisitoDePapeis('a', ('b', 'c'), 'd')
+    exige o papel 'a' E ('b' OU 'c') E 'd'. Os nomes são traduzidos uma única
+    vez para máscaras de bits (Role.bit), e a verificação passa a ser feita
+    com operações sobre inteiros
+    """
+
+    def __init__(self, *papeis_necessarios):
+        clausulas = list()
+        for papel in papeis_necessarios:
+            if isinstance(papel, (list, tuple, set, frozenset)):
+                clausulas.append(frozenset(papel))
+            else:
+                clausulas.append(frozenset((papel,)))
+        self.clausulas: tuple[frozenset[str], ...] = tuple(clausulas)
+        self._versao = -1
+        self._obrigatorios = 0
+        self._alternativas: tuple[int, ...] = ()
+        self._impossivel = False
+
+    def _resolve(self) -> None:
+        from src.models.usuario import Role
+        versao = _versao_dos_papeis
+        bits = Role.mapa_de_bits()
+        obrigatorios, alternativas, impossivel = 0, list(), False
+        for clausula in self.clausulas:
+            mascara = 0
+            for nome in clausula:
+                if nome in bits:
+                    mascara |= 1 << bits[nome]
+            if mascara == 0:
+                # Nenhum dos papéis da cláusula existe (ou tem bit): ninguém atende
+                impossivel = True
+            elif len(clausula) == 1:
+                obrigatorios |= mascara
+            else:
+                alternativas.append(mascara)
+        self._obrigatorios, self._alternativas, self._impossivel = obrigatorios, tuple(alternativas), impossivel
+        self._versao = versao
+
+    def atendido_por(self, mascara: int) -> bool:
+        if self._versao != _versao_dos_papeis:
+            self._resolve()
+        if self._impossivel or mascara & self._obrigatorios != self._obrigatorios:
+            return False
+        for alternativa in self._alternativas:
+            if not mascara & alternativa:
+                return False
+        return True
+
+
+@lru_cache(maxsize=256)
+def _compila(*papeis_necessarios) -> RequisitoDePapeis:
+    return RequisitoDePapeis(*papeis_necessarios)
+
+
+def compila_requisito(*papeis_necessarios) -> RequisitoDePapeis:
+    # Requisitos iguais compartilham a mesma compilação
+    return _compila(*(tuple(sorted(papel)) if isinstance(papel, (list, tuple, set, frozenset)) else papel
+                      for papel in papeis_necessarios))
+
 
 def papeis_aceitos(*nomes_de_papeis):
+    requisito = compila_requisito(*nomes_de_papeis)
+
     def wrapper(funcao_de_view):
         @wraps(funcao_de_view)
         def decorator(*args, **kwargs):
@@ -12,10 +89,10 @@ def papeis_aceitos(*nomes_de_papeis):
             if not current_user.is_authenticated:
                 flash(login.login_message, category=login.login_message_category)
                 return redirect(url_for(login.login_view))
-            if not current_user.tem_papeis(nomes_de_papeis):
+            if not requisito.atendido_por(current_user.mascara_de_papeis):
                 flash("Sem autorização para utilizar essa funcionalidade", category='warning')
                 current_app.logger.debug(f"user: {current_user.email}, acesso não autorizado")
-                return redirect(request.referrer if request.referrer else url_for('/'))
+                return redirect(request.referrer if request.referrer else url_for('index'))
 
             return funcao_de_view(*args, **kwargs)
 
@@ -1,5 +1,6 @@
 from urllib.parse import urlsplit
 
+import click
 import pyotp
 from flask import redirect, url_for, flash, request, render_template, Blueprint, current_app
 from flask_login import current_user, login_user, login_required, logout_user
@@ -9,24 +10,28 @@ from src import utils
 from src.forms.auth import LoginForm, SetNewPasswordForm, AskToResetPassword, RegistrationForm, ProfileForm, \
     Read2FACodeForm
 from src.models.usuario import User, Role
-from src.modules import db
+from src.modules import db, caixa_de_saida, limites, tokens, replicas, registro_de_acessos
 from src.role_management import papeis_aceitos
 
 bp = Blueprint('auth', __name__, url_prefix='/admin/user')
 
 
 @bp.route('/login', methods=['GET', 'POST'])
+@limites.limita('login_ip')
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
     form = LoginForm()
     if form.validate_on_submit():
+        # Só as tentativas erradas gastam fichas, e o balde é do par (IP, email):
+        # quem conhece o email de um usuário não consegue bloqueá-lo de outro IP.
+        # A verificação vem antes do hash da senha, que é propositalmente caro
+        chave = f"{request.remote_addr}|{form.email.data.strip().lower()}"
+        limites.verifica('login_email', chave, consome=False)
         usuario = User.get_by_email(form.email.data)
 
-        if usuario is None:
-            flash("Email ou senha incorretos", category='warning')
-            return redirect(url_for('auth.login'))
-        if not usuario.check_password(form.password.data):
+        if usuario is None or not usuario.check_password(form.password.data):
+            limites.consome('login_email', chave)
             flash("Email ou senha incorretos", category='warning')
             return redirect(url_for('auth.login'))
         if not usuario.ativo:
@@ -42,7 +47,6 @@ def login():
             return redirect(url_for('auth.get2fa', user_id=usuario.id, remember_me=bool(form.remember_me.data),
                                     next=request.args.get('next')))
         login_user(usuario, remember=form.remember_me.data)
-        db.session.commit()
         next_page = request.args.get('next')
         if not next_page or urlsplit(next_page).netloc != '':
             next_page = url_for('index')
@@ -64,26 +68,30 @@ def logout():
 def reset_password(token):
     if current_user.is_authenticated:
         return redirect(url_for('index'))
-    usuario, action = User.verify_jwt_token(token)
+    usuario, dados = User.verify_jwt_token(token, 'reset_password')
+    if dados is None:
+        flash("Token inválido", category='warning')
+        return redirect(url_for('index'))
     if usuario is None:
         flash("Usuário inválido", category='warning')
         return redirect(url_for('index'))
-    if action == 'reset_password':
-        form = SetNewPasswordForm()
-        if form.validate_on_submit():
-            usuario.set_password(form.password.data)
-            db.session.commit()
-            flash("Sua senha foi redefinida!", category='success')
-            return redirect(url_for('auth.login'))
-        return render_template('render_simple_slim_form.jinja',
-                               title='Escolha uma nova senha',
-                               form=form)
-    else:
-        flash("Token inválido", category='warning')
-        return redirect(url_for('index'))
+    form = SetNewPasswordForm()
+    if form.validate_on_submit():
+        # O token só é consumido quando a senha é efetivamente trocada
+        if not tokens.consome(dados):
+            flash("Token inválido", category='warning')
+            return redirect(url_for('index'))
+        usuario.set_password(form.password.data)
+        db.session.commit()
+        flash("Sua senha foi redefinida!", category='success')
+        return redirect(url_for('auth.login'))
+    return render_template('render_simple_slim_form.jinja',
+                           title='Escolha uma nova senha',
+                           form=form)
 
 
 @bp.route('/new_password/', methods=['GET', 'POST'])
+@limites.limita('new_password_ip')
 def new_password():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -91,6 +99,7 @@ def new_password():
     form = AskToResetPassword()
     if form.validate_on_submit():
         email = form.email.data
+        limites.verifica('new_password_email', email.strip().lower())
         usuario = User.get_by_email(email)
         flash(f"Se houver uma conta com o email {email}, uma mensagems será enviada "
               f"com as instruções para redefinir a senha", category='success')
@@ -99,8 +108,8 @@ def new_password():
                                    user=usuario,
                                    token=usuario.create_jwt_token('reset_password'),
                                    host=current_app.config.get('APP_BASE_URL'))
-            if not usuario.send_email(subject="Altere a sua senha", body=body):
-                current_app.logger.warning(f"Email de reset de senha para o usuario {str(usuario.id)} não enviado")
+            usuario.send_email(subject="Altere a sua senha", body=body)
+            db.session.commit()
             return redirect(url_for('auth.login'))
         else:
             current_app.logger.info(f"Pedido de reset de senha para usuario inexistente ({email})")
@@ -129,8 +138,7 @@ def register():
                                user=usuario,
                                token=usuario.create_jwt_token('validate_email'),
                                host=current_app.config.get('APP_BASE_URL'))
-        if not usuario.send_email(subject="Ative a sua conta", body=body):
-            current_app.logger.warning(f"Email de ativação para para o usuario {str(usuario.id)} não enviado")
+        usuario.send_email(subject="Ative a sua conta", body=body)
         db.session.commit()
         flash("Cadastro efetuado com sucesso. Confirme seu email antes de logar no sistema", category='success')
         return redirect(url_for('auth.login'))
@@ -143,8 +151,8 @@ def register():
 def valida_email(token):
     if current_user.is_authenticated:
         return redirect(url_for('index'))
-    usuario, action = User.verify_jwt_token(token)
-    if usuario and not usuario.email_validado and action == 'validate_email':
+    usuario, dados = User.verify_jwt_token(token, 'validate_email')
+    if usuario and not usuario.email_validado and tokens.consome(dados):
         usuario.email_validado = True
         usuario.dta_validacao_email = utils.timestamp()
         flash(f"Email {usuario.email} validado!", category='success')
@@ -178,10 +186,7 @@ def user():
                     flash("Códigos de autenticação reservas foram removidos", category='info')
                 body = render_template('auth/email/disable_2fa-email.jinja',
                                        user=current_user)
-                if not current_user.send_email(subject="Desativacao do segundo fator de autenticacao", body=body):
-                    current_app.logger.warning(
-                        f"Email de desativação do 2FA para o usuario "
-                        f"{str(current_user.id)} não enviado")
+                current_user.send_email(subject="Desativacao do segundo fator de autenticacao", body=body)
         db.session.commit()
         flash(message="Alterações efetuadas", category='success')
         return redirect(url_for('auth.user'))
@@ -229,6 +234,8 @@ def enable_2fa():
 
 
 @bp.route('/get2fa/<uuid:user_id>', methods=['GET', 'POST'])
+@limites.limita('get2fa_ip')
+@limites.limita('get2fa_usuario', chave=lambda user_id: str(user_id))
 def get2fa(user_id):
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -260,9 +267,15 @@ def get2fa(user_id):
 @bp.route('/management')
 @login_required
 @papeis_aceitos('Admin')
+@replicas.somente_leitura
 def management():
-    sentenca = db.select(User).order_by(User.nome)
-    usuarios = db.session.execute(sentenca).scalars()
+    acessos = registro_de_acessos.resumo()
+    sentenca = db.select(User, acessos.c.dta_atual, acessos.c.ip_atual, acessos.c.dta_anterior,
+                         acessos.c.ip_anterior). \
+        outerjoin(acessos, acessos.c.usuario_id == User.id). \
+        options(*User.opcoes_de_carga('identidade')). \
+        order_by(User.nome)
+    usuarios = db.session.execute(sentenca).all()
 
     return render_template('auth/management/lista.jinja',
                            title="Gerenciamento de usuários",
@@ -297,6 +310,8 @@ def flip_email(user_id):
 
 
 @bp.route('/revalida_email/<uuid:user_id>')
+@limites.limita('revalida_email_ip', metodos=('GET',))
+@limites.limita('revalida_email_usuario', chave=lambda user_id: str(user_id), metodos=('GET',))
 def revalida_email(user_id):
     usuario = User.get_by_id(user_id)
     if usuario:
@@ -304,10 +319,9 @@ def revalida_email(user_id):
                                user=usuario,
                                token=usuario.create_jwt_token('validate_email'),
                                host=current_app.config.get('APP_BASE_URL'))
-        if not usuario.send_email(subject="Revalide o seu email", body=body):
-            current_app.logger.warning(f"Email de revalidação para o usuario {str(usuario.id)} não enviado")
-        else:
-            flash("Mensagem para validação de e-mail enviada", category='info')
+        usuario.send_email(subject="Revalide o seu email", body=body)
+        flash("Mensagem para validação de e-mail enviada", category='info')
+        db.session.commit()
     next_page = request.args.get('next')
     if not next_page or urlsplit(next_page).netloc != '':
         next_page = url_for('index')
@@ -329,9 +343,18 @@ def disable_2fa(user_id):
                 db.session.delete(codigo)
         body = render_template('auth/email/disable_2fa-email.jinja',
                                user=usuario)
-        if not usuario.send_email(subject="Desativacao do segundo fator de autenticacao", body=body):
-            current_app.logger.warning(f"Email de desativação do 2FA para o usuario {str(usuario.id)} não enviado")
-        else:
-            flash(f"Segundo fator de autenticação desativado para o usuário {usuario.email}", category='info')
+        usuario.send_email(subject="Desativacao do segundo fator de autenticacao", body=body)
+        flash(f"Segundo fator de autenticação desativado para o usuário {usuario.email}", category='info')
         db.session.commit()
     return redirect(url_for('auth.management'))
+
+
+@bp.cli.command('caixa-de-saida')
+@click.option('--despacha', is_flag=True, help="Envia agora as mensagens pendentes")
+def situacao_da_caixa_de_saida(despacha: bool):
+    """Mostra a situação dos emails da caixa de saída"""
+    if despacha:
+        while (enviadas := caixa_de_saida.despacha()) > 0:
+            click.echo(f"{enviadas} mensagens processadas")
+    for situacao, quantidade in sorted(caixa_de_saida.situacao().items()):
+        click.echo(f"{situacao}: {quantidade}")
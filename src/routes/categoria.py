@@ -4,14 +4,16 @@ from flask_login import login_required
 
 from src.forms.categoria import NovoCategoriaForm, EditCategoriaForm
 from src.models.categoria import Categoria
-from src.modules import db
+from src.modules import db, busca, replicas
 from src.role_management import papeis_aceitos
+from src.services.paginacao import pagina_por_cursor, CursorInvalido
 
 bp = Blueprint('categoria', __name__, url_prefix='/admin/categoria')
 
 
 @bp.route('/', methods=['GET'])
 @login_required
+@replicas.somente_leitura
 def lista():
     # noinspection PyPep8Naming
     MAXPERPAGE = int(current_app.config.get('MAX_PER_PAGE', 500))
@@ -19,31 +21,46 @@ def lista():
     page = request.args.get('page', default=1, type=int)
     pp = request.args.get('pp', default=10, type=int)
     q = request.args.get('q', default="", type=str)
+    modo = request.args.get('modo', default='pagina', type=str)
+    cursor = request.args.get('cursor', default=None, type=str)
 
-    sentenca = db.select(Categoria)
+    sentenca = Categoria.seleciona_com_contagem()
 
-    if pp > MAXPERPAGE:
-        pp = MAXPERPAGE
+    # pp zero ou negativo viraria LIMIT negativo, que no SQLite significa "sem limite"
+    pp = min(max(pp, 1), MAXPERPAGE)
 
-    # Filtrar por parte do nome
+    # Filtrar por parte do nome, ordenando pela relevância quando houver índice de busca
+    relevancia = None
     if q != "":
-        sentenca = sentenca.filter(Categoria.nome.ilike(f"%{q}%"))
-
-    sentenca = sentenca.order_by(Categoria.nome)
-
-    try:
-        rset_page = db.paginate(sentenca, page=page, per_page=pp, max_per_page=MAXPERPAGE, error_out=True)
-    except werkzeug.exceptions.NotFound as e:
-        current_app.logger.warning(f"Exception: {e}")
-        page = 1
-        flash("Não existem registros na página solicitada. Apresentando primeira página", category='info')
-        rset_page = db.paginate(sentenca, page=page, per_page=pp, max_per_page=MAXPERPAGE, error_out=True)
+        sentenca, relevancia = busca.filtra(sentenca, Categoria, q)
+
+    if modo == 'cursor':
+        contar_total = bool(current_app.config.get('PAGINACAO_CURSOR_TOTAL', True))
+        try:
+            rset_page = pagina_por_cursor(sentenca, (Categoria.nome, Categoria.id), cursor, pp, contar_total)
+        except CursorInvalido as e:
+            current_app.logger.warning(f"Exception: {e}")
+            flash("Posição de navegação inválida. Apresentando primeira página", category='info')
+            rset_page = pagina_por_cursor(sentenca, (Categoria.nome, Categoria.id), None, pp, contar_total)
+    else:
+        modo = 'pagina'
+        if relevancia is not None:
+            sentenca = sentenca.order_by(relevancia)
+        sentenca = sentenca.order_by(Categoria.nome, Categoria.id)
+        try:
+            rset_page = db.paginate(sentenca, page=page, per_page=pp, max_per_page=MAXPERPAGE, error_out=True)
+        except werkzeug.exceptions.NotFound as e:
+            current_app.logger.warning(f"Exception: {e}")
+            page = 1
+            flash("Não existem registros na página solicitada. Apresentando primeira página", category='info')
+            rset_page = db.paginate(sentenca, page=page, per_page=pp, max_per_page=MAXPERPAGE, error_out=True)
 
     return render_template('categoria/lista.jinja',
                            rset_page=rset_page,
                            page=page,
                            pp=pp,
                            q=q,
+                           modo=modo,
                            title="Lista de categorias")
 
 
@@ -1,23 +1,33 @@
-import json
+import csv
+import itertools
 import uuid
 
+import click
+
 from werkzeug.exceptions import NotFound
-from base64 import b64encode
 
-from flask import Blueprint, render_template, flash, redirect, url_for, request, Response, current_app, abort
-from flask_login import login_required
+from flask import Blueprint, render_template, flash, redirect, url_for, request, Response, current_app, abort, \
+    send_file, stream_with_context, jsonify
+from flask_login import login_required, current_user
 
 from src.role_management import papeis_aceitos
 from src.forms.produto import NovoProdutoForm, EditProdutoForm, CompraVendaProdutoForm
 from src.models.produto import Produto
 from src.models.categoria import Categoria
-from src.modules import db
+from src.modules import db, thumbnail_cache, busca, tarefas, versoes, relatorios, blobstore, replicas
+from src.services import exportacao
+from src.services.pdf import Coluna, gera_tabela_pdf
+from src.services.compravenda import executa_compravenda
+from src.services.fotos import processa_foto
+from src.services.imagens import identifica, ImagemInvalida
+from src.services.paginacao import pagina_por_cursor, CursorInvalido
 
 bp = Blueprint('produto', __name__, url_prefix='/admin/produto')
 
 
 @bp.route('/', methods=['GET'])
 @login_required
+@replicas.somente_leitura
 def lista():
     # noinspection PyPep8Naming
     MAXPERPAGE = int(current_app.config.get('MAX_PER_PAGE', 500))
@@ -25,17 +35,20 @@ def lista():
     page = request.args.get('page', default=1, type=int)
     pp = request.args.get('pp', default=10, type=int)
     q = request.args.get('q', default="", type=str)
+    modo = request.args.get('modo', default='pagina', type=str)
+    cursor = request.args.get('cursor', default=None, type=str)
     a = request.args.get('a', default='off', type=str)
     c = request.args.get('c', default="", type=str)
 
-    sentenca = db.select(Produto)
+    sentenca = Produto.seleciona('listagem')
 
-    if pp > MAXPERPAGE:
-        pp = MAXPERPAGE
+    # pp zero ou negativo viraria LIMIT negativo, que no SQLite significa "sem limite"
+    pp = min(max(pp, 1), MAXPERPAGE)
 
-    # Filtrar por parte do nome
+    # Filtrar por parte do nome, ordenando pela relevância quando houver índice de busca
+    relevancia = None
     if q != "":
-        sentenca = sentenca.filter(Produto.nome.ilike(f"%{q}%"))
+        sentenca, relevancia = busca.filtra(sentenca, Produto, q)
 
     # Filtrar por categoria
     if c != "":
@@ -58,27 +71,64 @@ def lista():
         if a == 'on':
             sentenca = sentenca.filter_by(ativo=0)
 
-    sentenca = sentenca.order_by(Produto.nome)
-
-    try:
-        rset_page = db.paginate(sentenca, page=page, per_page=pp, max_per_page=MAXPERPAGE, error_out=True)
-    except NotFound as e:
-        current_app.logger.warning(f"Exception: {e}")
-        page = 1
-        flash("Não existem registros na página solicitada. Apresentando primeira página", category='info')
-        rset_page = db.paginate(sentenca, page=page, per_page=pp, max_per_page=MAXPERPAGE, error_out=True)
+    if modo == 'cursor':
+        contar_total = bool(current_app.config.get('PAGINACAO_CURSOR_TOTAL', True))
+        try:
+            rset_page = pagina_por_cursor(sentenca, (Produto.nome, Produto.id), cursor, pp, contar_total)
+        except CursorInvalido as e:
+            current_app.logger.warning(f"Exception: {e}")
+            flash("Posição de navegação inválida. Apresentando primeira página", category='info')
+            rset_page = pagina_por_cursor(sentenca, (Produto.nome, Produto.id), None, pp, contar_total)
+    else:
+        modo = 'pagina'
+        if relevancia is not None:
+            sentenca = sentenca.order_by(relevancia)
+        sentenca = sentenca.order_by(Produto.nome, Produto.id)
+        try:
+            rset_page = db.paginate(sentenca, page=page, per_page=pp, max_per_page=MAXPERPAGE, error_out=True)
+        except NotFound as e:
+            current_app.logger.warning(f"Exception: {e}")
+            page = 1
+            flash("Não existem registros na página solicitada. Apresentando primeira página", category='info')
+            rset_page = db.paginate(sentenca, page=page, per_page=pp, max_per_page=MAXPERPAGE, error_out=True)
 
     return render_template('produto/lista.jinja',
                            rset_page=rset_page,
                            page=page,
                            pp=pp,
                            q=q,
+                           modo=modo,
                            c=str(c),
                            a=a,
                            categorias=Categoria.get_tuples_id_atributo(),
                            title="Lista de produtos")
 
 
+def _foto_valida(form) -> bool:
+    # Rejeita na própria requisição o que nem é uma imagem; a decodificação completa é feita em segundo plano
+    if not form.foto_raw.data:
+        return True
+    try:
+        identifica(request.files[form.foto_raw.name].stream)
+    except ImagemInvalida as e:
+        form.foto_raw.errors.append(str(e))
+        return False
+    return True
+
+
+def _submete_foto(produto: Produto, form) -> None:
+    arquivo = request.files[form.foto_raw.name]
+    sequencia = Produto.proxima_sequencia_de_foto(produto.id)
+    db.session.commit()
+    tarefa = tarefas.cria('foto', dono=str(current_user.id), produto=str(produto.id), arquivo=arquivo.filename,
+                          sequencia=sequencia)
+    arquivo.save(tarefa.arquivo('entrada'))
+    tarefas.submete(tarefa, processa_foto, produto.id, sequencia,
+                    dimensao_maxima=int(current_app.config.get('IMAGEM_DIMENSAO_MAXIMA', 1600)),
+                    formatos=current_app.config.get('IMAGEM_FORMATOS', ['AVIF', 'WEBP', 'JPEG']),
+                    qualidade=int(current_app.config.get('IMAGEM_QUALIDADE', 80)))
+
+
 @bp.route('/novo', methods=['GET', 'POST'])
 @login_required
 @papeis_aceitos('Admin')
@@ -98,23 +148,25 @@ def novo():
         if categoria is None:
             flash("Categoria inválida", category='info')
             return redirect(url_for('produto.lista'))
+        if not _foto_valida(form):
+            return render_template('render_simple_form.jinja',
+                                   title="Novo produto",
+                                   form=form)
 
         produto = Produto()
         produto.nome = form.nome.data
         produto.preco = form.preco.data
         produto.ativo = form.ativo.data
         produto.categoria = categoria
-        if form.foto_raw.data:
-            produto.possui_foto = True
-            produto.foto_base64 = b64encode(request.files[form.foto_raw.name].read()).decode('ascii')
-            produto.foto_mime = request.files[form.foto_raw.name].mimetype
-        else:
-            produto.possui_foto = False
-            produto.foto_base64 = None
-            produto.foto_mime = None
+        produto.define_foto(None, None)
         db.session.add(produto)
         db.session.commit()
-        flash(message=f"Produto \"{form.nome.data}\" adicionado", category='success')
+        if form.foto_raw.data:
+            _submete_foto(produto, form)
+            flash(message=f"Produto \"{form.nome.data}\" adicionado. A foto está sendo processada",
+                  category='success')
+        else:
+            flash(message=f"Produto \"{form.nome.data}\" adicionado", category='success')
         return redirect(url_for('produto.lista'))
     return render_template('render_simple_form.jinja',
                            title="Novo produto",
@@ -125,12 +177,12 @@ def novo():
 @login_required
 @papeis_aceitos('Admin')
 def edit(id_produto):
-    produto = Produto.get_by_id(id_produto)
+    produto = Produto.get_by_id(id_produto, perfil='detalhe')
     if produto is None:
         return redirect(url_for('produto.lista'))
 
     form = EditProdutoForm()
-    form.categoria.default = str(produto.categoria.id)
+    form.categoria.default = str(produto.categoria_id)
     form.categoria.choices = Categoria.get_tuples_id_atributo()
 
     if form.validate_on_submit():
@@ -139,24 +191,31 @@ def edit(id_produto):
             flash("Categoria inválida", category='info')
             return redirect(url_for('produto.lista'))
 
+        com_foto = bool(form.foto_raw.data) and not form.remover_imagem.data
+        if com_foto and not _foto_valida(form):
+            return render_template('produto/edit.jinja',
+                                   form=form,
+                                   produto=produto,
+                                   title="Alterar produto")
+
         produto.nome = form.nome.data
         produto.preco = form.preco.data
         produto.ativo = form.ativo.data
         produto.categoria = categoria
         if form.remover_imagem.data:
-            produto.possui_foto = False
-            produto.foto_base64 = None
-            produto.foto_mime = None
-        elif form.foto_raw.data:
-            produto.possui_foto = True
-            produto.foto_base64 = b64encode(request.files[form.foto_raw.name].read()).decode('ascii')
-            produto.foto_mime = request.files[form.foto_raw.name].mimetype
+            produto.define_foto(None, None)
+            # Envios ainda em processamento não devem trazer a foto de volta
+            Produto.proxima_sequencia_de_foto(produto.id)
         db.session.commit()
-        flash(message="Produto alterado!", category='success')
+        if form.remover_imagem.data:
+            thumbnail_cache.invalida(produto.id)
+        if com_foto:
+            _submete_foto(produto, form)
+            flash(message="Produto alterado! A foto está sendo processada", category='success')
+        else:
+            flash(message="Produto alterado!", category='success')
         return redirect(url_for('produto.lista'))
 
-    form.categoria.default = str(produto.categoria.id)
-    form.categoria.choices = Categoria.get_tuples_id_atributo()
     form.process()
     form.nome.data = produto.nome
     form.preco.data = produto.preco
@@ -172,13 +231,14 @@ def edit(id_produto):
 @login_required
 @papeis_aceitos('Admin')
 def remove(id_produto):
-    produto = Produto.get_by_id(id_produto)
+    produto = Produto.get_by_id(id_produto, perfil='listagem')
     if produto is None:
         return redirect(url_for('produto.lista'))
 
     if request.method == 'POST':  # confirmação da remoção
         db.session.delete(produto)
         db.session.commit()
+        thumbnail_cache.invalida(id_produto)
         flash(message="Produto removido!", category='success')
         return redirect(url_for('produto.lista'))
 
@@ -187,44 +247,132 @@ def remove(id_produto):
                            title="Remover produto")
 
 
+def _define_cache_da_imagem(resposta: Response, versionada: bool) -> Response:
+    # URLs com o segmento de versão nunca mudam de conteúdo; as demais são revalidadas
+    resposta.cache_control.private = True
+    if versionada:
+        resposta.cache_control.no_cache = None
+        resposta.cache_control.max_age = 365 * 24 * 3600
+        resposta.cache_control.immutable = True
+    else:
+        resposta.cache_control.no_cache = True
+    return resposta
+
+
 @bp.route('/<uuid:id_produto>/imagem', methods=['GET'])
+@bp.route('/<uuid:id_produto>/imagem/<versao>', methods=['GET'])
 @login_required
-def imagem(id_produto):
-    produto = Produto.get_by_id(id_produto)
+def imagem(id_produto, versao: str | None = None):
+    produto = Produto.get_by_id(id_produto, perfil='foto')
     if produto is None:
         return Response(status=404)
-    imagem_content, imagem_type = produto.imagem
-    return Response(imagem_content, mimetype=imagem_type)
+    if not produto.possui_foto or not produto.foto_mime:
+        return redirect(url_for('static', filename='img/sem-foto.png'))
+    if versao is not None and versao != produto.versao_da_foto:
+        return redirect(url_for('produto.imagem', id_produto=produto.id, versao=produto.versao_da_foto))
+
+    # Com o arquivo em disco, send_file trata If-None-Match, If-Modified-Since e Range sem ler a foto inteira
+    caminho = blobstore.caminho_local(produto.foto_hash) if produto.foto_hash else None
+    if caminho is not None:
+        resposta = send_file(caminho, mimetype=produto.foto_mime, etag=produto.foto_hash,
+                             last_modified=produto.dta_atualizacao, conditional=True)
+    else:
+        imagem_content, imagem_type = produto.imagem
+        if imagem_content is None:
+            return redirect(url_for('static', filename='img/sem-foto.png'))
+        resposta = Response(imagem_content, mimetype=imagem_type)
+        resposta.set_etag(produto.hash_da_foto)
+        resposta.last_modified = produto.dta_atualizacao
+        resposta.make_conditional(request, accept_ranges=True, complete_length=len(imagem_content))
+    return _define_cache_da_imagem(resposta, versao is not None)
 
 
 @bp.route('/<uuid:id_produto>/thumbnail', methods=['GET'])
 @bp.route('/<uuid:id_produto>/thumbnail/<int:max_size>', methods=['GET'])
+@bp.route('/<uuid:id_produto>/thumbnail/<int:max_size>/<versao>', methods=['GET'])
 @login_required
-def thumbnail(id_produto, max_size: int = 64):
-    produto = Produto.get_by_id(id_produto)
+def thumbnail(id_produto, max_size: int = 64, versao: str | None = None):
+    produto = Produto.get_by_id(id_produto, perfil='foto')
     if produto is None:
         return Response(status=404)
+    if versao is not None and versao != produto.versao_da_foto:
+        return redirect(url_for('produto.thumbnail', id_produto=produto.id, max_size=max_size,
+                                versao=produto.versao_da_foto))
+    foto_hash = produto.hash_da_foto if produto.possui_foto else None
+    if foto_hash is None:
+        return redirect(url_for('static', filename='img/sem-foto-thumbnail.png'))
+
+    # A miniatura é derivada da foto, então o hash da foto e o tamanho a identificam
+    etag = f"{foto_hash}-{min(max_size, 128)}"
+    if request.if_none_match.contains(etag):
+        resposta = Response(status=304)
+        resposta.set_etag(etag)
+        return _define_cache_da_imagem(resposta, versao is not None)
     imagem_content, imagem_type = produto.thumbnail(max_size=max_size)
-    return Response(imagem_content, mimetype=imagem_type)
+    if imagem_content is None:
+        return redirect(url_for('static', filename='img/sem-foto-thumbnail.png'))
+    resposta = Response(imagem_content, mimetype=imagem_type)
+    resposta.set_etag(etag)
+    resposta.last_modified = produto.dta_atualizacao
+    resposta.make_conditional(request)
+    return _define_cache_da_imagem(resposta, versao is not None)
 
 
 @bp.route('/em_falta', methods=['GET'])
 @login_required
+@replicas.somente_leitura
 def emfalta():
     pdf = True if request.args.get('pdf') else False
-    sentenca = db.select(Produto).where(Produto.estoque <= 0).order_by(Produto.estoque.asc())
-    rset = db.session.execute(sentenca).scalars()
-    if not rset:
+    if not Produto.quantidade_em_falta():
         flash("Não há produtos em falta", category="success")
         return redirect(url_for('produto.lista'))
     if pdf:
-        return render_template('produto/emfalta.jinja',
-                               title="Produtos em falta",
-                               rset=rset)
-    else:
-        return render_template('produto/emfalta.jinja',
-                               title="Produtos em falta",
-                               rset=rset)
+        # Gerado novamente apenas quando a lista de produtos em falta muda
+        return relatorios.envia('produtos_em_falta', versoes.marca('produtos_em_falta'), 'pdf',
+                                mimetype='application/pdf',
+                                download_name='produtos_em_falta.pdf',
+                                gerador=_gera_pdf_em_falta)
+    return render_template('produto/emfalta.jinja',
+                           title="Produtos em falta",
+                           rset=Produto.em_falta())
+
+
+def _gera_pdf_em_falta():
+    colunas = [Coluna("Nome", 235),
+               Coluna("Preço", 70, 'direita'),
+               Coluna("Estoque", 55, 'direita'),
+               Coluna("Ativo", 40, 'centro'),
+               Coluna("Categoria", 115)]
+    # Os produtos são lidos em lotes, à medida que as páginas são geradas
+    linhas = ((produto.nome,
+               f"R$ {produto.preco:.2f}",
+               str(produto.estoque),
+               "Sim" if produto.ativo else "Não",
+               produto.categoria_nome or "")
+              for produto in exportacao.linhas(Produto.seleciona_em_falta()))
+    return gera_tabela_pdf("Produtos em falta", colunas, linhas)
+
+
+@bp.route('/em_falta/json', methods=['GET'])
+@login_required
+@replicas.somente_leitura
+def emfalta_json():
+    retorno = list()
+    for produto in Produto.em_falta():
+        retorno.append({'id': str(produto.id),
+                        'nome': produto.nome,
+                        'preco': str(produto.preco),
+                        'estoque': produto.estoque,
+                        'ativo': produto.ativo,
+                        'categoria': produto.categoria_nome})
+    return jsonify(retorno)
+
+
+@bp.app_context_processor
+def contexto_em_falta():
+    # Usado pelo menu para exibir a quantidade de produtos em falta
+    return {'quantidade_em_falta': Produto.quantidade_em_falta}
+
 
 @bp.route('/compravenda', methods=['GET', 'POST'])
 @login_required
@@ -235,73 +383,147 @@ def compravenda():
             flash("Arquivo não enviado", category='warning')
             return redirect(url_for('produto.compravenda'))
         arquivo = request.files['arquivo_transacoes']
-        if arquivo.mimetype != 'application/json':
-            flash("Arquivo enviado não é um JSON", category='warning')
-            return redirect(url_for('produto.compravenda'))
-        try:
-            dados = arquivo.read().decode('utf-8')
-        except UnicodeDecodeError:
-            flash("Arquivo enviado não está no formato UTF-8", category='warning')
-            return redirect(url_for('produto.compravenda'))
-
-        try:
-            transacoes = json.loads(dados)
-        except json.JSONDecodeError:
-            flash("Arquivo enviado não é um arquivo JSON bem formado", category='warning')
+        if (arquivo.mimetype not in ('application/json', 'application/x-ndjson', 'application/jsonl') and
+                not (arquivo.filename or '').lower().endswith(('.ndjson', '.jsonl'))):
+            flash("Arquivo enviado não é um JSON ou NDJSON", category='warning')
             return redirect(url_for('produto.compravenda'))
 
-        saida = list()
-        for transacao in transacoes:
-            produto = Produto.get_by_id(transacao.get('id'))
-            if not produto:
-                saida.append((f"Produto {transacao.get('id')} não encontrado", 'x', 'warning'))
-                continue
-            try:
-                qtd = int(transacao.get('quantidade'))
-            except ValueError:
-                saida.append((f"Produto \"{produto.nome}\" com quantidade indicada de forma incorreta", 'x', 'warning'))
-                continue
-            except KeyError:
-                saida.append((f"Produto \"{produto.nome}\" sem quantidade indicada", 'x', 'warning'))
-                continue
-            limitado = transacao.get('limitado', True)
-            novo_estoque = produto.estoque + qtd
-            if limitado and novo_estoque < 0:
-                if qtd > 0:
-                    saida.append((f"Comprar {qtd:d} unidade do produto \"{produto.nome}\" vai deixá-lo com {novo_estoque:d} unidades, e não é possível deixar estoque negativo", 'x', 'warning'))
-                else:
-                    saida.append((f"Vender {qtd * -1:d} unidade do produto \"{produto.nome}\" vai deixá-lo com {novo_estoque:d} unidades, e não é possível deixar estoque negativo", 'x', 'warning'))
-                continue
-            produto.estoque = novo_estoque
-            if qtd > 0:
-                saida.append((f"Depois de comprar {qtd:d} unidade do produto \"{produto.nome}\" temos {novo_estoque:d} unidades em estoque", 'check', 'success'))
-            else:
-                saida.append((f"Depois de vender {qtd * -1:d} unidade do produto \"{produto.nome}\" temos {novo_estoque:d} unidades em estoque", 'check', 'success'))
-            db.session.commit()
-
-        flash("Operações de compra e venda executadas", category='success')
-        return render_template('produto/compravenda.jinja',
-                               title="Compras e vendas",
-                               resultado=True,
-                               linhas=saida,
-                               form=form)
+        # O arquivo é processado em segundo plano, e a requisição retorna imediatamente
+        tarefa = tarefas.cria('compravenda', dono=str(current_user.id), arquivo=arquivo.filename)
+        arquivo.save(tarefa.arquivo('entrada'))
+        tarefas.submete(tarefa, executa_compravenda,
+                        tamanho_lote=int(current_app.config.get('COMPRAVENDA_LOTE', 1000)))
+        flash("Arquivo recebido. As operações de compra e venda estão sendo processadas", category='info')
+        return redirect(url_for('produto.compravenda_tarefa', tarefa_id=tarefa.id))
     return render_template('produto/compravenda.jinja',
                            title="Compras e vendas",
-                           resultado=False,
-                           linhas=list(),
                            form=form)
 
+
+def _tarefa_do_usuario(tarefa_id):
+    tarefa = tarefas.obtem(tarefa_id)
+    if tarefa is None or tarefa.estado.get('dono') != str(current_user.id):
+        return None
+    return tarefa
+
+
+@bp.route('/compravenda/<uuid:tarefa_id>', methods=['GET'])
+@login_required
+def compravenda_tarefa(tarefa_id):
+    tarefa = _tarefa_do_usuario(tarefa_id)
+    if tarefa is None:
+        flash("Processamento inexistente ou expirado", category='warning')
+        return redirect(url_for('produto.compravenda'))
+    estado = tarefa.estado
+
+    # Prévia das primeiras linhas do relatório; o relatório completo pode ser baixado
+    linhas = list()
+    if estado.get('situacao') in ('concluida', 'erro') and tarefa.arquivo('relatorio.csv').is_file():
+        with open(tarefa.arquivo('relatorio.csv'), newline='', encoding='utf-8') as relatorio:
+            leitor = csv.reader(relatorio)
+            next(leitor, None)
+            previa = int(current_app.config.get('COMPRAVENDA_PREVIA', 200))
+            for _, situacao, mensagem in itertools.islice(leitor, previa):
+                if situacao == 'aplicada':
+                    linhas.append((mensagem, 'check', 'success'))
+                else:
+                    linhas.append((mensagem, 'x', 'warning'))
+    return render_template('produto/compravenda_tarefa.jinja',
+                           title="Compras e vendas",
+                           tarefa=tarefa,
+                           estado=estado,
+                           linhas=linhas)
+
+
+@bp.route('/compravenda/<uuid:tarefa_id>/relatorio', methods=['GET'])
+@login_required
+def compravenda_relatorio(tarefa_id):
+    tarefa = _tarefa_do_usuario(tarefa_id)
+    if tarefa is None or not tarefa.arquivo('relatorio.csv').is_file():
+        return Response(status=404)
+    return send_file(tarefa.arquivo('relatorio.csv'),
+                     mimetype='text/csv',
+                     as_attachment=True,
+                     download_name=f"compravenda-{tarefa.id}.csv")
+
+
 @bp.route('/listajson', methods=['GET'])
 @login_required
+@replicas.somente_leitura
 def listajson():
-    sentenca = db.select(Produto).order_by(Produto.nome)
-    rset = db.session.execute(sentenca).scalars()
-    retorno = list()
-    for produto in rset:
-        item = dict()
-        item['id'] = str(produto.id)
-        item['nome'] = produto.nome
-        retorno.append(item)
-    return Response(json.dumps(retorno, indent=2, sort_keys=True,ensure_ascii=False).encode('utf8'),
-                    headers={'Content-Disposition': 'attachment;filename=produtos.json'},
-                    mimetype='application/json')
+    formato = request.args.get('formato', default='json', type=str)
+    if formato not in exportacao.FORMATOS:
+        abort(400)
+    mimetype, extensao = exportacao.FORMATOS[formato]
+    gzip = request.accept_encodings['gzip'] > 0
+
+    # Catálogo inalterado desde a última exportação: responde 304 sem ler os produtos
+    versao = exportacao.versao_da_tabela(Produto)
+    etag = f"{versao}-{formato}{'-gz' if gzip else ''}" if versao is not None else None
+    if etag is not None and request.if_none_match.contains(etag):
+        resposta = Response(status=304)
+        resposta.set_etag(etag)
+        resposta.vary.add('Accept-Encoding')
+        return resposta
+
+    sentenca = db.select(Produto.id, Produto.nome).order_by(Produto.nome, Produto.id)
+    partes = exportacao.GERADORES[formato](exportacao.linhas(sentenca))
+    resposta = Response(stream_with_context(exportacao.codifica(partes, gzip=gzip)),
+                        headers={'Content-Disposition': f"attachment;filename=produtos.{extensao}"},
+                        mimetype=mimetype)
+    if gzip:
+        resposta.content_encoding = 'gzip'
+    resposta.vary.add('Accept-Encoding')
+    if etag is not None:
+        resposta.set_etag(etag)
+    resposta.cache_control.private = True
+    resposta.cache_control.no_cache = True
+    return resposta
+
+
+@bp.cli.command('migra-fotos')
+@click.option('--lote', default=100, show_default=True, help="Quantidade de produtos migrados por transação")
+def migra_fotos(lote: int):
+    """Move as fotos da coluna foto_base64 para o armazém de blobs"""
+    migrados = 0
+    chaves = set()
+    while True:
+        sentenca = db.select(Produto).where(Produto.foto_base64.is_not(None)).limit(lote)
+        produtos = db.session.execute(sentenca).scalars().all()
+        if not produtos:
+            break
+        for produto in produtos:
+            if produto.migra_foto_legada():
+                migrados += 1
+                chaves.add(produto.foto_hash)
+        db.session.commit()
+        click.echo(f"{migrados} fotos migradas")
+    click.echo(f"Migração concluída: {migrados} fotos em {len(chaves)} blobs distintos")
+
+
+@bp.cli.command('limpa-blobs')
+@click.option('--idade-minima', default=3600, show_default=True,
+              help="Só remove blobs gravados há mais segundos que isso")
+@click.option('--simula', is_flag=True, help="Lista os blobs órfãos sem removê-los")
+def limpa_blobs(idade_minima: int, simula: bool):
+    """Remove do armazém de blobs as fotos que nenhum produto referencia"""
+    # Fotos substituídas ou de produtos removidos continuam no armazém, pois o
+    # mesmo blob pode ser de outro produto. Blobs recentes são preservados: a
+    # foto é gravada no armazém antes do commit que a associa ao produto
+    referenciadas = set(db.session.execute(db.select(Produto.foto_hash).
+                                           where(Produto.foto_hash.is_not(None)).
+                                           distinct()).scalars())
+    removidos = 0
+    for chave in list(blobstore.chaves()):
+        if chave in referenciadas:
+            continue
+        idade = blobstore.idade(chave)
+        if idade is not None and idade < idade_minima:
+            continue
+        if simula:
+            click.echo(chave)
+        else:
+            blobstore.remove(chave)
+        removidos += 1
+    click.echo(f"{removidos} blobs órfãos {'encontrados' if simula else 'removidos'}, "
+               f"{len(referenciadas)} referenciados")
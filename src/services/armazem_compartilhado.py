@@ -0,0 +1,49 @@
+import contextlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterator
+
+
+class ArmazemCompartilhado:
+    """
+    Arquivo SQLite próprio, fora do banco da aplicação, para estado pequeno e
+    muito escrito que precisa ser visto por todos os processos (workers) da
+    aplicação, como contadores de limite de taxa. Cada thread tem a sua conexão
+    """
+
+    def __init__(self, caminho: Path, esquema: list[str]):
+        self.caminho = caminho
+        self._esquema = esquema
+        self._local = threading.local()
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        with self.transacao() as conexao:
+            for comando in self._esquema:
+                conexao.execute(comando)
+
+    def _conexao(self) -> sqlite3.Connection:
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            conexao = sqlite3.connect(self.caminho, timeout=5, isolation_level=None, check_same_thread=False)
+            conexao.execute("PRAGMA journal_mode = WAL")
+            conexao.execute("PRAGMA synchronous = NORMAL")
+            self._local.conexao = conexao
+        return conexao
+
+    def consulta(self, sql: str, parametros: tuple = ()) -> list[tuple]:
+        # Leitura avulsa, sem o lock de escrita; no modo WAL não espera pelos escritores
+        return self._conexao().execute(sql, parametros).fetchall()
+
+    @contextlib.contextmanager
+    def transacao(self) -> Iterator[sqlite3.Connection]:
+        # BEGIN IMMEDIATE obtém o lock de escrita no início, tornando a
+        # sequência leitura-alteração-gravação atômica entre processos
+        conexao = self._conexao()
+        conexao.execute("BEGIN IMMEDIATE")
+        try:
+            yield conexao
+        except BaseException:
+            conexao.execute("ROLLBACK")
+            raise
+        else:
+            conexao.execute("COMMIT")
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Iterator
+
+from flask import Flask
+
+
+class ArmazemDeBlobs(ABC):
+    """
+    Interface dos armazéns de conteúdo binário endereçados pelo SHA-256 do conteúdo
+    """
+
+    @staticmethod
+    def chave_de(dados: bytes) -> str:
+        return hashlib.sha256(dados).hexdigest()
+
+    @abstractmethod
+    def grava(self, dados: bytes) -> str:
+        ...
+
+    @abstractmethod
+    def le(self, chave: str) -> bytes | None:
+        ...
+
+    @abstractmethod
+    def existe(self, chave: str) -> bool:
+        ...
+
+    @abstractmethod
+    def remove(self, chave: str) -> None:
+        ...
+
+    @abstractmethod
+    def chaves(self) -> Iterator[str]:
+        ...
+
+    def caminho_local(self, chave: str) -> Path | None:
+        # Backends em disco devolvem o arquivo, para que possa ser enviado sem ser lido para a memória
+        return None
+
+    def idade(self, chave: str) -> float | None:
+        # Segundos desde a gravação do blob, quando o backend sabe informar
+        return None
+
+
+class ArmazemLocal(ArmazemDeBlobs):
+    """
+    Armazena cada blob em <raiz>/ab/cd/abcd..., onde abcd... é o SHA-256 do conteúdo.
+    Conteúdos idênticos caem no mesmo arquivo e são gravados uma única vez
+    """
+
+    def __init__(self, app: Flask):
+        self.raiz = Path(app.instance_path) / Path(app.config.get('BLOBSTORE_PATH', 'blobs'))
+        self.raiz.mkdir(parents=True, exist_ok=True)
+
+    def caminho(self, chave: str) -> Path:
+        if len(chave) != 64 or any(c not in '0123456789abcdef' for c in chave):
+            raise ValueError(f"Chave de blob inválida: {chave}")
+        return self.raiz / chave[0:2] / chave[2:4] / chave
+
+    def grava(self, dados: bytes) -> str:
+        chave = self.chave_de(dados)
+        destino = self.caminho(chave)
+        if destino.is_file():
+            return chave
+        destino.parent.mkdir(parents=True, exist_ok=True)
+        temporario = destino.with_name(f".{chave}.{uuid.uuid4().hex}")
+        temporario.write_bytes(dados)
+        os.replace(temporario, destino)
+        return chave
+
+    def caminho_local(self, chave: str) -> Path | None:
+        caminho = self.caminho(chave)
+        return caminho if caminho.is_file() else None
+
+    def idade(self, chave: str) -> float | None:
+        try:
+            return time.time() - self.caminho(chave).stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+    def le(self, chave: str) -> bytes | None:
+        try:
+            return self.caminho(chave).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def existe(self, chave: str) -> bool:
+        return self.caminho(chave).is_file()
+
+    def remove(self, chave: str) -> None:
+        try:
+            self.caminho(chave).unlink()
+        except FileNotFoundError:
+            pass
+
+    def chaves(self) -> Iterator[str]:
+        for arquivo in self.raiz.glob('??/??/*'):
+            if arquivo.is_file() and not arquivo.name.startswith('.'):
+                yield arquivo.name
+
+
+BACKENDS: dict[str, type[ArmazemDeBlobs]] = {
+    'local': ArmazemLocal,
+}
+
+
+class BlobStore:
+    def __init__(self, app: Flask | None = None):
+        self.backend: ArmazemDeBlobs | None = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        nome = app.config.get('BLOBSTORE_BACKEND', 'local')
+        if nome not in BACKENDS:
+            raise ValueError(f"Backend de blobs desconhecido: {nome}")
+        self.backend = BACKENDS[nome](app)
+        app.extensions['blobstore'] = self
+
+    def grava(self, dados: bytes) -> str:
+        return self.backend.grava(dados)
+
+    def le(self, chave: str) -> bytes | None:
+        return self.backend.le(chave)
+
+    def existe(self, chave: str) -> bool:
+        return self.backend.existe(chave)
+
+    def remove(self, chave: str) -> None:
+        self.backend.remove(chave)
+
+    def chaves(self) -> Iterator[str]:
+        return self.backend.chaves()
+
+    def caminho_local(self, chave: str) -> Path | None:
+        return self.backend.caminho_local(chave)
+
+    def idade(self, chave: str) -> float | None:
+        return self.backend.idade(chave)
@@ -0,0 +1,120 @@
+import re
+
+import sqlalchemy as sa
+from flask import Flask, current_app
+
+
+class IndiceDeBusca:
+    """
+    Índice de busca textual usando o FTS5 do SQLite. Para cada tabela indexada
+    são criadas uma tabela virtual FTS5, uma tabela que associa o rowid do
+    índice ao id (UUID) do registro e os gatilhos que mantêm as duas em sincronia
+    com a tabela original. A busca ignora acentos e maiúsculas ("agua" encontra
+    "Água") e devolve a relevância (bm25) de cada registro
+    """
+
+    def __init__(self, app: Flask | None = None):
+        self.disponivel = False
+        self._indexados: dict[type, str] = dict()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        app.extensions['busca'] = self
+
+    def indexa(self, cls: type, atributo: str = 'nome') -> None:
+        self._indexados[cls] = atributo
+
+    @staticmethod
+    def _tabelas(cls: type) -> tuple[str, str]:
+        return f"{cls.__tablename__}_busca", f"{cls.__tablename__}_busca_ids"
+
+    def cria_estrutura(self) -> None:
+        # Deve ser chamada dentro de um contexto de aplicação, depois que o esquema existir
+        from src.modules import db
+        if db.engine.dialect.name != 'sqlite':
+            current_app.logger.warning("Índice de busca disponível apenas para SQLite. Usando ilike")
+            return
+        try:
+            with db.engine.begin() as conexao:
+                for cls, atributo in self._indexados.items():
+                    self._cria_estrutura_da_tabela(conexao, cls.__tablename__, atributo)
+        except sa.exc.OperationalError as e:
+            current_app.logger.warning(f"FTS5 indisponível ({e}). Usando ilike")
+            self.disponivel = False
+        else:
+            self.disponivel = True
+
+    def _cria_estrutura_da_tabela(self, conexao: sa.Connection, tabela: str, atributo: str) -> None:
+        fts, ids = f"{tabela}_busca", f"{tabela}_busca_ids"
+        comandos = [
+            f"CREATE TABLE IF NOT EXISTS {ids} (rowid INTEGER PRIMARY KEY, id CHAR(32) NOT NULL UNIQUE)",
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({atributo}, "
+            f"tokenize = 'unicode61 remove_diacritics 2')",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {tabela} BEGIN "
+            f"INSERT INTO {ids}(id) VALUES (new.id); "
+            f"INSERT INTO {fts}(rowid, {atributo}) "
+            f"VALUES ((SELECT rowid FROM {ids} WHERE id = new.id), new.{atributo}); "
+            f"END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {atributo} ON {tabela} BEGIN "
+            f"UPDATE {fts} SET {atributo} = new.{atributo} "
+            f"WHERE rowid = (SELECT rowid FROM {ids} WHERE id = new.id); "
+            f"END",
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {tabela} BEGIN "
+            f"DELETE FROM {fts} WHERE rowid = (SELECT rowid FROM {ids} WHERE id = old.id); "
+            f"DELETE FROM {ids} WHERE id = old.id; "
+            f"END",
+        ]
+        for comando in comandos:
+            conexao.exec_driver_sql(comando)
+
+        # Popula o índice de bases que já tinham registros antes dele existir
+        indexados = conexao.exec_driver_sql(f"SELECT count(*) FROM {ids}").scalar_one()
+        existentes = conexao.exec_driver_sql(f"SELECT count(*) FROM {tabela}").scalar_one()
+        if indexados != existentes:
+            current_app.logger.info(f"Reconstruindo o índice de busca de {tabela}")
+            conexao.exec_driver_sql(f"DELETE FROM {fts}")
+            conexao.exec_driver_sql(f"DELETE FROM {ids}")
+            conexao.exec_driver_sql(f"INSERT INTO {ids}(id) SELECT id FROM {tabela}")
+            conexao.exec_driver_sql(f"INSERT INTO {fts}(rowid, {atributo}) "
+                                    f"SELECT m.rowid, t.{atributo} FROM {tabela} t JOIN {ids} m ON m.id = t.id")
+
+    @staticmethod
+    def expressao(texto: str) -> str | None:
+        # Cada palavra vira um prefixo entre aspas, e todas devem estar presentes
+        palavras = re.findall(r'\w+', texto)
+        if not palavras:
+            return None
+        return " ".join(f"\"{palavra}\"*" for palavra in palavras)
+
+    def consulta(self, cls: type, texto: str) -> sa.Subquery | None:
+        """
+        Subconsulta com as colunas id e relevancia dos registros que atendem
+        à busca, ou None se o índice não estiver disponível
+        """
+        if not self.disponivel or cls not in self._indexados:
+            return None
+        fts, ids = self._tabelas(cls)
+        expressao = self.expressao(texto)
+        tabela_fts = sa.table(fts, sa.column('rowid'))
+        tabela_ids = sa.table(ids, sa.column('rowid'), sa.column('id'))
+        if expressao is None:
+            return (sa.select(tabela_ids.c.id, sa.literal(0.0).label('relevancia')).
+                    where(sa.false()).
+                    subquery())
+        return (sa.select(tabela_ids.c.id, sa.func.bm25(sa.literal_column(fts)).label('relevancia')).
+                select_from(tabela_fts).
+                join(tabela_ids, tabela_ids.c.rowid == tabela_fts.c.rowid).
+                where(sa.literal_column(fts).op('MATCH')(expressao)).
+                subquery())
+
+    def filtra(self, sentenca: sa.Select, cls: type, texto: str) -> tuple[sa.Select, sa.ColumnElement | None]:
+        """
+        Aplica a busca à sentença. Devolve a nova sentença e a coluna de
+        relevância para ordenação (None quando a busca recai no ilike)
+        """
+        resultado = self.consulta(cls, texto)
+        atributo = getattr(cls, self._indexados.get(cls, 'nome'))
+        if resultado is None:
+            return sentenca.filter(atributo.ilike(f"%{texto}%")), None
+        return sentenca.join(resultado, resultado.c.id == cls.id), resultado.c.relevancia
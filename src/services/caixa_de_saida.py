@@ -0,0 +1,177 @@
+import datetime
+import threading
+import traceback
+
+import sqlalchemy as sa
+from flask import Flask
+from sqlalchemy.orm import Session
+
+
+class CaixaDeSaida:
+    """
+    Despachante dos emails gravados na tabela caixa_de_saida. Uma thread
+    envia as mensagens pendentes em lotes, reutilizando uma única conexão SMTP
+    por lote, e reagenda as que falharem com espera exponencial, até
+    EMAIL_MAX_TENTATIVAS. A thread é acordada logo depois do commit de uma
+    transação que gravou mensagens, e também verifica a tabela periodicamente
+    """
+
+    def __init__(self, app: Flask | None = None):
+        self.app: Flask | None = None
+        self.lote: int = 20
+        self.intervalo: float = 30
+        self.max_tentativas: int = 5
+        self.espera_base: float = 30
+        self._acorda = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        sa.event.listen(Session, 'after_commit', self._apos_commit)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        self.app = app
+        self.lote = int(app.config.get('EMAIL_LOTE', 20))
+        self.intervalo = float(app.config.get('EMAIL_INTERVALO', 30))
+        self.max_tentativas = int(app.config.get('EMAIL_MAX_TENTATIVAS', 5))
+        self.espera_base = float(app.config.get('EMAIL_ESPERA_BASE', 30))
+        app.extensions['caixa_de_saida'] = self
+
+    def enfileira(self, destinatarios: list[str], assunto: str, corpo: str, message_id: str, usuario_id=None):
+        """
+        Grava a mensagem na sessão atual. Ela só será enviada depois do commit
+        """
+        from src.models.mensagem import Mensagem
+        from src.modules import db
+        mensagem = Mensagem()
+        mensagem.usuario_id = usuario_id
+        mensagem.destinatarios = destinatarios
+        mensagem.assunto = assunto
+        mensagem.corpo = corpo
+        mensagem.message_id = message_id
+        mensagem.situacao = 'pendente'
+        db.session.add(mensagem)
+        db.session.info['caixa_de_saida'] = True
+        return mensagem
+
+    def _apos_commit(self, session: Session) -> None:
+        if session.info.pop('caixa_de_saida', False):
+            self._acorda.set()
+
+    def inicia(self) -> None:
+        if self.app.config.get('EMAIL_DESPACHO_ATIVO', True) is False:
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._executa, name='caixa-de-saida', daemon=True)
+                self._thread.start()
+
+    def _executa(self) -> None:
+        while True:
+            self._acorda.wait(self.intervalo)
+            self._acorda.clear()
+            with self.app.app_context():
+                try:
+                    while self.despacha() == self.lote:
+                        pass
+                except Exception as e:
+                    self.app.logger.error(f"Caixa de saída: {e}\n{traceback.format_exc()}")
+                finally:
+                    from src.modules import db
+                    db.session.remove()
+
+    @staticmethod
+    def _agora() -> datetime.datetime:
+        return datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+
+    def _reserva(self) -> list:
+        # Marca o lote como 'enviando' antes de enviar, para que dois
+        # despachantes (de processos diferentes) não enviem a mesma mensagem
+        from src.models.mensagem import Mensagem
+        from src.modules import db
+        agora = self._agora()
+        # Mensagens que ficaram em 'enviando' por um processo interrompido voltam para a fila
+        db.session.execute(sa.update(Mensagem).
+                           where(Mensagem.situacao == 'enviando',
+                                 Mensagem.dta_atualizacao < agora - datetime.timedelta(minutes=10)).
+                           values(situacao='pendente'))
+        candidatas = db.session.execute(sa.select(Mensagem.id).
+                                        where(Mensagem.situacao == 'pendente',
+                                              sa.or_(Mensagem.proxima_tentativa.is_(None),
+                                                     Mensagem.proxima_tentativa <= agora)).
+                                        order_by(Mensagem.dta_cadastro).
+                                        limit(self.lote)).scalars().all()
+        reservadas = list()
+        for mensagem_id in candidatas:
+            resultado = db.session.execute(sa.update(Mensagem).
+                                           where(Mensagem.id == mensagem_id, Mensagem.situacao == 'pendente').
+                                           values(situacao='enviando', dta_atualizacao=agora))
+            if resultado.rowcount == 1:
+                reservadas.append(mensagem_id)
+        db.session.commit()
+        if not reservadas:
+            return list()
+        return db.session.execute(sa.select(Mensagem).where(Mensagem.id.in_(reservadas))).scalars().all()
+
+    def despacha(self) -> int:
+        """
+        Envia um lote de mensagens pendentes. Devolve quantas foram processadas
+        """
+        from flask_mailman import EmailMessage
+        from src.modules import db, mail
+        mensagens = self._reserva()
+        if not mensagens:
+            return 0
+
+        conexao = mail.get_connection(fail_silently=False)
+        try:
+            conexao.open()
+        except Exception as e:
+            self.app.logger.warning(f"Caixa de saída: conexão com o servidor de email falhou: {e}")
+            for mensagem in mensagens:
+                self._reagenda(mensagem, str(e))
+            db.session.commit()
+            return len(mensagens)
+
+        try:
+            for mensagem in mensagens:
+                msg = EmailMessage(subject=mensagem.assunto,
+                                   body=mensagem.corpo,
+                                   to=mensagem.destinatarios,
+                                   headers={'Message-ID': mensagem.message_id},
+                                   connection=conexao)
+                try:
+                    msg.send()
+                except Exception as e:
+                    self.app.logger.warning(f"Caixa de saída: mensagem {mensagem.id} não enviada: {e}")
+                    self._reagenda(mensagem, str(e))
+                else:
+                    mensagem.situacao = 'enviada'
+                    mensagem.tentativas += 1
+                    mensagem.dta_envio = self._agora()
+                    mensagem.ultimo_erro = None
+                # Confirma cada mensagem, para não reenviar as já entregues se o processo parar
+                db.session.commit()
+        finally:
+            try:
+                conexao.close()
+            except Exception as e:
+                self.app.logger.debug(f"Caixa de saída: erro ao fechar a conexão: {e}")
+        return len(mensagens)
+
+    def _reagenda(self, mensagem, erro: str) -> None:
+        mensagem.tentativas += 1
+        mensagem.ultimo_erro = erro
+        if mensagem.tentativas >= self.max_tentativas:
+            mensagem.situacao = 'falha'
+            mensagem.proxima_tentativa = None
+        else:
+            mensagem.situacao = 'pendente'
+            espera = min(self.espera_base * 2 ** (mensagem.tentativas - 1), 6 * 3600)
+            mensagem.proxima_tentativa = self._agora() + datetime.timedelta(seconds=espera)
+
+    def situacao(self) -> dict[str, int]:
+        from src.models.mensagem import Mensagem
+        from src.modules import db
+        return {situacao: quantidade for situacao, quantidade in
+                db.session.execute(sa.select(Mensagem.situacao, sa.func.count()).group_by(Mensagem.situacao))}
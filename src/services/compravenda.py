@@ -0,0 +1,322 @@
+import codecs
+import csv
+import json
+import time
+import uuid
+from typing import BinaryIO, Callable, Iterable, Iterator
+
+import sqlalchemy as sa
+
+from src.models.produto import Produto
+from src.modules import db
+from src.services.tarefas import Tarefa
+
+# Limite de parâmetros por consulta IN, abaixo do máximo padrão do SQLite
+_MAX_PARAMETROS = 500
+
+
+class ArquivoInvalido(ValueError):
+    pass
+
+
+class _LeitorIncremental:
+    # Lê o arquivo em blocos, decodificando UTF-8, sem carregá-lo inteiro na memória
+    def __init__(self, arquivo: BinaryIO, tamanho_bloco: int, max_transacao: int):
+        self._arquivo = arquivo
+        self._decodificador = codecs.getincrementaldecoder('utf-8')()
+        self._tamanho_bloco = tamanho_bloco
+        self._max_transacao = max_transacao
+        self.buffer = ''
+        self.pos = 0
+        self.fim = False
+
+    def le_mais(self) -> bool:
+        if self.fim:
+            return False
+        if len(self.buffer) - self.pos > self._max_transacao:
+            raise ArquivoInvalido("Transação muito grande ou arquivo JSON malformado")
+        try:
+            bloco = self._arquivo.read(self._tamanho_bloco)
+            texto = self._decodificador.decode(bloco, final=not bloco)
+        except UnicodeDecodeError as e:
+            raise ArquivoInvalido("Arquivo enviado não está no formato UTF-8") from e
+        if not bloco:
+            self.fim = True
+        self.buffer = self.buffer[self.pos:] + texto
+        self.pos = 0
+        return True
+
+    def proximo_caractere(self) -> str | None:
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n\ufeff':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.le_mais():
+                return None
+
+
+def _le_valor(leitor: _LeitorIncremental, decodificador: json.JSONDecoder, delimitadores: str):
+    # Lê o valor JSON que começa em leitor.pos, buscando mais blocos até que ele esteja completo
+    while True:
+        try:
+            valor, fim = decodificador.raw_decode(leitor.buffer, leitor.pos)
+        except ValueError:
+            fim = None
+        # Só aceita o valor se ele for seguido de um delimitador, pois um número
+        # no fim do buffer (como "12." de "12.5") pode ainda estar incompleto
+        if fim is not None and (leitor.fim or (fim < len(leitor.buffer) and leitor.buffer[fim] in delimitadores)):
+            leitor.pos = fim
+            return valor
+        if not leitor.le_mais():
+            raise ArquivoInvalido("Arquivo enviado não é um arquivo JSON bem formado")
+
+
+def _itera_lista_json(leitor: _LeitorIncremental) -> Iterator:
+    decodificador = json.JSONDecoder()
+    leitor.pos += 1  # '['
+    if leitor.proximo_caractere() == ']':
+        return
+    while True:
+        if leitor.proximo_caractere() is None:
+            raise ArquivoInvalido("Arquivo enviado não é um arquivo JSON bem formado")
+        yield _le_valor(leitor, decodificador, ' \t\r\n,]')
+        separador = leitor.proximo_caractere()
+        if separador == ']':
+            return
+        if separador != ',':
+            raise ArquivoInvalido("Arquivo enviado não é um arquivo JSON bem formado")
+        leitor.pos += 1
+
+
+def _itera_valores_json(leitor: _LeitorIncremental) -> Iterator:
+    # Objetos JSON em sequência, separados por espaços ou quebras de linha, cada
+    # um podendo ocupar várias linhas (como um único objeto formatado)
+    decodificador = json.JSONDecoder()
+    while leitor.proximo_caractere() is not None:
+        yield _le_valor(leitor, decodificador, ' \t\r\n')
+
+
+def _primeira_linha_e_json(leitor: _LeitorIncremental) -> bool:
+    while leitor.buffer.find('\n', leitor.pos) < 0 and leitor.le_mais():
+        pass
+    quebra = leitor.buffer.find('\n', leitor.pos)
+    linha = leitor.buffer[leitor.pos:quebra if quebra >= 0 else len(leitor.buffer)]
+    try:
+        json.loads(linha)
+    except ValueError:
+        return False
+    return True
+
+
+def _itera_ndjson(leitor: _LeitorIncremental) -> Iterator:
+    while True:
+        quebra = leitor.buffer.find('\n', leitor.pos)
+        if quebra < 0:
+            if leitor.le_mais():
+                continue
+            quebra = len(leitor.buffer)
+        linha = leitor.buffer[leitor.pos:quebra].strip()
+        leitor.pos = quebra + 1
+        if linha:
+            try:
+                yield json.loads(linha)
+            except ValueError:
+                # Linhas inválidas são relatadas pelo processamento como transações inválidas
+                yield linha
+        if leitor.fim and leitor.pos >= len(leitor.buffer):
+            return
+
+
+def le_transacoes(arquivo: BinaryIO, tamanho_bloco: int = 64 * 1024,
+                  max_transacao: int = 1024 * 1024) -> Iterator:
+    """
+    Devolve as transações do arquivo uma a uma, com memória limitada. Aceita
+    uma lista JSON, NDJSON (um objeto JSON por linha) ou objetos JSON que
+    ocupam várias linhas, como um único objeto formatado
+    """
+    leitor = _LeitorIncremental(arquivo, tamanho_bloco, max_transacao)
+    primeiro = leitor.proximo_caractere()
+    if primeiro is None:
+        return iter(())
+    if primeiro == '[':
+        return _itera_lista_json(leitor)
+    if primeiro == '{' and not _primeira_linha_e_json(leitor):
+        return _itera_valores_json(leitor)
+    return _itera_ndjson(leitor)
+
+
+class EstatisticasCompraVenda:
+    def __init__(self):
+        self.linhas = 0
+        self.aplicadas = 0
+        self.rejeitadas = 0
+        self.lotes = 0
+        self.segundos = 0.0
+
+    @property
+    def linhas_por_segundo(self) -> float:
+        return self.linhas / self.segundos if self.segundos > 0 else 0.0
+
+
+def _em_lotes(transacoes: Iterable, tamanho: int) -> Iterator[list]:
+    lote = list()
+    try:
+        for transacao in transacoes:
+            lote.append(transacao)
+            if len(lote) >= tamanho:
+                yield lote
+                lote = list()
+    except ArquivoInvalido:
+        # As transações lidas antes do erro são processadas, e só então o erro segue adiante
+        if lote:
+            yield lote
+        raise
+    if lote:
+        yield lote
+
+
+def _converte_id(valor) -> uuid.UUID | None:
+    try:
+        return uuid.UUID(str(valor))
+    except ValueError:
+        return None
+
+
+def _trava_para_escrita() -> None:
+    # No SQLite, BEGIN IMMEDIATE obtém o lock de escrita antes da leitura dos
+    # estoques: nenhum outro processo ou thread altera os produtos do lote entre
+    # a leitura e o UPDATE. Nos demais bancos, o SELECT ... FOR UPDATE faz o mesmo
+    db.session.commit()
+    if db.session.get_bind().dialect.name == 'sqlite':
+        db.session.execute(sa.text("BEGIN IMMEDIATE"))
+
+
+def _carrega_estoques(ids: set[uuid.UUID]) -> dict[uuid.UUID, list]:
+    estado: dict[uuid.UUID, list] = dict()
+    ids = list(ids)
+    for inicio in range(0, len(ids), _MAX_PARAMETROS):
+        sentenca = (sa.select(Produto.id, Produto.nome, Produto.estoque).
+                    where(Produto.id.in_(ids[inicio:inicio + _MAX_PARAMETROS])).
+                    with_for_update())
+        for produto_id, nome, estoque in db.session.execute(sentenca):
+            estado[produto_id] = [nome, estoque]
+    return estado
+
+
+def _aplica(transacao, estado: dict[uuid.UUID, list], deltas: dict[uuid.UUID, int]) -> tuple[str, str, str]:
+    if not isinstance(transacao, dict):
+        return f"Transação em formato inválido: {transacao}", 'x', 'warning'
+    produto_id = _converte_id(transacao.get('id'))
+    if produto_id is None or produto_id not in estado:
+        return f"Produto {transacao.get('id')} não encontrado", 'x', 'warning'
+    nome, estoque = estado[produto_id]
+    if transacao.get('quantidade') is None:
+        return f"Produto \"{nome}\" sem quantidade indicada", 'x', 'warning'
+    try:
+        qtd = int(transacao.get('quantidade'))
+    except (ValueError, TypeError):
+        return f"Produto \"{nome}\" com quantidade indicada de forma incorreta", 'x', 'warning'
+    limitado = transacao.get('limitado', True)
+    novo_estoque = estoque + qtd
+    if limitado and novo_estoque < 0:
+        if qtd > 0:
+            return (f"Comprar {qtd:d} unidade do produto \"{nome}\" vai deixá-lo com {novo_estoque:d} unidades, "
+                    f"e não é possível deixar estoque negativo", 'x', 'warning')
+        return (f"Vender {qtd * -1:d} unidade do produto \"{nome}\" vai deixá-lo com {novo_estoque:d} unidades, "
+                f"e não é possível deixar estoque negativo", 'x', 'warning')
+    estado[produto_id][1] = novo_estoque
+    deltas[produto_id] = deltas.get(produto_id, 0) + qtd
+    if qtd > 0:
+        return (f"Depois de comprar {qtd:d} unidade do produto \"{nome}\" temos {novo_estoque:d} unidades em estoque",
+                'check', 'success')
+    return (f"Depois de vender {qtd * -1:d} unidade do produto \"{nome}\" temos {novo_estoque:d} unidades em estoque",
+            'check', 'success')
+
+
+def processa_transacoes(transacoes: Iterable,
+                        registra: Callable[[tuple[str, str, str]], None],
+                        tamanho_lote: int = 1000,
+                        progresso: Callable[[EstatisticasCompraVenda], None] | None = None) -> EstatisticasCompraVenda:
+    """
+    Aplica as transações de compra e venda em lotes, cada um em uma transação
+    de escrita. Os estoques dos produtos do lote são lidos já com o lock de
+    escrita, as quantidades são aplicadas em memória, na ordem do arquivo, e
+    a soma das quantidades aceitas de cada produto é gravada como incremento
+    (estoque = estoque + delta), com um único UPDATE executemany seguido de
+    commit. Cada linha gera uma mensagem (texto, ícone, categoria) entregue a
+    registra
+    """
+    produtos = Produto.__table__
+    incrementa = (sa.update(produtos).
+                  where(produtos.c.id == sa.bindparam('produto_id')).
+                  values(estoque=produtos.c.estoque + sa.bindparam('delta')))
+    estatisticas = EstatisticasCompraVenda()
+    inicio = time.perf_counter()
+    for lote in _em_lotes(transacoes, tamanho_lote):
+        ids = {_converte_id(t.get('id')) for t in lote if isinstance(t, dict)}
+        ids.discard(None)
+        _trava_para_escrita()
+        estado = _carrega_estoques(ids)
+
+        deltas: dict[uuid.UUID, int] = dict()
+        for transacao in lote:
+            linha = _aplica(transacao, estado, deltas)
+            if linha[2] == 'success':
+                estatisticas.aplicadas += 1
+            else:
+                estatisticas.rejeitadas += 1
+            registra(linha)
+        estatisticas.linhas += len(lote)
+
+        alterados = [{'produto_id': produto_id, 'delta': delta} for produto_id, delta in deltas.items() if delta]
+        if alterados:
+            db.session.execute(incrementa, alterados)
+        db.session.commit()
+        estatisticas.lotes += 1
+        estatisticas.segundos = time.perf_counter() - inicio
+        if progresso is not None:
+            progresso(estatisticas)
+    estatisticas.segundos = time.perf_counter() - inicio
+    return estatisticas
+
+
+def executa_compravenda(tarefa: Tarefa, tamanho_lote: int = 1000) -> None:
+    """
+    Processa, em segundo plano, o arquivo 'entrada' da tarefa, gravando o
+    resultado de cada linha em 'relatorio.csv' e o andamento no estado da tarefa
+    """
+    entrada = tarefa.arquivo('entrada')
+    tamanho = max(entrada.stat().st_size, 1)
+    with (open(entrada, 'rb') as arquivo,
+          open(tarefa.arquivo('relatorio.csv'), 'w', newline='', encoding='utf-8') as relatorio):
+        escritor = csv.writer(relatorio)
+        escritor.writerow(['linha', 'situacao', 'mensagem'])
+        numero = 0
+
+        def registra(linha: tuple[str, str, str]) -> None:
+            nonlocal numero
+            numero += 1
+            escritor.writerow([numero, 'aplicada' if linha[2] == 'success' else 'rejeitada', linha[0]])
+
+        def progresso(estatisticas: EstatisticasCompraVenda) -> None:
+            relatorio.flush()
+            tarefa.atualiza(linhas=estatisticas.linhas,
+                            aplicadas=estatisticas.aplicadas,
+                            rejeitadas=estatisticas.rejeitadas,
+                            percentual=min(99, int(arquivo.tell() * 100 / tamanho)),
+                            linhas_por_segundo=round(estatisticas.linhas_por_segundo))
+
+        try:
+            estatisticas = processa_transacoes(le_transacoes(arquivo), registra, tamanho_lote, progresso)
+        except ArquivoInvalido as e:
+            # As transações lidas antes do erro já foram aplicadas e estão no relatório
+            escritor.writerow([numero + 1, 'erro', str(e)])
+            raise
+    entrada.unlink()
+    tarefa.atualiza(linhas=estatisticas.linhas,
+                    aplicadas=estatisticas.aplicadas,
+                    rejeitadas=estatisticas.rejeitadas,
+                    percentual=100,
+                    segundos=round(estatisticas.segundos, 3),
+                    linhas_por_segundo=round(estatisticas.linhas_por_segundo))
@@ -0,0 +1,80 @@
+from typing import Callable
+
+import sqlalchemy as sa
+from flask import Flask, current_app
+
+
+class AtualizadorDeEsquema:
+    """
+    Atualiza, na inicialização, bancos criados por versões anteriores da
+    aplicação: cria as tabelas e os índices que faltam, acrescenta as colunas
+    novas dos modelos e executa os passos registrados pelos modelos (índices
+    que o ALTER TABLE não cria, preenchimento de colunas novas). Cada operação
+    verifica o estado do banco antes, e repetir a atualização não tem efeito
+    """
+
+    def __init__(self, app: Flask | None = None):
+        self._passos: list[tuple[str, Callable[[sa.Connection], bool]]] = list()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        app.extensions['esquema'] = self
+
+    def passo(self, nome: str) -> Callable:
+        """
+        Decorador que registra um passo de atualização. A função recebe a
+        conexão, já em transação, e devolve True se alterou alguma coisa
+        """
+
+        def registra(funcao: Callable[[sa.Connection], bool]):
+            self._passos.append((nome, funcao))
+            return funcao
+
+        return registra
+
+    @staticmethod
+    def _adiciona_coluna(conexao: sa.Connection, tabela: sa.Table, coluna: sa.Column) -> None:
+        if not coluna.nullable and coluna.server_default is None:
+            raise RuntimeError(f"Coluna {tabela.name}.{coluna.name} é obrigatória e sem valor padrão: "
+                               f"precisa de uma migração manual")
+        preparador = conexao.dialect.identifier_preparer
+        ddl = (f"ALTER TABLE {preparador.format_table(tabela)} ADD COLUMN {preparador.format_column(coluna)} "
+               f"{coluna.type.compile(dialect=conexao.dialect)}")
+        if coluna.server_default is not None:
+            padrao = coluna.server_default.arg
+            padrao = padrao.text if isinstance(padrao, sa.TextClause) else f"'{padrao}'"
+            ddl += f" NOT NULL DEFAULT {padrao}" if not coluna.nullable else f" DEFAULT {padrao}"
+        conexao.exec_driver_sql(ddl)
+
+    def atualiza(self) -> list[str]:
+        """
+        Deve ser chamada dentro de um contexto de aplicação. Devolve a
+        descrição das alterações feitas
+        """
+        from src.modules import db
+        alteracoes = list()
+        with db.engine.begin() as conexao:
+            inspetor = sa.inspect(conexao)
+            existentes = set(inspetor.get_table_names())
+            for tabela in db.metadata.sorted_tables:
+                if tabela.name not in existentes:
+                    tabela.create(conexao)
+                    alteracoes.append(f"tabela {tabela.name}")
+                    continue
+                colunas = {coluna['name'] for coluna in inspetor.get_columns(tabela.name)}
+                for coluna in tabela.columns:
+                    if coluna.name not in colunas:
+                        self._adiciona_coluna(conexao, tabela, coluna)
+                        alteracoes.append(f"coluna {tabela.name}.{coluna.name}")
+                indices = {indice['name'] for indice in inspetor.get_indexes(tabela.name)}
+                for indice in tabela.indexes:
+                    if indice.name not in indices:
+                        indice.create(conexao)
+                        alteracoes.append(f"índice {indice.name}")
+            for nome, funcao in self._passos:
+                if funcao(conexao):
+                    alteracoes.append(nome)
+        for alteracao in alteracoes:
+            current_app.logger.info(f"Esquema atualizado: {alteracao}")
+        return alteracoes
@@ -0,0 +1,100 @@
+import csv
+import io
+import json
+import zlib
+from typing import Iterable, Iterator
+
+import sqlalchemy as sa
+
+from src.modules import replicas, versoes
+
+FORMATOS = {
+    'json': ('application/json', 'json'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+# Os blocos gerados são agrupados até este tamanho antes de serem enviados
+_TAMANHO_DO_BLOCO = 16 * 1024
+
+
+def versao_da_tabela(cls: type) -> str | None:
+    """
+    Marca de versão da tabela de cls (versoes.marca), mantida por gatilhos
+    que a incrementam a cada INSERT, UPDATE ou DELETE: uma única leitura, sem
+    tocar nas linhas. None se a tabela não é monitorada ou se não há versões
+    """
+    return versoes.marca(cls.__tablename__)
+
+
+def linhas(sentenca: sa.Select, tamanho_lote: int = 1000) -> Iterator[sa.Row]:
+    # Cursor do lado do servidor: as linhas são lidas em lotes, sem materializar o resultado inteiro.
+    # A leitura dura o envio inteiro da resposta, então usa uma sessão própria, em uma réplica
+    with replicas.sessao_de_leitura() as sessao:
+        yield from sessao.execute(sentenca.execution_options(yield_per=tamanho_lote))
+
+
+def _como_dict(linha: sa.Row) -> dict:
+    return {chave: str(valor) if valor is not None and not isinstance(valor, (int, float, str)) else valor
+            for chave, valor in linha._mapping.items()}
+
+
+def gera_json(registros: Iterable[sa.Row]) -> Iterator[str]:
+    yield "["
+    separador = "\n"
+    for linha in registros:
+        yield separador + "  " + json.dumps(_como_dict(linha), sort_keys=True, ensure_ascii=False)
+        separador = ",\n"
+    yield "\n]\n"
+
+
+def gera_ndjson(registros: Iterable[sa.Row]) -> Iterator[str]:
+    for linha in registros:
+        yield json.dumps(_como_dict(linha), sort_keys=True, ensure_ascii=False) + "\n"
+
+
+def gera_csv(registros: Iterable[sa.Row]) -> Iterator[str]:
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    cabecalho = False
+    for linha in registros:
+        if not cabecalho:
+            escritor.writerow(linha._fields)
+            cabecalho = True
+        escritor.writerow(_como_dict(linha).values())
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+GERADORES = {
+    'json': gera_json,
+    'ndjson': gera_ndjson,
+    'csv': gera_csv,
+}
+
+
+def codifica(partes: Iterable[str], gzip: bool = False) -> Iterator[bytes]:
+    """
+    Converte as partes para UTF-8 e as agrupa em blocos, comprimindo com gzip
+    à medida que são geradas quando solicitado
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    pendente = list()
+    tamanho = 0
+    for parte in partes:
+        dados = parte.encode('utf-8')
+        pendente.append(dados)
+        tamanho += len(dados)
+        if tamanho >= _TAMANHO_DO_BLOCO:
+            bloco = b"".join(pendente)
+            pendente, tamanho = list(), 0
+            if compressor is not None:
+                bloco = compressor.compress(bloco)
+            if bloco:
+                yield bloco
+    bloco = b"".join(pendente)
+    if compressor is not None:
+        bloco = compressor.compress(bloco) + compressor.flush()
+    if bloco:
+        yield bloco
@@ -0,0 +1,44 @@
+import time
+import uuid
+from typing import Iterable
+
+from src.models.produto import Produto
+from src.modules import db, thumbnail_cache
+from src.services.imagens import normaliza, ImagemInvalida
+from src.services.tarefas import Tarefa
+
+
+def processa_foto(tarefa: Tarefa, produto_id: uuid.UUID, sequencia: int, dimensao_maxima: int,
+                  formatos: Iterable[str], qualidade: int) -> None:
+    """
+    Normaliza a foto enviada (arquivo 'entrada' da tarefa), grava o resultado
+    como foto do produto e já deixa as miniaturas no cache. Se a foto foi
+    enviada de novo ou removida depois deste envio (sequencia), o resultado
+    é descartado: as tarefas não terminam necessariamente na ordem de envio
+    """
+    entrada = tarefa.arquivo('entrada')
+    try:
+        dados = entrada.read_bytes()
+        normalizada = normaliza(dados, dimensao_maxima, formatos, qualidade, thumbnail_cache.tamanhos)
+    except ImagemInvalida as e:
+        tarefa.atualiza(situacao='erro', mensagem=str(e), concluida_em=time.time())
+        return
+    finally:
+        entrada.unlink(missing_ok=True)
+
+    foto_hash = Produto.define_foto_do_envio(produto_id, sequencia, normalizada.dados, normalizada.mime)
+    db.session.commit()
+    if foto_hash is None:
+        if Produto.get_by_id(produto_id) is None:
+            tarefa.atualiza(situacao='erro', mensagem="Produto removido antes do processamento da foto",
+                            concluida_em=time.time())
+        else:
+            tarefa.atualiza(situacao='descartada', mensagem="Foto substituída ou removida durante o processamento",
+                            concluida_em=time.time())
+        return
+
+    thumbnail_cache.invalida(produto_id)
+    for tamanho, miniatura in normalizada.miniaturas.items():
+        thumbnail_cache.grava(produto_id, tamanho, foto_hash, miniatura)
+    tarefa.atualiza(bytes_enviados=len(dados), bytes_gravados=len(normalizada.dados),
+                    largura=normalizada.largura, altura=normalizada.altura, mime=normalizada.mime)
@@ -0,0 +1,124 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Callable, Iterable
+
+from flask import Flask, Response
+# noinspection PyPackageRequirements
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class ServicoSobrecarregado(RuntimeError):
+    pass
+
+
+class ServicoDeHash:
+    """
+    Executa os hashes de senha (scrypt/pbkdf2), que são propositalmente lentos,
+    em um conjunto limitado de processos, liberando a thread da requisição e o
+    GIL. Quando a fila passa de HASH_FILA_MAXIMA e não libera espaço em
+    HASH_ESPERA_MAXIMA segundos, a requisição recebe 503 em vez de enfileirar
+    indefinidamente. Com HASH_WORKERS igual a 0 os hashes são feitos na própria
+    thread, como antes. Enquanto há hashes sendo feitos, as estatísticas da
+    fila vão para o log a cada HASH_LOG_INTERVALO segundos (0 desliga)
+    """
+
+    def __init__(self, app: Flask | None = None):
+        self.app: Flask | None = None
+        self.workers: int = 0
+        self.intervalo_do_log: float = 0
+        self._proximo_log: float = 0
+        self.espera_maxima: float = 0
+        self.fila_maxima: int = 0
+        self._executor: ProcessPoolExecutor | None = None
+        self._vagas: threading.BoundedSemaphore | None = None
+        self._pendentes = 0
+        self._rejeitados = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        self.app = app
+        self.intervalo_do_log = float(app.config.get('HASH_LOG_INTERVALO', 60))
+        self.workers = int(app.config.get('HASH_WORKERS', 2))
+        self.fila_maxima = int(app.config.get('HASH_FILA_MAXIMA', 32))
+        self.espera_maxima = float(app.config.get('HASH_ESPERA_MAXIMA', 5))
+        self._vagas = threading.BoundedSemaphore(self.fila_maxima)
+        app.extensions['hashing'] = self
+
+        @app.errorhandler(ServicoSobrecarregado)
+        def servico_sobrecarregado(e):
+            app.logger.warning(f"Serviço de hash sobrecarregado: {e} {self.estatisticas}")
+            return Response("Servidor ocupado. Tente novamente em alguns segundos",
+                            status=503, headers={'Retry-After': '5'}, mimetype='text/plain')
+
+    @property
+    def estatisticas(self) -> dict[str, int]:
+        return {'pendentes': self._pendentes,
+                'fila_maxima': self.fila_maxima,
+                'rejeitados': self._rejeitados,
+                'workers': self.workers}
+
+    def _obtem_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: a aplicação tem outras threads, e fork copiaria locks em estado inconsistente
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _submete(self, funcao: Callable, *args) -> Future:
+        if not self._vagas.acquire(timeout=self.espera_maxima):
+            with self._lock:
+                self._rejeitados += 1
+            raise ServicoSobrecarregado(f"{self._pendentes} hashes na fila")
+        with self._lock:
+            self._pendentes += 1
+        self._registra_no_log()
+        try:
+            futuro = self._obtem_executor().submit(funcao, *args)
+        except BaseException:
+            self._libera(None)
+            raise
+        futuro.add_done_callback(self._libera)
+        return futuro
+
+    def _registra_no_log(self) -> None:
+        if self.intervalo_do_log <= 0:
+            return
+        agora = time.monotonic()
+        with self._lock:
+            if agora < self._proximo_log:
+                return
+            self._proximo_log = agora + self.intervalo_do_log
+        self.app.logger.info(f"Serviço de hash: {self.estatisticas}")
+
+    def _libera(self, _futuro: Future | None) -> None:
+        with self._lock:
+            self._pendentes -= 1
+        self._vagas.release()
+
+    def gera(self, senha: str) -> str:
+        if self.workers <= 0:
+            return generate_password_hash(senha)
+        return self._submete(generate_password_hash, senha).result()
+
+    def gera_varios(self, senhas: Iterable[str]) -> list[str]:
+        # Os hashes são calculados em paralelo, um por processo
+        if self.workers <= 0:
+            return [generate_password_hash(senha) for senha in senhas]
+        futuros = [self._submete(generate_password_hash, senha) for senha in senhas]
+        return [futuro.result() for futuro in futuros]
+
+    def verifica(self, pwhash: str, senha: str) -> bool:
+        if self.workers <= 0:
+            return check_password_hash(pwhash, senha)
+        return self._submete(check_password_hash, pwhash, senha).result()
+
+    def encerra(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
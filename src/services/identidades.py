@@ -0,0 +1,114 @@
+import threading
+import time
+from typing import Any
+
+import sqlalchemy as sa
+from flask import Flask
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+
+class _Identidade:
+    __slots__ = ('expira', 'registro', 'papeis', 'mascara')
+
+    def __init__(self, expira: float, registro: Any, papeis: frozenset[str], mascara: int):
+        self.expira = expira
+        self.registro = registro
+        self.papeis = papeis
+        self.mascara = mascara
+
+
+class CacheDeIdentidades:
+    """
+    Cache, por alguns segundos, do usuário autenticado, do conjunto de nomes
+    dos seus papéis e da máscara de bits desses papéis, para que cada requisição não precise consultar o banco
+    antes da view. Guarda uma cópia desanexada das colunas do usuário, que é
+    reanexada à sessão com merge(load=False), sem consulta. As entradas são
+    invalidadas depois do commit de qualquer alteração nas classes observadas
+    """
+
+    def __init__(self, app: Flask | None = None):
+        self.ttl: float = 0
+        self._identidades: dict[Any, _Identidade] = dict()
+        self._observadas: dict[type, bool] = dict()
+        self._lock = threading.Lock()
+        sa.event.listen(Session, 'after_flush', self._registra_alteracoes)
+        sa.event.listen(Session, 'after_commit', self._aplica_invalidacoes)
+        sa.event.listen(Session, 'after_soft_rollback', self._descarta_invalidacoes)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        self.ttl = float(app.config.get('IDENTIDADES_TTL', 10))
+        app.extensions['identidades'] = self
+
+    def observa(self, cls: type, invalida_tudo: bool = False) -> None:
+        # Alterar um registro de cls invalida a identidade com o mesmo id, ou todas
+        # elas quando invalida_tudo (por exemplo, papéis compartilhados entre usuários)
+        self._observadas[cls] = invalida_tudo
+
+    def obtem(self, cls: type, registro_id: Any, perfil: str | None = None) -> Any:
+        """
+        Devolve o registro anexado à sessão atual, a partir do cache quando
+        possível, ou None se ele não existir
+        """
+        from src.modules import db
+        agora = time.monotonic()
+        with self._lock:
+            identidade = self._identidades.get(registro_id)
+        if identidade is not None and identidade.expira > agora:
+            registro = db.session.merge(identidade.registro, load=False)
+            registro.papeis_em_cache = identidade.papeis
+            registro.mascara_em_cache = identidade.mascara
+            return registro
+
+        registro = cls.get_by_id(registro_id, perfil=perfil)
+        if registro is None or self.ttl <= 0:
+            return registro
+        papeis, mascara = registro.papeis, registro.mascara_de_papeis
+        registro.papeis_em_cache, registro.mascara_em_cache = papeis, mascara
+        with self._lock:
+            if len(self._identidades) > 4096:
+                self._identidades.clear()
+            self._identidades[registro_id] = _Identidade(agora + self.ttl, self._copia(registro), papeis, mascara)
+        return registro
+
+    @staticmethod
+    def _copia(registro: Any) -> Any:
+        # Cópia desanexada apenas com as colunas, que pode ser compartilhada entre sessões
+        mapper = sa.inspect(registro).mapper
+        copia = mapper.class_manager.new_instance()
+        for atributo in mapper.column_attrs:
+            setattr(copia, atributo.key, getattr(registro, atributo.key))
+        make_transient_to_detached(copia)
+        return copia
+
+    def invalida(self, registro_id: Any = None) -> None:
+        with self._lock:
+            if registro_id is None:
+                self._identidades.clear()
+            else:
+                self._identidades.pop(registro_id, None)
+
+    def _registra_alteracoes(self, session: Session, _flush_context) -> None:
+        if not self._observadas:
+            return
+        pendentes = session.info.setdefault('identidades_invalidadas', set())
+        for instancia in (*session.new, *session.dirty, *session.deleted):
+            invalida_tudo = self._observadas.get(type(instancia))
+            if invalida_tudo is None:
+                continue
+            pendentes.add(None if invalida_tudo else instancia.id)
+
+    def _aplica_invalidacoes(self, session: Session) -> None:
+        pendentes = session.info.pop('identidades_invalidadas', None)
+        if not pendentes:
+            return
+        if None in pendentes:
+            self.invalida()
+            return
+        for registro_id in pendentes:
+            self.invalida(registro_id)
+
+    @staticmethod
+    def _descarta_invalidacoes(session: Session, _transacao) -> None:
+        session.info.pop('identidades_invalidadas', None)
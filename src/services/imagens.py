@@ -0,0 +1,158 @@
+import io
+from typing import BinaryIO, Iterable, NamedTuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Formatos aceitos no envio, identificados pelo conteúdo do arquivo e não pela extensão ou mimetype
+FORMATOS_ACEITOS = ('JPEG', 'MPO', 'PNG', 'WEBP')
+
+# MPO é o JPEG com imagens adicionais (profundidade, prévia) gravado por muitos
+# celulares; a primeira imagem é um JPEG comum, e é só ela que é usada
+FORMATOS_EQUIVALENTES = {
+    'MPO': 'JPEG',
+}
+
+MIME_DOS_FORMATOS = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp',
+    'AVIF': 'image/avif',
+}
+
+ORIENTACAO_EXIF = 0x0112
+
+
+class ImagemInvalida(ValueError):
+    pass
+
+
+class ImagemNormalizada(NamedTuple):
+    dados: bytes
+    mime: str
+    largura: int
+    altura: int
+    miniaturas: dict[int, bytes]
+
+
+def identifica(arquivo: BinaryIO) -> str:
+    """
+    Verificação rápida, feita na requisição: lê apenas o cabeçalho para
+    identificar o formato. A decodificação completa fica para normaliza()
+    """
+    posicao = arquivo.tell()
+    try:
+        with Image.open(arquivo) as imagem:
+            formato = imagem.format
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        raise ImagemInvalida("Arquivo enviado não é uma imagem válida") from e
+    finally:
+        arquivo.seek(posicao)
+    if formato not in FORMATOS_ACEITOS:
+        raise ImagemInvalida(f"Formato de imagem não aceito ({formato})")
+    return FORMATOS_EQUIVALENTES.get(formato, formato)
+
+
+def formato_de_saida(preferidos: Iterable[str]) -> str:
+    # Primeiro formato da lista que a instalação do Pillow consegue gravar
+    Image.init()
+    for formato in preferidos:
+        formato = formato.upper()
+        if formato in MIME_DOS_FORMATOS and formato in Image.SAVE:
+            return formato
+    return 'JPEG'
+
+
+def _decodifica(dados: bytes) -> Image.Image:
+    try:
+        imagem = Image.open(io.BytesIO(dados))
+        if imagem.format not in FORMATOS_ACEITOS:
+            raise ImagemInvalida(f"Formato de imagem não aceito ({imagem.format})")
+        # Decodifica por completo: arquivos truncados ou corrompidos falham aqui
+        imagem.load()
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise ImagemInvalida("Arquivo enviado não é uma imagem válida") from e
+    return imagem
+
+
+def _prepara_modo(imagem: Image.Image, formato: str) -> Image.Image:
+    transparente = imagem.mode in ('RGBA', 'LA', 'PA') or \
+                   (imagem.mode == 'P' and 'transparency' in imagem.info)
+    if not transparente:
+        return imagem if imagem.mode == 'RGB' else imagem.convert('RGB')
+    imagem = imagem if imagem.mode == 'RGBA' else imagem.convert('RGBA')
+    if formato != 'JPEG':
+        return imagem
+    # JPEG não tem canal alfa: compõe sobre fundo branco
+    fundo = Image.new('RGB', imagem.size, (255, 255, 255))
+    fundo.paste(imagem, mask=imagem.getchannel('A'))
+    return fundo
+
+
+def codifica(imagem: Image.Image, formato: str, qualidade: int, otimiza: bool = True) -> bytes:
+    # otimiza: tabelas de Huffman otimizadas e JPEG progressivo, que só compensam em imagens grandes
+    saida = io.BytesIO()
+    icc_profile = imagem.info.get('icc_profile')
+    if formato == 'JPEG':
+        imagem.save(saida, format=formato, quality=qualidade, optimize=otimiza, progressive=otimiza,
+                    icc_profile=icc_profile)
+    elif formato == 'WEBP':
+        imagem.save(saida, format=formato, quality=qualidade, method=4, icc_profile=icc_profile)
+    elif formato == 'AVIF':
+        imagem.save(saida, format=formato, quality=qualidade, icc_profile=icc_profile)
+    else:
+        imagem.save(saida, format=formato, optimize=otimiza, icc_profile=icc_profile)
+    return saida.getvalue()
+
+
+def normaliza(dados: bytes, dimensao_maxima: int, formatos: Iterable[str], qualidade: int,
+              tamanhos_miniaturas: Iterable[int] = ()) -> ImagemNormalizada:
+    """
+    Decodifica a imagem enviada, aplica a orientação indicada no EXIF e
+    descarta os metadados, reduz o original para caber em dimensao_maxima e o
+    recodifica no primeiro dos formatos suportado. As miniaturas são geradas na
+    mesma passada, cada uma a partir da anterior (maior), e não do original
+    """
+    imagem = _decodifica(dados)
+    formato = formato_de_saida(formatos)
+
+    imagem = ImageOps.exif_transpose(imagem)
+    imagem.info.pop('exif', None)
+    imagem = _prepara_modo(imagem, formato)
+    imagem.thumbnail((dimensao_maxima, dimensao_maxima), Image.Resampling.LANCZOS, reducing_gap=3.0)
+    largura, altura = imagem.size
+    original = codifica(imagem, formato, qualidade)
+
+    miniaturas = dict()
+    atual = imagem
+    for tamanho in sorted(set(tamanhos_miniaturas), reverse=True):
+        atual = atual.copy()
+        atual.thumbnail((tamanho, tamanho), Image.Resampling.LANCZOS)
+        miniaturas[tamanho] = codifica(atual, formato, qualidade, otimiza=False)
+    return ImagemNormalizada(original, MIME_DOS_FORMATOS[formato], largura, altura, miniaturas)
+
+
+def miniatura(dados: bytes, max_size: int, qualidade: int = 85) -> tuple[bytes, str]:
+    """
+    Miniatura que cabe em max_size x max_size, no formato da imagem original.
+    Em JPEG, o modo draft decodifica a imagem já reduzida (1/2, 1/4 ou 1/8),
+    sem passar pela resolução completa
+    """
+    try:
+        imagem = Image.open(io.BytesIO(dados))
+        formato = FORMATOS_EQUIVALENTES.get(imagem.format, imagem.format)
+        fator = max(imagem.size) / max_size
+        # Em reduções grandes, reduce() (média de blocos, barata) leva a imagem a até
+        # 2x o tamanho final e o LANCZOS só atua no último passo; em reduções
+        # pequenas o BICUBIC é visualmente equivalente e mais rápido
+        if fator >= 2:
+            filtro, reducing_gap = Image.Resampling.LANCZOS, 2.0
+        else:
+            filtro, reducing_gap = Image.Resampling.BICUBIC, None
+        # O draft precisa vir antes de qualquer acesso aos pixels: exif_transpose carrega a imagem
+        imagem.draft(None, (max_size * 2, max_size * 2))
+        if imagem.getexif().get(ORIENTACAO_EXIF, 1) != 1:
+            imagem = ImageOps.exif_transpose(imagem)
+        imagem.thumbnail((max_size, max_size), filtro, reducing_gap=reducing_gap)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, SyntaxError) as e:
+        raise ImagemInvalida("Foto armazenada não é uma imagem válida") from e
+    return codifica(imagem, formato, qualidade, otimiza=False), MIME_DOS_FORMATOS.get(formato, f"image/{formato.lower()}")
@@ -0,0 +1,126 @@
+import math
+import random
+import sqlite3
+import time
+from functools import wraps
+from pathlib import Path
+from typing import Callable
+
+from flask import Flask, current_app, request, flash, render_template
+
+from src.services.armazem_compartilhado import ArmazemCompartilhado
+
+# Regras padrão: capacidade do balde e período (segundos) para reabastecê-lo por completo
+REGRAS_PADRAO: dict[str, tuple[int, int]] = {
+    'login_ip': (30, 300),
+    'login_email': (10, 900),
+    'get2fa_ip': (30, 300),
+    'get2fa_usuario': (10, 900),
+    'new_password_ip': (10, 3600),
+    'new_password_email': (3, 3600),
+    'revalida_email_ip': (10, 3600),
+    'revalida_email_usuario': (3, 3600),
+}
+
+
+class LimiteExcedido(Exception):
+    def __init__(self, regra: str, espera: float):
+        super().__init__(f"Limite \"{regra}\" excedido")
+        self.regra = regra
+        self.espera = espera
+
+
+class LimitadorDeTaxa:
+    """
+    Limites de taxa por balde de fichas (token bucket), identificados por regra
+    e chave (IP, email, id do usuário). Os baldes ficam em um arquivo SQLite
+    compartilhado por todos os workers, e cada consumo é uma transação curta.
+    O IP é o request.remote_addr: atrás de proxy reverso, PROXIES_CONFIAVEIS
+    precisa indicar quantos proxies há na frente da aplicação, ou todos os
+    clientes cairão no balde do IP do proxy
+    """
+
+    def __init__(self, app: Flask | None = None):
+        self.ativo = True
+        self.regras: dict[str, tuple[int, int]] = dict(REGRAS_PADRAO)
+        self._armazem: ArmazemCompartilhado | None = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        self.ativo = bool(app.config.get('RATE_LIMIT_ATIVO', True))
+        for regra, (capacidade, periodo) in app.config.get('RATE_LIMITS', dict()).items():
+            self.regras[regra] = (int(capacidade), int(periodo))
+        caminho = Path(app.instance_path) / Path(app.config.get('RATE_LIMIT_DB', 'limites.sqlite3'))
+        self._armazem = ArmazemCompartilhado(caminho, [
+            "CREATE TABLE IF NOT EXISTS baldes (chave TEXT PRIMARY KEY, fichas REAL NOT NULL, "
+            "atualizado REAL NOT NULL)",
+        ])
+        app.extensions['limites'] = self
+
+        @app.errorhandler(LimiteExcedido)
+        def limite_excedido(e):
+            app.logger.warning(f"{e} ({request.remote_addr})")
+            espera = math.ceil(e.espera)
+            flash(f"Muitas tentativas. Tente novamente em {espera} segundos", category='danger')
+            return render_template('index.jinja', title="Página inicial"), 429, {'Retry-After': str(espera)}
+
+    def consome(self, regra: str, chave: str | None, consome: bool = True) -> float:
+        """
+        Consome uma ficha do balde. Devolve 0 se permitido, ou os segundos até
+        a próxima ficha se o limite foi atingido. Com consome=False, apenas
+        verifica se há ficha, sem gastá-la
+        """
+        if not self.ativo or chave is None:
+            return 0.0
+        capacidade, periodo = self.regras[regra]
+        taxa = capacidade / periodo
+        agora = time.time()
+        chave_completa = f"{regra}:{chave}"
+        try:
+            with self._armazem.transacao() as conexao:
+                linha = conexao.execute("SELECT fichas, atualizado FROM baldes WHERE chave = ?",
+                                        (chave_completa,)).fetchone()
+                fichas = capacidade if linha is None else min(capacidade, linha[0] + (agora - linha[1]) * taxa)
+                espera = 0.0
+                if fichas < 1:
+                    espera = (1 - fichas) / taxa
+                elif consome:
+                    fichas -= 1
+                if not consome:
+                    return espera
+                conexao.execute("INSERT INTO baldes(chave, fichas, atualizado) VALUES (?, ?, ?) "
+                                "ON CONFLICT(chave) DO UPDATE SET fichas = excluded.fichas, "
+                                "atualizado = excluded.atualizado",
+                                (chave_completa, fichas, agora))
+                if random.random() < 0.001:
+                    # Baldes parados há mais de um dia já estariam cheios
+                    conexao.execute("DELETE FROM baldes WHERE atualizado < ?", (agora - 86400,))
+        except sqlite3.OperationalError as e:
+            # O limite não pode derrubar a aplicação: na falha do armazém, permite
+            current_app.logger.error(f"Limitador de taxa indisponível: {e}")
+            return 0.0
+        return espera
+
+    def verifica(self, regra: str, chave: str | None, consome: bool = True) -> None:
+        espera = self.consome(regra, chave, consome)
+        if espera > 0:
+            raise LimiteExcedido(regra, espera)
+
+    def limita(self, regra: str, chave: Callable[..., str | None] | None = None,
+               metodos: tuple[str, ...] = ('POST',)):
+        """
+        Decorador de view. Por padrão a chave é o IP de origem, e apenas os
+        métodos indicados consomem fichas
+        """
+
+        def wrapper(funcao_de_view):
+            @wraps(funcao_de_view)
+            def decorator(*args, **kwargs):
+                if request.method in metodos:
+                    self.verifica(regra, chave(*args, **kwargs) if chave is not None else request.remote_addr)
+                return funcao_de_view(*args, **kwargs)
+
+            return decorator
+
+        return wrapper
@@ -0,0 +1,131 @@
+import base64
+import json
+import threading
+import time
+import uuid
+from typing import Any, Iterator
+
+import sqlalchemy as sa
+from flask import current_app
+
+from src.modules import db
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def codifica_cursor(valores: tuple, direcao: str) -> str:
+    conteudo = json.dumps({'v': [str(v) if isinstance(v, uuid.UUID) else v for v in valores], 'd': direcao},
+                          separators=(',', ':'), ensure_ascii=False)
+    return base64.urlsafe_b64encode(conteudo.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decodifica_cursor(cursor: str) -> tuple[list, str]:
+    try:
+        conteudo = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        dados = json.loads(conteudo.decode('utf-8'))
+        valores, direcao = dados['v'], dados['d']
+    except (ValueError, KeyError, TypeError) as e:
+        raise CursorInvalido(f"Cursor inválido: {cursor}") from e
+    if direcao not in ('p', 'a') or not isinstance(valores, list):
+        raise CursorInvalido(f"Cursor inválido: {cursor}")
+    return valores, direcao
+
+
+class _CacheDeTotais:
+    # Totais por sentença (SQL + parâmetros), mantidos por alguns segundos
+    def __init__(self):
+        self._totais: dict[tuple, tuple[float, int]] = dict()
+        self._lock = threading.Lock()
+
+    def obtem(self, sentenca: sa.Select, ttl: int) -> int:
+        compilada = sentenca.compile(db.engine)
+        chave = (str(compilada), tuple(sorted((k, str(v)) for k, v in compilada.params.items())))
+        agora = time.monotonic()
+        with self._lock:
+            registro = self._totais.get(chave)
+        if registro is not None and registro[0] > agora:
+            return registro[1]
+        total = db.session.execute(sa.select(sa.func.count()).
+                                   select_from(sentenca.order_by(None).subquery())).scalar_one()
+        with self._lock:
+            if len(self._totais) > 1024:
+                self._totais.clear()
+            self._totais[chave] = (agora + ttl, total)
+        return total
+
+
+_totais = _CacheDeTotais()
+
+
+class PaginaPorCursor:
+    """
+    Página obtida por paginação por chave (keyset), ordenada pelas colunas
+    indicadas. Não usa OFFSET, então o custo não cresce com a profundidade
+    """
+
+    def __init__(self, items: list, per_page: int, colunas: tuple[str, ...],
+                 has_prev: bool, has_next: bool, total: int | None = None):
+        self.items = items
+        self.per_page = per_page
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.total = total
+        self._colunas = colunas
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.items)
+
+    def _cursor(self, item: Any, direcao: str) -> str:
+        return codifica_cursor(tuple(getattr(item, c) for c in self._colunas), direcao)
+
+    @property
+    def next_cursor(self) -> str | None:
+        return self._cursor(self.items[-1], 'p') if self.has_next and self.items else None
+
+    @property
+    def prev_cursor(self) -> str | None:
+        return self._cursor(self.items[0], 'a') if self.has_prev and self.items else None
+
+
+def pagina_por_cursor(sentenca: sa.Select, colunas: tuple, cursor: str | None, per_page: int,
+                      contar_total: bool = True) -> PaginaPorCursor:
+    # As colunas devem identificar unicamente cada linha, como (nome, id)
+    if per_page < 1:
+        raise ValueError(f"Tamanho de página inválido: {per_page}")
+    nomes = tuple(c.key for c in colunas)
+    direcao = 'p'
+    base = sentenca.order_by(None)
+    if cursor:
+        valores, direcao = decodifica_cursor(cursor)
+        if len(valores) != len(colunas):
+            raise CursorInvalido(f"Cursor inválido: {cursor}")
+        try:
+            valores = [uuid.UUID(v) if isinstance(c.type, sa.Uuid) else v for c, v in zip(colunas, valores)]
+        except (ValueError, TypeError, AttributeError) as e:
+            raise CursorInvalido(f"Cursor inválido: {cursor}") from e
+        limite = sa.tuple_(*[sa.literal(v, c.type) for c, v in zip(colunas, valores)])
+        if direcao == 'p':
+            base = base.where(sa.tuple_(*colunas) > limite)
+        else:
+            base = base.where(sa.tuple_(*colunas) < limite)
+
+    if direcao == 'p':
+        base = base.order_by(*[c.asc() for c in colunas])
+    else:
+        base = base.order_by(*[c.desc() for c in colunas])
+
+    items = list(db.session.execute(base.limit(per_page + 1)).unique().scalars())
+    ha_mais = len(items) > per_page
+    items = items[:per_page]
+    if direcao == 'p':
+        has_prev, has_next = cursor is not None, ha_mais
+    else:
+        items.reverse()
+        has_prev, has_next = ha_mais, True
+
+    total = None
+    if contar_total:
+        total = _totais.obtem(sentenca, int(current_app.config.get('PAGINACAO_TOTAL_TTL', 60)))
+    return PaginaPorCursor(items, per_page, nomes, has_prev, has_next, total)
@@ -0,0 +1,136 @@
+import datetime
+import zlib
+from typing import Iterable, Iterator, NamedTuple
+
+# Página A4, em pontos
+LARGURA_PAGINA = 595
+ALTURA_PAGINA = 842
+MARGEM = 40
+TAMANHO_FONTE = 9
+ALTURA_LINHA = 14
+# Courier é monoespaçada (600/1000 do tamanho da fonte), o que permite alinhar e
+# truncar os textos sem as tabelas de métricas de uma fonte proporcional
+LARGURA_CARACTERE = 0.6 * TAMANHO_FONTE
+
+
+class Coluna(NamedTuple):
+    titulo: str
+    largura: float
+    alinhamento: str = 'esquerda'  # esquerda, direita ou centro
+
+
+def _texto_pdf(texto: str) -> bytes:
+    dados = texto.encode('cp1252', errors='replace')
+    return b"(" + dados.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def _ajusta(texto: str, coluna: Coluna) -> tuple[str, float]:
+    # Trunca o texto na largura da coluna e devolve o deslocamento horizontal para o alinhamento
+    maximo = max(1, int((coluna.largura - 4) / LARGURA_CARACTERE))
+    if len(texto) > maximo:
+        texto = texto[:maximo - 1] + "…"
+    sobra = coluna.largura - 4 - len(texto) * LARGURA_CARACTERE
+    if coluna.alinhamento == 'direita':
+        return texto, 2 + sobra
+    if coluna.alinhamento == 'centro':
+        return texto, 2 + sobra / 2
+    return texto, 2
+
+
+class _Escritor:
+    def __init__(self):
+        self.posicao = 0
+        self.deslocamentos: dict[int, int] = dict()
+
+    def objeto(self, numero: int, conteudo: bytes) -> bytes:
+        self.deslocamentos[numero] = self.posicao
+        dados = f"{numero} 0 obj\n".encode('ascii') + conteudo + b"\nendobj\n"
+        self.posicao += len(dados)
+        return dados
+
+    def bruto(self, dados: bytes) -> bytes:
+        self.posicao += len(dados)
+        return dados
+
+
+def _conteudo_da_pagina(titulo: str, colunas: list[Coluna], linhas: list[tuple[str, ...]], pagina: int,
+                        gerado_em: str) -> bytes:
+    comandos = list()
+    topo = ALTURA_PAGINA - MARGEM
+    comandos.append(b"BT /F2 14 Tf 1 0 0 1 %d %.2f Tm " % (MARGEM, topo - 14) + _texto_pdf(titulo) + b" Tj ET")
+    y = topo - 40
+    # Cabeçalho da tabela, repetido em todas as páginas
+    comandos.append(b"0.85 g %d %.2f %d %d re f 0 g" % (MARGEM, y - 4, LARGURA_PAGINA - 2 * MARGEM, ALTURA_LINHA))
+    x = MARGEM
+    for coluna in colunas:
+        texto, deslocamento = _ajusta(coluna.titulo, coluna)
+        comandos.append(b"BT /F3 %d Tf 1 0 0 1 %.2f %.2f Tm " % (TAMANHO_FONTE, x + deslocamento, y) +
+                        _texto_pdf(texto) + b" Tj ET")
+        x += coluna.largura
+    for indice, linha in enumerate(linhas):
+        y -= ALTURA_LINHA
+        if indice % 2:
+            comandos.append(b"0.95 g %d %.2f %d %d re f 0 g" % (MARGEM, y - 4, LARGURA_PAGINA - 2 * MARGEM,
+                                                                  ALTURA_LINHA))
+        x = MARGEM
+        for coluna, valor in zip(colunas, linha):
+            texto, deslocamento = _ajusta(valor, coluna)
+            comandos.append(b"BT /F1 %d Tf 1 0 0 1 %.2f %.2f Tm " % (TAMANHO_FONTE, x + deslocamento, y) +
+                            _texto_pdf(texto) + b" Tj ET")
+            x += coluna.largura
+    rodape = f"Gerado em {gerado_em} - Página {pagina}"
+    comandos.append(b"BT /F1 8 Tf 1 0 0 1 %d %d Tm " % (MARGEM, MARGEM - 16) + _texto_pdf(rodape) + b" Tj ET")
+    return b"\n".join(comandos)
+
+
+def gera_tabela_pdf(titulo: str, colunas: list[Coluna], linhas: Iterable[tuple[str, ...]]) -> Iterator[bytes]:
+    """
+    Gera um PDF com uma tabela, página a página. Cada página é enviada assim
+    que fica pronta, e apenas as linhas dela ficam em memória
+    """
+    escritor = _Escritor()
+    linhas_por_pagina = int((ALTURA_PAGINA - 2 * MARGEM - 40) // ALTURA_LINHA) - 1
+    gerado_em = datetime.datetime.now().strftime('%d/%m/%Y %H:%M')
+
+    # 1: catálogo, 2: árvore de páginas (gravada no fim), 3 a 5: fontes
+    yield escritor.bruto(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    yield escritor.objeto(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    for numero, fonte in ((3, b"Courier"), (4, b"Helvetica-Bold"), (5, b"Courier-Bold")):
+        yield escritor.objeto(numero, b"<< /Type /Font /Subtype /Type1 /BaseFont /" + fonte +
+                              b" /Encoding /WinAnsiEncoding >>")
+
+    paginas: list[int] = list()
+    proximo = 6
+
+    def pagina_pronta(conteudo_das_linhas: list[tuple[str, ...]]) -> bytes:
+        nonlocal proximo
+        conteudo = zlib.compress(_conteudo_da_pagina(titulo, colunas, conteudo_das_linhas, len(paginas) + 1,
+                                                     gerado_em))
+        numero_conteudo, numero_pagina = proximo, proximo + 1
+        proximo += 2
+        paginas.append(numero_pagina)
+        return (escritor.objeto(numero_conteudo, b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(conteudo) +
+                                conteudo + b"\nendstream") +
+                escritor.objeto(numero_pagina, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+                                               b"/Resources << /Font << /F1 3 0 R /F2 4 0 R /F3 5 0 R >> >> "
+                                               b"/Contents %d 0 R >>" % (LARGURA_PAGINA, ALTURA_PAGINA,
+                                                                         numero_conteudo)))
+
+    pendentes: list[tuple[str, ...]] = list()
+    for linha in linhas:
+        pendentes.append(linha)
+        if len(pendentes) == linhas_por_pagina:
+            yield pagina_pronta(pendentes)
+            pendentes = list()
+    if pendentes or not paginas:
+        yield pagina_pronta(pendentes)
+
+    kids = b" ".join(b"%d 0 R" % numero for numero in paginas)
+    yield escritor.objeto(2, b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(paginas))
+
+    inicio_xref = escritor.posicao
+    tabela = [b"xref\n0 %d\n" % proximo, b"0000000000 65535 f \n"]
+    for numero in range(1, proximo):
+        tabela.append(b"%010d 00000 n \n" % escritor.deslocamentos[numero])
+    tabela.append(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (proximo, inicio_xref))
+    yield escritor.bruto(b"".join(tabela))
@@ -0,0 +1,92 @@
+import re
+from typing import Any
+
+import sqlalchemy as sa
+from flask import Flask
+
+PRAGMAS_PADRAO: dict[str, Any] = {
+    # WAL: leitores não bloqueiam o escritor, e o escritor não bloqueia os leitores
+    'journal_mode': 'WAL',
+    # Em WAL, NORMAL só perde as últimas transações numa queda de energia, sem corromper o banco
+    'synchronous': 'NORMAL',
+    # Em vez de "database is locked" imediato, espera o lock de escrita por até 5 segundos
+    'busy_timeout': 5000,
+    # Valor negativo é em KiB: 16 MiB de cache de páginas por conexão
+    'cache_size': -16000,
+    'mmap_size': 128 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+
+class PerfilSQLite:
+    """
+    Ajustes do SQLite para uso com vários workers e threads: PRAGMAs aplicados
+    a cada conexão aberta pelo pool e um engine separado, somente leitura, com
+    pool próprio, usado pelo roteamento de leituras (RoteadorDeReplicas) quando
+    não há réplicas configuradas
+    """
+
+    def __init__(self, app: Flask | None = None):
+        self.ativo = False
+        self.pragmas: dict[str, Any] = dict()
+        self.engine_de_leitura: sa.Engine | None = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        # Deve ser chamada depois de db.init_app, que cria o engine principal
+        from src.modules import db
+        app.extensions['perfil_sqlite'] = self
+        self.ativo = bool(app.config.get('SQLITE_PERFIL_ATIVO', True))
+        self.pragmas = dict(PRAGMAS_PADRAO)
+        self.pragmas.update(app.config.get('SQLITE_PRAGMAS', dict()))
+        for nome in self.pragmas:
+            if not re.fullmatch(r'[a-z_]+', nome):
+                raise ValueError(f"PRAGMA inválido: \"{nome}\"")
+        if not self.ativo:
+            return
+        with app.app_context():
+            engine = db.engine
+        if engine.dialect.name != 'sqlite':
+            app.logger.warning("Perfil SQLite ignorado: o banco não é SQLite")
+            self.ativo = False
+            return
+        sa.event.listen(engine, 'connect', self._aplica_pragmas)
+
+        if engine.url.database in (None, '', ':memory:'):
+            return
+        self.engine_de_leitura = sa.create_engine(engine.url,
+                                                  pool_size=int(app.config.get('SQLITE_LEITURA_POOL', 5)),
+                                                  max_overflow=int(app.config.get('SQLITE_LEITURA_OVERFLOW', 5)))
+        self.configura_leitura(self.engine_de_leitura)
+
+    @staticmethod
+    def _formata(valor: Any) -> str:
+        if isinstance(valor, bool):
+            return 'ON' if valor else 'OFF'
+        return str(valor)
+
+    def _aplica_pragmas(self, conexao, _registro) -> None:
+        cursor = conexao.cursor()
+        try:
+            for nome, valor in self.pragmas.items():
+                cursor.execute(f"PRAGMA {nome} = {self._formata(valor)}")
+        finally:
+            cursor.close()
+
+    def _aplica_pragmas_de_leitura(self, conexao, registro) -> None:
+        self._aplica_pragmas(conexao, registro)
+        cursor = conexao.cursor()
+        try:
+            # Qualquer escrita por este engine é um erro de programação
+            cursor.execute("PRAGMA query_only = ON")
+        finally:
+            cursor.close()
+
+    def configura_leitura(self, engine: sa.Engine) -> None:
+        """
+        Aplica o perfil, mais query_only, a um engine de leitura (o próprio ou
+        de uma réplica). Engines que não são SQLite não são alterados
+        """
+        if self.ativo and engine.dialect.name == 'sqlite':
+            sa.event.listen(engine, 'connect', self._aplica_pragmas_de_leitura)
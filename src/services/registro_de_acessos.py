@@ -0,0 +1,161 @@
+import atexit
+import datetime
+import random
+import threading
+import traceback
+from typing import NamedTuple
+
+import sqlalchemy as sa
+from flask import Flask
+
+
+class RegistroAcesso(NamedTuple):
+    usuario_id: object
+    dta_acesso: datetime.datetime
+    ip: str | None
+
+
+class RegistroDeAcessos:
+    """
+    Registro dos logins na tabela acessos. O login só acrescenta o acesso a
+    uma lista em memória; uma thread grava a lista em lote, com um único
+    INSERT, a cada ACESSOS_INTERVALO segundos ou assim que ela chega a
+    ACESSOS_LOTE registros. Assim a tabela de usuários não é alterada a cada
+    login. O que ainda estiver na lista é gravado quando o processo termina
+    """
+
+    def __init__(self, app: Flask | None = None):
+        self.app: Flask | None = None
+        self.lote: int = 100
+        self.intervalo: float = 5
+        self.max_pendentes: int = 10000
+        self.retencao_dias: int = 180
+        self._pendentes: list[RegistroAcesso] = list()
+        self._acorda = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._lock_da_gravacao = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        self.app = app
+        self.lote = int(app.config.get('ACESSOS_LOTE', 100))
+        self.intervalo = float(app.config.get('ACESSOS_INTERVALO', 5))
+        self.max_pendentes = int(app.config.get('ACESSOS_MAX_PENDENTES', 10000))
+        self.retencao_dias = int(app.config.get('ACESSOS_RETENCAO_DIAS', 180))
+        app.extensions['registro_de_acessos'] = self
+        atexit.register(self.grava)
+
+    @staticmethod
+    def _agora() -> datetime.datetime:
+        return datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+
+    def registra(self, usuario_id, ip: str | None) -> None:
+        """
+        Anota um acesso. Não faz nenhuma operação no banco
+        """
+        with self._lock:
+            self._pendentes.append(RegistroAcesso(usuario_id, self._agora(), ip))
+            if len(self._pendentes) > self.max_pendentes:
+                # Banco indisponível por muito tempo: descarta os mais antigos, para não crescer sem limite
+                del self._pendentes[:len(self._pendentes) - self.max_pendentes]
+            cheia = len(self._pendentes) >= self.lote
+        if cheia:
+            self._acorda.set()
+
+    def inicia(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._executa, name='registro-de-acessos', daemon=True)
+                self._thread.start()
+
+    def _executa(self) -> None:
+        while True:
+            self._acorda.wait(self.intervalo)
+            self._acorda.clear()
+            self.grava()
+
+    def grava(self) -> int:
+        """
+        Grava os acessos pendentes. Devolve quantos foram gravados
+        """
+        from src.models.acesso import Acesso
+        from src.modules import db
+        with self._lock_da_gravacao:
+            with self._lock:
+                pendentes, self._pendentes = self._pendentes, list()
+            if not pendentes:
+                return 0
+            with self.app.app_context():
+                try:
+                    db.session.execute(sa.insert(Acesso), [registro._asdict() for registro in pendentes])
+                    if random.random() < 0.01:
+                        self.remove_expirados()
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.error(f"Registro de acessos: {e}\n{traceback.format_exc()}")
+                    # Devolve o lote à lista, na frente dos que chegaram nesse meio tempo
+                    with self._lock:
+                        self._pendentes[:0] = pendentes
+                        if len(self._pendentes) > self.max_pendentes:
+                            del self._pendentes[:len(self._pendentes) - self.max_pendentes]
+                    return 0
+                finally:
+                    db.session.remove()
+        return len(pendentes)
+
+    def remove_expirados(self) -> None:
+        """
+        Remove os acessos mais antigos que ACESSOS_RETENCAO_DIAS, exceto os
+        dois mais recentes de cada usuário: são o único registro do último
+        acesso de quem não entra há mais tempo que isso. Não faz o commit
+        """
+        from src.models.acesso import Acesso
+        from src.modules import db
+        limite = self._agora() - datetime.timedelta(days=self.retencao_dias)
+        ordenados = sa.select(Acesso.id, Acesso.dta_acesso,
+                              sa.func.row_number().over(partition_by=Acesso.usuario_id,
+                                                        order_by=Acesso.dta_acesso.desc()).label('ordem')). \
+            subquery()
+        expirados = sa.select(ordenados.c.id).where(ordenados.c.ordem > 2, ordenados.c.dta_acesso < limite)
+        db.session.execute(sa.delete(Acesso).where(Acesso.id.in_(expirados)))
+
+    def ultimos(self, usuario_id, quantidade: int = 2) -> list[RegistroAcesso]:
+        """
+        Acessos mais recentes do usuário, do mais novo para o mais antigo,
+        incluindo os que ainda não foram gravados
+        """
+        from src.models.acesso import Acesso
+        from src.modules import db
+        with self._lock:
+            registros = [registro for registro in self._pendentes if registro.usuario_id == usuario_id]
+        sentenca = sa.select(Acesso.usuario_id, Acesso.dta_acesso, Acesso.ip). \
+            where(Acesso.usuario_id == usuario_id). \
+            order_by(Acesso.dta_acesso.desc()). \
+            limit(quantidade)
+        registros.extend(RegistroAcesso(*linha) for linha in db.session.execute(sentenca))
+        registros.sort(key=lambda registro: registro.dta_acesso, reverse=True)
+        return registros[:quantidade]
+
+    @staticmethod
+    def resumo():
+        """
+        Subconsulta com o acesso atual e o anterior de cada usuário (colunas
+        usuario_id, dta_atual, ip_atual, dta_anterior e ip_anterior), obtidos em
+        uma única passada pelo índice (usuario_id, dta_acesso)
+        """
+        from src.models.acesso import Acesso
+        ordenados = sa.select(Acesso.usuario_id, Acesso.dta_acesso, Acesso.ip,
+                              sa.func.row_number().over(partition_by=Acesso.usuario_id,
+                                                        order_by=Acesso.dta_acesso.desc()).label('ordem')). \
+            subquery()
+        return sa.select(ordenados.c.usuario_id,
+                         sa.func.max(sa.case((ordenados.c.ordem == 1, ordenados.c.dta_acesso))).label('dta_atual'),
+                         sa.func.max(sa.case((ordenados.c.ordem == 1, ordenados.c.ip))).label('ip_atual'),
+                         sa.func.max(sa.case((ordenados.c.ordem == 2, ordenados.c.dta_acesso))).label('dta_anterior'),
+                         sa.func.max(sa.case((ordenados.c.ordem == 2, ordenados.c.ip))).label('ip_anterior')). \
+            where(ordenados.c.ordem <= 2). \
+            group_by(ordenados.c.usuario_id). \
+            subquery()
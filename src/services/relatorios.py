@@ -0,0 +1,63 @@
+import os
+import uuid
+from pathlib import Path
+from typing import Callable, Iterator
+
+from flask import Flask, Response, send_file, stream_with_context
+
+
+class RelatoriosEmCache:
+    """
+    Relatórios gerados (PDFs, por exemplo) gravados em disco e identificados
+    pela marca de versão dos dados usados para gerá-los (versoes.marca, que
+    inclui o identificador do banco). Enquanto a marca não mudar, o arquivo
+    gravado é enviado; quando muda, o relatório é gerado de novo e transmitido
+    ao cliente ao mesmo tempo em que é gravado
+    """
+
+    def __init__(self, app: Flask | None = None):
+        self.diretorio: Path | None = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        self.diretorio = Path(app.instance_path) / Path(app.config.get('RELATORIOS_DIR', 'relatorios'))
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        app.extensions['relatorios'] = self
+
+    def _grava_enquanto_transmite(self, nome: str, versao: str, extensao: str,
+                                  partes: Iterator[bytes]) -> Iterator[bytes]:
+        destino = self.diretorio / f"{nome}-{versao}.{extensao}"
+        temporario = self.diretorio / f".{nome}-{versao}.{uuid.uuid4().hex}"
+        completo = False
+        try:
+            with open(temporario, 'wb') as arquivo:
+                for parte in partes:
+                    arquivo.write(parte)
+                    yield parte
+            completo = True
+        finally:
+            if completo:
+                os.replace(temporario, destino)
+                # Versões anteriores não serão mais usadas
+                for antigo in self.diretorio.glob(f"{nome}-*.{extensao}"):
+                    if antigo != destino:
+                        antigo.unlink(missing_ok=True)
+            else:
+                temporario.unlink(missing_ok=True)
+
+    def envia(self, nome: str, versao: str | None, extensao: str, mimetype: str, download_name: str,
+              gerador: Callable[[], Iterator[bytes]]) -> Response:
+        if versao is None:
+            # Sem versão dos dados não há como saber se o arquivo gravado ainda vale
+            return Response(stream_with_context(gerador()), mimetype=mimetype,
+                            headers={'Content-Disposition': f"attachment;filename={download_name}"})
+        destino = self.diretorio / f"{nome}-{versao}.{extensao}"
+        if destino.is_file():
+            return send_file(destino, mimetype=mimetype, as_attachment=True, download_name=download_name,
+                             etag=f"{nome}-{versao}", conditional=True, max_age=0)
+        resposta = Response(stream_with_context(self._grava_enquanto_transmite(nome, versao, extensao, gerador())),
+                            mimetype=mimetype,
+                            headers={'Content-Disposition': f"attachment;filename={download_name}"})
+        resposta.set_etag(f"{nome}-{versao}")
+        return resposta
@@ -0,0 +1,150 @@
+import contextlib
+import random
+import time
+from functools import wraps
+from pathlib import Path
+from typing import Iterator
+
+import sqlalchemy as sa
+from flask import Flask, current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session as SessaoFlask
+from sqlalchemy.orm import Session
+
+
+class SessaoRoteada(SessaoFlask):
+    """
+    Sessão do Flask-SQLAlchemy que envia as leituras das views marcadas com
+    RoteadorDeReplicas.somente_leitura para um engine de leitura. Escritas
+    (flush, INSERT/UPDATE/DELETE) sempre vão para o banco principal, e o
+    commit de uma transação que escreveu fixa o usuário no banco principal
+    (RoteadorDeReplicas.fixa_no_principal)
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing:
+            roteador = current_app.extensions.get('replicas')
+            if roteador is not None and roteador.leitura_roteada(clause):
+                engine = roteador.engine_da_requisicao()
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _e_consulta(clause: sa.TextClause) -> bool:
+    return clause.text.lstrip().upper().startswith(('SELECT', 'WITH'))
+
+
+@sa.event.listens_for(SessaoRoteada, 'after_flush')
+def _flush_escreveu(sessao, _contexto):
+    sessao.info['escreveu'] = True
+
+
+@sa.event.listens_for(SessaoRoteada, 'do_orm_execute')
+def _execucao_escreveu(estado):
+    # INSERT/UPDATE/DELETE executados diretamente, fora do flush
+    if estado.is_insert or estado.is_update or estado.is_delete or \
+            (isinstance(estado.statement, sa.TextClause) and not _e_consulta(estado.statement)):
+        estado.session.info['escreveu'] = True
+
+
+@sa.event.listens_for(SessaoRoteada, 'after_commit')
+def _commit_com_escrita(sessao):
+    if sessao.info.pop('escreveu', False):
+        roteador = current_app.extensions.get('replicas')
+        if roteador is not None:
+            roteador.fixa_no_principal()
+
+
+@sa.event.listens_for(SessaoRoteada, 'after_rollback')
+def _rollback(sessao):
+    sessao.info.pop('escreveu', None)
+
+
+class RoteadorDeReplicas:
+    """
+    Engines de leitura (réplicas) e a regra de quando usá-los. As réplicas vêm
+    de BANCO_REPLICAS; sem réplicas configuradas, usa o engine de leitura do
+    perfil SQLite, que abre o mesmo arquivo com um pool próprio. Depois de uma
+    requisição que gravou no banco principal, qualquer que seja o método, as
+    leituras do mesmo usuário ficam no banco principal por BANCO_REPLICAS_JANELA
+    segundos, para que ele veja o que acabou de gravar
+    """
+
+    def __init__(self, app: Flask | None = None):
+        self.engines: list[sa.Engine] = list()
+        self.janela: int = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        # Deve ser chamada depois de perfil_sqlite.init_app
+        from src.modules import perfil_sqlite
+        self.janela = int(app.config.get('BANCO_REPLICAS_JANELA', 10))
+        self.engines = list()
+        for uri in app.config.get('BANCO_REPLICAS', list()):
+            url = sa.engine.make_url(uri)
+            if url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:') and \
+                    not Path(url.database).is_absolute():
+                # Mesmo tratamento que o Flask-SQLAlchemy dá ao banco principal: relativo à pasta instance
+                url = url.set(database=str(Path(app.instance_path) / url.database))
+            engine = sa.create_engine(url)
+            perfil_sqlite.configura_leitura(engine)
+            self.engines.append(engine)
+        if not self.engines and perfil_sqlite.engine_de_leitura is not None:
+            self.engines.append(perfil_sqlite.engine_de_leitura)
+        app.extensions['replicas'] = self
+
+    def fixa_no_principal(self) -> None:
+        """
+        Chamada no commit de uma transação que escreveu. Fora de requisições
+        (tarefas, comandos) não há usuário a fixar
+        """
+        if self.engines and has_request_context():
+            session['_principal_ate'] = time.time() + self.janela
+
+    def somente_leitura(self, funcao_de_view):
+        """
+        Decorador de view. As consultas da view passam a ir para uma réplica
+        """
+
+        @wraps(funcao_de_view)
+        def decorator(*args, **kwargs):
+            if request.method in ('GET', 'HEAD'):
+                g.somente_leitura = True
+            return funcao_de_view(*args, **kwargs)
+
+        return decorator
+
+    @staticmethod
+    def leitura_roteada(clause) -> bool:
+        if not has_request_context() or not g.get('somente_leitura', False):
+            return False
+        if session.get('_principal_ate', 0) > time.time():
+            return False
+        if isinstance(clause, sa.Select):
+            return True
+        if isinstance(clause, sa.TextClause):
+            return _e_consulta(clause)
+        return False
+
+    def engine_da_requisicao(self) -> sa.Engine | None:
+        # A mesma réplica atende toda a requisição, para que as leituras sejam coerentes entre si
+        if not self.engines:
+            return None
+        if 'replica' not in g:
+            g.replica = random.choice(self.engines)
+        return g.replica
+
+    @contextlib.contextmanager
+    def sessao_de_leitura(self) -> Iterator[Session]:
+        """
+        Sessão própria ligada a uma réplica, para leituras longas fora da sessão
+        da requisição. Sem réplicas, ou logo após uma escrita, usa o engine principal
+        """
+        from src.modules import db
+        if not self.engines or (has_request_context() and session.get('_principal_ate', 0) > time.time()):
+            engine = db.engine
+        else:
+            engine = random.choice(self.engines)
+        with Session(engine) as sessao:
+            yield sessao
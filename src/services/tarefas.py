@@ -0,0 +1,109 @@
+import json
+import os
+import shutil
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable
+
+from flask import Flask
+
+
+class Tarefa:
+    """
+    Tarefa executada em segundo plano. O estado fica em um arquivo JSON no
+    diretório da tarefa, de forma que qualquer processo da aplicação consegue
+    consultar o andamento, e não apenas o que a está executando
+    """
+
+    def __init__(self, diretorio: Path):
+        self.diretorio = diretorio
+        self.id = diretorio.name
+
+    @property
+    def _arquivo_de_estado(self) -> Path:
+        return self.diretorio / 'estado.json'
+
+    def arquivo(self, nome: str) -> Path:
+        return self.diretorio / nome
+
+    @property
+    def estado(self) -> dict[str, Any]:
+        try:
+            return json.loads(self._arquivo_de_estado.read_text(encoding='utf-8'))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return dict()
+
+    def atualiza(self, **campos) -> None:
+        estado = self.estado
+        estado.update(campos)
+        estado['atualizada_em'] = time.time()
+        temporario = self.diretorio / f".estado.{uuid.uuid4().hex}"
+        temporario.write_text(json.dumps(estado, ensure_ascii=False), encoding='utf-8')
+        os.replace(temporario, self._arquivo_de_estado)
+
+
+class GerenciadorDeTarefas:
+    def __init__(self, app: Flask | None = None):
+        self.app: Flask | None = None
+        self.diretorio: Path | None = None
+        self.retencao: int = 0
+        self._executor: ThreadPoolExecutor | None = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        self.app = app
+        self.diretorio = Path(app.instance_path) / Path(app.config.get('TAREFAS_DIR', 'tarefas'))
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        self.retencao = int(app.config.get('TAREFAS_RETENCAO_HORAS', 24)) * 3600
+        self._executor = ThreadPoolExecutor(max_workers=int(app.config.get('TAREFAS_WORKERS', 2)),
+                                            thread_name_prefix='tarefa')
+        app.extensions['tarefas'] = self
+
+    def cria(self, tipo: str, **campos) -> Tarefa:
+        self.remove_expiradas()
+        diretorio = self.diretorio / str(uuid.uuid4())
+        diretorio.mkdir()
+        tarefa = Tarefa(diretorio)
+        tarefa.atualiza(tipo=tipo, situacao='pendente', criada_em=time.time(), **campos)
+        return tarefa
+
+    def obtem(self, tarefa_id: str) -> Tarefa | None:
+        try:
+            tarefa_id = str(uuid.UUID(str(tarefa_id)))
+        except ValueError:
+            return None
+        diretorio = self.diretorio / tarefa_id
+        return Tarefa(diretorio) if diretorio.is_dir() else None
+
+    def submete(self, tarefa: Tarefa, funcao: Callable[..., None], *args, **kwargs) -> None:
+        app = self.app
+
+        def executa():
+            with app.app_context():
+                tarefa.atualiza(situacao='executando', iniciada_em=time.time())
+                try:
+                    funcao(tarefa, *args, **kwargs)
+                except Exception as e:
+                    app.logger.error(f"Tarefa {tarefa.id}: {e}\n{traceback.format_exc()}")
+                    tarefa.atualiza(situacao='erro', mensagem=str(e), concluida_em=time.time())
+                else:
+                    if tarefa.estado.get('situacao') == 'executando':
+                        tarefa.atualiza(situacao='concluida', concluida_em=time.time())
+                finally:
+                    # O arquivo enviado não é mais necessário, mesmo que a tarefa tenha falhado
+                    tarefa.arquivo('entrada').unlink(missing_ok=True)
+
+        self._executor.submit(executa)
+
+    def remove_expiradas(self) -> None:
+        limite = time.time() - self.retencao
+        for diretorio in self.diretorio.iterdir():
+            try:
+                if diretorio.is_dir() and diretorio.stat().st_mtime < limite:
+                    shutil.rmtree(diretorio, ignore_errors=True)
+            except FileNotFoundError:
+                pass
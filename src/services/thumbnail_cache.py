@@ -0,0 +1,106 @@
+import os
+import shutil
+import threading
+import uuid
+from pathlib import Path
+
+from flask import Flask
+
+
+class ThumbnailCache:
+    """
+    Cache em disco das miniaturas dos produtos. Cada variante é identificada
+    pelo id do produto, pelo tamanho e pelo hash do conteúdo da foto, de forma
+    que trocar a foto nunca devolve uma miniatura antiga. Quando o espaço
+    ocupado passa do limite, as variantes menos usadas recentemente são removidas
+    """
+
+    def __init__(self, app: Flask | None = None):
+        self.diretorio: Path | None = None
+        self.max_bytes: int = 0
+        self.tamanhos: tuple[int, ...] = ()
+        self._ocupado: int = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        self.diretorio = Path(app.instance_path) / Path(app.config.get('THUMBNAIL_CACHE_DIR', 'thumbnails'))
+        self.max_bytes = int(app.config.get('THUMBNAIL_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+        self.tamanhos = tuple(int(t) for t in app.config.get('THUMBNAIL_TAMANHOS', [64, 128]))
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        self._ocupado = sum(f.stat().st_size for f in self.diretorio.rglob('*') if f.is_file())
+        app.extensions['thumbnail_cache'] = self
+
+    def _caminho(self, produto_id: uuid.UUID, max_size: int, foto_hash: str) -> Path:
+        return self.diretorio / str(produto_id) / f"{max_size}-{foto_hash}"
+
+    def obtem(self, produto_id: uuid.UUID, max_size: int, foto_hash: str) -> bytes | None:
+        if self.diretorio is None:
+            return None
+        caminho = self._caminho(produto_id, max_size, foto_hash)
+        try:
+            dados = caminho.read_bytes()
+        except FileNotFoundError:
+            return None
+        # Atualiza o mtime para que a remoção por LRU preserve as variantes em uso
+        try:
+            os.utime(caminho)
+        except OSError:
+            pass
+        return dados
+
+    def grava(self, produto_id: uuid.UUID, max_size: int, foto_hash: str, dados: bytes) -> None:
+        if self.diretorio is None:
+            return
+        caminho = self._caminho(produto_id, max_size, foto_hash)
+        caminho.parent.mkdir(parents=True, exist_ok=True)
+        temporario = caminho.with_name(f".{caminho.name}.{uuid.uuid4().hex}")
+        temporario.write_bytes(dados)
+        # A variante pode já existir (gravações concorrentes da mesma miniatura)
+        try:
+            substituido = caminho.stat().st_size
+        except FileNotFoundError:
+            substituido = 0
+        os.replace(temporario, caminho)
+        with self._lock:
+            self._ocupado += len(dados) - substituido
+            excedeu = self._ocupado > self.max_bytes
+        if excedeu:
+            self.remove_excedente()
+
+    def invalida(self, produto_id: uuid.UUID) -> None:
+        if self.diretorio is None:
+            return
+        diretorio = self.diretorio / str(produto_id)
+        if not diretorio.is_dir():
+            return
+        liberado = sum(f.stat().st_size for f in diretorio.iterdir() if f.is_file())
+        shutil.rmtree(diretorio, ignore_errors=True)
+        with self._lock:
+            self._ocupado = max(0, self._ocupado - liberado)
+
+    def remove_excedente(self) -> None:
+        # Remove as variantes menos usadas até ficar em 90% do limite, para não
+        # ter que repetir a varredura a cada nova miniatura gravada
+        alvo = int(self.max_bytes * 0.9)
+        arquivos = []
+        for arquivo in self.diretorio.rglob('*'):
+            try:
+                estado = arquivo.stat()
+            except FileNotFoundError:
+                continue
+            if arquivo.is_file():
+                arquivos.append((estado.st_mtime, estado.st_size, arquivo))
+        arquivos.sort(key=lambda a: a[0])
+        ocupado = sum(a[1] for a in arquivos)
+        for _, tamanho, arquivo in arquivos:
+            if ocupado <= alvo:
+                break
+            try:
+                arquivo.unlink()
+            except FileNotFoundError:
+                pass
+            ocupado -= tamanho
+        with self._lock:
+            self._ocupado = ocupado
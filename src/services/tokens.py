@@ -0,0 +1,116 @@
+import datetime
+import random
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from typing import NamedTuple
+
+import jwt
+from flask import Flask, current_app
+
+from src.services.armazem_compartilhado import ArmazemCompartilhado
+
+
+class TokenValido(NamedTuple):
+    usuario: str
+    acao: str
+    jti: str
+    expira: float
+
+
+class ServicoDeTokens:
+    """
+    Tokens JWT de uso único (redefinição de senha, validação de email). Cada
+    token leva no cabeçalho o identificador (kid) da chave que o assinou, o que
+    permite trocar a chave ativa sem invalidar os tokens já enviados. Os ids
+    (jti) dos tokens usados ficam em um arquivo SQLite compartilhado pelos
+    workers até a expiração, e um token já usado é recusado sem consultar a
+    tabela de usuários
+    """
+
+    ALGORITMO = 'HS256'
+
+    def __init__(self, app: Flask | None = None):
+        self._chaves: dict[str, bytes] = dict()
+        self._chave_ativa: str | None = None
+        self._armazem: ArmazemCompartilhado | None = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        chaves = app.config.get('TOKEN_CHAVES') or {'principal': app.config.get('SECRET_KEY')}
+        # As chaves são convertidas uma única vez, e não a cada token
+        self._chaves = {kid: segredo.encode('utf-8') for kid, segredo in chaves.items()}
+        self._chave_ativa = app.config.get('TOKEN_CHAVE_ATIVA') or next(iter(self._chaves))
+        if self._chave_ativa not in self._chaves:
+            raise KeyError(f"Chave de token ativa \"{self._chave_ativa}\" não está em TOKEN_CHAVES")
+        caminho = Path(app.instance_path) / Path(app.config.get('TOKEN_DB', 'tokens.sqlite3'))
+        self._armazem = ArmazemCompartilhado(caminho, [
+            "CREATE TABLE IF NOT EXISTS consumidos (jti TEXT PRIMARY KEY, expira REAL NOT NULL) WITHOUT ROWID",
+        ])
+        app.extensions['tokens'] = self
+
+    def gera(self, usuario: str, acao: str, expira_em: int = 600) -> str:
+        payload = {
+            'user': usuario,
+            'action': acao.lower(),
+            'jti': uuid.uuid4().hex,
+            'exp': time.time() + expira_em,
+        }
+        return jwt.encode(payload=payload,
+                          key=self._chaves[self._chave_ativa],
+                          algorithm=self.ALGORITMO,
+                          headers={'kid': self._chave_ativa})
+
+    def verifica(self, token: str, acao: str) -> TokenValido | None:
+        """
+        Devolve os dados do token se a assinatura, a validade e a ação
+        conferem e se ele ainda não foi consumido
+        """
+        try:
+            kid = jwt.get_unverified_header(token).get('kid')
+            chave = self._chaves.get(kid)
+            if chave is None:
+                raise jwt.exceptions.InvalidKeyError(f"Chave \"{kid}\" desconhecida")
+            payload = jwt.decode(token,
+                                 key=chave,
+                                 algorithms=[self.ALGORITMO],
+                                 leeway=datetime.timedelta(seconds=10),
+                                 options={'require': ['exp', 'jti']})
+        except jwt.exceptions.PyJWTError as e:
+            current_app.logger.error(f"JWT Token validation: {e}")
+            return None
+        if payload.get('action') != acao.lower() or not payload.get('user'):
+            return None
+        dados = TokenValido(payload['user'], payload['action'], str(payload['jti']), float(payload['exp']))
+        if self.foi_consumido(dados.jti):
+            current_app.logger.warning(f"Token {dados.jti} reutilizado")
+            return None
+        return dados
+
+    def foi_consumido(self, jti: str) -> bool:
+        try:
+            return bool(self._armazem.consulta("SELECT 1 FROM consumidos WHERE jti = ?", (jti,)))
+        except sqlite3.OperationalError as e:
+            # Sem o armazém não há como garantir o uso único: recusa
+            current_app.logger.error(f"Armazém de tokens indisponível: {e}")
+            return True
+
+    def consome(self, dados: TokenValido) -> bool:
+        """
+        Marca o token como usado. Devolve False se ele já tinha sido consumido,
+        inclusive por outra requisição concorrente
+        """
+        agora = time.time()
+        try:
+            with self._armazem.transacao() as conexao:
+                inserido = conexao.execute("INSERT OR IGNORE INTO consumidos(jti, expira) VALUES (?, ?)",
+                                           (dados.jti, dados.expira + 60)).rowcount == 1
+                if random.random() < 0.01:
+                    # Tokens expirados já são recusados pela validade; o registro não é mais necessário
+                    conexao.execute("DELETE FROM consumidos WHERE expira < ?", (agora,))
+        except sqlite3.OperationalError as e:
+            current_app.logger.error(f"Armazém de tokens indisponível: {e}")
+            return False
+        return inserido
@@ -0,0 +1,124 @@
+import secrets
+import threading
+from typing import Any, Callable
+
+import sqlalchemy as sa
+from flask import Flask, current_app
+
+
+class VersoesDeDados:
+    """
+    Números de versão de conjuntos de dados, mantidos na tabela versoes_de_dados
+    por gatilhos do SQLite. Cada alteração nas tabelas monitoradas incrementa a
+    versão, inclusive as feitas por UPDATE em lote, fora do ORM. Quem deriva
+    dados caros dessas tabelas (contagens, relatórios) guarda o resultado junto
+    com a versão, e só recalcula quando ela muda
+    """
+
+    TABELA = 'versoes_de_dados'
+    # Linha com um número sorteado quando a tabela é criada: identifica o banco
+    BANCO = '_banco'
+
+    def __init__(self, app: Flask | None = None):
+        self.disponivel = False
+        self.banco: str | None = None
+        self._monitoradas: list[tuple[str, str, str | None]] = list()
+        self._modelos: set[str] = set()
+        self._cache: dict[tuple, tuple[int, Any]] = dict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        app.extensions['versoes'] = self
+
+    def monitora(self, nome: str, tabela: str, condicao: str | None = None) -> None:
+        # condicao: expressão SQL sobre old/new que restringe quais linhas alteradas contam
+        self._monitoradas.append((nome, tabela, condicao))
+
+    def monitora_modelo(self, nome: str, cls: type) -> None:
+        """
+        Incrementa a versão nome a cada INSERT, UPDATE ou DELETE feito pelo ORM
+        em cls, na mesma transação da alteração. Alterações feitas por UPDATE
+        em lote (fora do ORM) não são vistas; para elas, use monitora()
+        """
+        self._modelos.add(nome)
+
+        def incrementa(_mapper, conexao, _registro):
+            if self.disponivel:
+                conexao.execute(sa.text(f"UPDATE {self.TABELA} SET versao = versao + 1 WHERE nome = :nome"),
+                                {'nome': nome})
+
+        for evento in ('after_insert', 'after_update', 'after_delete'):
+            sa.event.listen(cls, evento, incrementa)
+
+    def cria_estrutura(self) -> None:
+        # Deve ser chamada dentro de um contexto de aplicação, depois que o esquema existir
+        from src.modules import db
+        if db.engine.dialect.name != 'sqlite':
+            current_app.logger.warning("Versões de dados disponíveis apenas para SQLite. Resultados sem cache")
+            return
+        with db.engine.begin() as conexao:
+            conexao.exec_driver_sql(f"CREATE TABLE IF NOT EXISTS {self.TABELA} "
+                                    f"(nome VARCHAR(60) PRIMARY KEY, versao INTEGER NOT NULL DEFAULT 0)")
+            conexao.exec_driver_sql(f"INSERT OR IGNORE INTO {self.TABELA}(nome, versao) VALUES (?, ?)",
+                                    (self.BANCO, secrets.randbits(62)))
+            banco = conexao.exec_driver_sql(f"SELECT versao FROM {self.TABELA} WHERE nome = ?",
+                                            (self.BANCO,)).scalar_one()
+            for nome in self._modelos:
+                conexao.exec_driver_sql(f"INSERT OR IGNORE INTO {self.TABELA}(nome, versao) VALUES (?, 0)", (nome,))
+            for nome, tabela, condicao in self._monitoradas:
+                conexao.exec_driver_sql(f"INSERT OR IGNORE INTO {self.TABELA}(nome, versao) VALUES (?, 0)", (nome,))
+                incremento = f"UPDATE {self.TABELA} SET versao = versao + 1 WHERE nome = '{nome}'; "
+                for evento, linhas in (('INSERT', 'new'), ('UPDATE', None), ('DELETE', 'old')):
+                    if condicao is None:
+                        quando = ""
+                    elif linhas is None:
+                        quando = (f" WHEN ({condicao.replace('{linha}', 'old')}) "
+                                  f"OR ({condicao.replace('{linha}', 'new')})")
+                    else:
+                        quando = f" WHEN {condicao.replace('{linha}', linhas)}"
+                    conexao.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS "
+                                            f"{self.TABELA}_{nome}_{tabela}_{evento.lower()} "
+                                            f"AFTER {evento} ON {tabela} FOR EACH ROW{quando} BEGIN "
+                                            f"{incremento}END")
+        self.banco = f"{banco:x}"
+        with self._lock:
+            # Valores calculados em outro banco, com versões que podem coincidir
+            self._cache.clear()
+        self.disponivel = True
+
+    def atual(self, nome: str) -> int | None:
+        if not self.disponivel:
+            return None
+        from src.modules import db
+        return db.session.execute(sa.text(f"SELECT versao FROM {self.TABELA} WHERE nome = :nome"),
+                                  {'nome': nome}).scalar_one_or_none()
+
+    def marca(self, nome: str) -> str | None:
+        """
+        Versão de nome acompanhada do identificador do banco. As versões
+        recomeçam do zero num banco novo; a marca não se repete, e serve para
+        nomear o que é guardado fora do banco (arquivos, ETags)
+        """
+        versao = self.atual(nome)
+        if versao is None:
+            return None
+        return f"{self.banco}-{versao}"
+
+    def em_cache(self, nome: str, chave: Any, gerador: Callable[[], Any]) -> Any:
+        """
+        Devolve o resultado de gerador() calculado na versão atual de nome,
+        chamando-o apenas quando a versão mudou desde o último cálculo
+        """
+        versao = self.atual(nome)
+        if versao is None:
+            return gerador()
+        with self._lock:
+            registro = self._cache.get((nome, chave))
+        if registro is not None and registro[0] == versao:
+            return registro[1]
+        valor = gerador()
+        with self._lock:
+            self._cache[(nome, chave)] = (versao, valor)
+        return valor
@@ -0,0 +1,92 @@
+import contextlib
+import json
+import threading
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+import sqlalchemy as sa
+from flask import Flask
+
+from src import create_app
+
+RAIZ = Path(__file__).resolve().parents[1]
+
+CONFIGURACAO_DE_TESTE = {
+    'TESTING': True,
+    'WTF_CSRF_ENABLED': False,
+    'MAIL_BACKEND': 'locmem',
+    'EMAIL_DESPACHO_ATIVO': False,
+    'RATE_LIMIT_ATIVO': False,
+    'HASH_WORKERS': 1,
+}
+
+
+def cria_app(instancia: Path, **configuracao) -> Flask:
+    """
+    Aplicação com banco e pasta instance próprios, criada a partir de
+    config.sample.json. O banco começa vazio e é criado e semeado pela
+    própria aplicação
+    """
+    config = json.loads((RAIZ / 'instance' / 'config.sample.json').read_text(encoding='utf-8'))
+    config.update(CONFIGURACAO_DE_TESTE)
+    config.update(configuracao)
+    (instancia / 'config.test.json').write_text(json.dumps(config), encoding='utf-8')
+    (instancia / config.get('SQLITE_DB_NAME', 'application_db.sqlite3')).touch()
+    return create_app('config.test.json', instance_path=str(instancia))
+
+
+def entra(cliente, email: str = 'admin@admin.com.br', senha: str = '123') -> None:
+    resposta = cliente.post('/admin/user/login', data={'email': email, 'password': senha})
+    assert resposta.status_code == 302 and resposta.headers['Location'] != '/admin/user/login'
+
+
+class ContadorDeConsultas:
+    """
+    Conta os comandos SQL enviados ao banco, em qualquer engine, enquanto
+    ativo. Só conta os da thread que o ativou: as threads de segundo plano
+    (caixa de saída, registro de acessos) consultam o banco a qualquer momento
+    """
+
+    def __init__(self):
+        self.sentencas: list[str] = list()
+        self._thread: int | None = None
+
+    def _registra(self, _conexao, _cursor, sentenca, _parametros, _contexto, _executemany):
+        if threading.get_ident() == self._thread:
+            self.sentencas.append(sentenca)
+
+    @property
+    def total(self) -> int:
+        return len(self.sentencas)
+
+    @contextlib.contextmanager
+    def ativo(self) -> Iterator['ContadorDeConsultas']:
+        self._thread = threading.get_ident()
+        sa.event.listen(sa.Engine, 'before_cursor_execute', self._registra)
+        try:
+            yield self
+        finally:
+            sa.event.remove(sa.Engine, 'before_cursor_execute', self._registra)
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory) -> Flask:
+    return cria_app(tmp_path_factory.mktemp('instance'))
+
+
+@pytest.fixture
+def cliente(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin(app):
+    cliente = app.test_client()
+    entra(cliente)
+    return cliente
+
+
+@pytest.fixture
+def contador() -> ContadorDeConsultas:
+    return ContadorDeConsultas()
@@ -0,0 +1,66 @@
+import email
+import email.policy
+import socketserver
+import threading
+from email.message import EmailMessage
+
+
+class ServidorSMTPLocal:
+    """
+    Servidor SMTP mínimo, em uma thread, que guarda as mensagens recebidas em
+    vez de entregá-las. recusa_envio faz o servidor responder com erro
+    temporário (451) a cada mensagem, para simular falhas de entrega
+    """
+
+    def __init__(self):
+        self.mensagens: list[EmailMessage] = list()
+        self.recusa_envio = False
+        self.conexoes = 0
+        servidor = self
+
+        class Sessao(socketserver.StreamRequestHandler):
+            def responde(self, linha: str) -> None:
+                self.wfile.write(f"{linha}\r\n".encode('ascii'))
+
+            def handle(self):
+                servidor.conexoes += 1
+                self.responde("220 localhost SMTP de teste")
+                while True:
+                    linha = self.rfile.readline()
+                    if not linha:
+                        return
+                    comando = linha.decode('utf-8', 'replace').strip().upper()
+                    if comando.startswith('EHLO'):
+                        self.responde("250-localhost")
+                        self.responde("250 8BITMIME")
+                    elif comando.startswith('HELO') or comando.startswith('RCPT') or \
+                            comando.startswith('RSET') or comando.startswith('NOOP'):
+                        self.responde("250 OK")
+                    elif comando.startswith('MAIL'):
+                        self.responde("451 Tente mais tarde" if servidor.recusa_envio else "250 OK")
+                    elif comando == 'DATA':
+                        self.responde("354 Termine com <CRLF>.<CRLF>")
+                        linhas = list()
+                        while (linha := self.rfile.readline()) not in (b'.\r\n', b''):
+                            linhas.append(linha[1:] if linha.startswith(b'..') else linha)
+                        servidor.mensagens.append(email.message_from_bytes(b''.join(linhas),
+                                                                           policy=email.policy.default))
+                        self.responde("250 OK")
+                    elif comando == 'QUIT':
+                        self.responde("221 Até logo")
+                        return
+                    else:
+                        self.responde("502 Comando não implementado")
+
+        self._servidor = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Sessao)
+        self._servidor.daemon_threads = True
+        self.porta = self._servidor.server_address[1]
+        self._thread = threading.Thread(target=self._servidor.serve_forever, daemon=True)
+
+    def __enter__(self) -> 'ServidorSMTPLocal':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self._servidor.shutdown()
+        self._servidor.server_close()
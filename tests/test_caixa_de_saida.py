@@ -0,0 +1,96 @@
+import pytest
+import sqlalchemy as sa
+
+from src.models.mensagem import Mensagem
+from src.models.usuario import User
+from src.modules import db, caixa_de_saida
+from tests.conftest import cria_app
+from tests.smtp_local import ServidorSMTPLocal
+
+
+@pytest.fixture(scope='module')
+def smtp():
+    with ServidorSMTPLocal() as servidor:
+        yield servidor
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory, smtp):
+    return cria_app(tmp_path_factory.mktemp('instance'),
+                    MAIL_BACKEND='smtp', MAIL_SERVER='127.0.0.1', MAIL_PORT=smtp.porta,
+                    MAIL_USE_TLS=False, MAIL_USE_SSL=False, MAIL_TIMEOUT=5,
+                    EMAIL_LOTE=20, EMAIL_MAX_TENTATIVAS=2, EMAIL_ESPERA_BASE=0)
+
+
+@pytest.fixture(autouse=True)
+def caixa_vazia(app, smtp):
+    smtp.mensagens.clear()
+    smtp.recusa_envio = False
+    with app.app_context():
+        db.session.execute(sa.delete(Mensagem))
+        db.session.commit()
+
+
+def enfileira(app, quantidade: int) -> None:
+    with app.test_request_context():
+        usuario = User.get_by_email('admin@admin.com.br')
+        for i in range(quantidade):
+            usuario.send_email(subject=f"Teste {i}", body="Corpo da mensagem")
+        db.session.commit()
+
+
+def mensagens(app) -> list[Mensagem]:
+    with app.app_context():
+        resultado = db.session.execute(sa.select(Mensagem)).scalars().all()
+        for mensagem in resultado:
+            db.session.expunge(mensagem)
+        return resultado
+
+
+def test_mensagens_so_saem_depois_do_commit(app, smtp):
+    with app.test_request_context():
+        User.get_by_email('admin@admin.com.br').send_email(subject="Descartada")
+        db.session.rollback()
+        assert caixa_de_saida.despacha() == 0
+    assert smtp.mensagens == []
+
+
+def test_lote_enviado_em_uma_conexao(app, smtp):
+    enfileira(app, 3)
+    conexoes = smtp.conexoes
+    with app.app_context():
+        assert caixa_de_saida.despacha() == 3
+        assert caixa_de_saida.despacha() == 0
+        assert caixa_de_saida.situacao() == {'enviada': 3}
+    assert smtp.conexoes == conexoes + 1
+    assert sorted(m['Subject'] for m in smtp.mensagens) == [f"[Meu App 2024] Teste {i}" for i in range(3)]
+    assert all(m['To'] == 'admin@admin.com.br' for m in smtp.mensagens)
+
+
+def test_falha_reagenda_ate_o_maximo_de_tentativas(app, smtp):
+    enfileira(app, 1)
+    smtp.recusa_envio = True
+    with app.app_context():
+        assert caixa_de_saida.despacha() == 1
+    mensagem, = mensagens(app)
+    assert (mensagem.situacao, mensagem.tentativas) == ('pendente', 1)
+    assert mensagem.proxima_tentativa is not None and mensagem.ultimo_erro
+
+    with app.app_context():
+        assert caixa_de_saida.despacha() == 1
+    mensagem, = mensagens(app)
+    assert (mensagem.situacao, mensagem.tentativas) == ('falha', 2)
+    assert smtp.mensagens == []
+
+
+def test_reenvio_depois_de_falha_temporaria(app, smtp):
+    enfileira(app, 1)
+    smtp.recusa_envio = True
+    with app.app_context():
+        caixa_de_saida.despacha()
+    smtp.recusa_envio = False
+    with app.app_context():
+        assert caixa_de_saida.despacha() == 1
+    mensagem, = mensagens(app)
+    assert (mensagem.situacao, mensagem.tentativas) == ('enviada', 2)
+    assert len(smtp.mensagens) == 1
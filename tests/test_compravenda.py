@@ -0,0 +1,112 @@
+import io
+import json
+import threading
+import time
+
+import pytest
+import sqlalchemy as sa
+
+from src.models.produto import Produto
+from src.modules import db, tarefas
+from src.services.compravenda import processa_transacoes, le_transacoes, executa_compravenda, ArquivoInvalido
+
+
+def um_produto(app) -> Produto:
+    with app.app_context():
+        produto = db.session.execute(sa.select(Produto).order_by(Produto.nome).limit(1)).scalar_one()
+        db.session.expunge(produto)
+        return produto
+
+
+def estoque(app, produto_id) -> int:
+    with app.app_context():
+        return db.session.execute(sa.select(Produto.estoque).where(Produto.id == produto_id)).scalar_one()
+
+
+def test_tarefas_concorrentes_no_mesmo_produto_nao_perdem_atualizacoes(app):
+    produto = um_produto(app)
+    # A semeadura pode deixar estoques negativos, e então as compras seriam recusadas
+    with app.app_context():
+        db.session.execute(sa.update(Produto).where(Produto.id == produto.id).values(estoque=0))
+        db.session.commit()
+    linhas, aplicadas = 2000, list()
+
+    def tarefa():
+        with app.app_context():
+            transacoes = ({'id': str(produto.id), 'quantidade': 1} for _ in range(linhas))
+            aplicadas.append(processa_transacoes(transacoes, lambda _linha: None, tamanho_lote=50).aplicadas)
+            db.session.remove()
+
+    threads = [threading.Thread(target=tarefa) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert aplicadas == [linhas, linhas]
+    assert estoque(app, produto.id) == 2 * linhas
+
+
+def test_limite_de_estoque_usa_o_valor_atual(app):
+    produto = um_produto(app)
+    with app.app_context():
+        db.session.execute(sa.update(Produto).where(Produto.id == produto.id).values(estoque=3))
+        db.session.commit()
+    mensagens = list()
+
+    def aplica(*quantidades):
+        with app.app_context():
+            transacoes = [{'id': str(produto.id), 'quantidade': q} for q in quantidades]
+            processa_transacoes(transacoes, mensagens.append, tamanho_lote=1)
+
+    aplica(-2)
+    # Alteração feita por fora entre dois arquivos
+    with app.app_context():
+        db.session.execute(sa.update(Produto).where(Produto.id == produto.id).values(estoque=Produto.estoque + 10))
+        db.session.commit()
+    aplica(-11, -1)
+    assert [m[2] for m in mensagens] == ['success', 'success', 'warning']
+    assert estoque(app, produto.id) == 0
+
+
+def transacoes_de(texto: str) -> list:
+    return list(le_transacoes(io.BytesIO(texto.encode('utf-8')), tamanho_bloco=7))
+
+
+def test_formatos_aceitos():
+    objeto = {'id': 'abc', 'quantidade': 2}
+    assert transacoes_de(json.dumps([objeto, objeto])) == [objeto, objeto]
+    assert transacoes_de(json.dumps(objeto) + '\nlixo\n' + json.dumps(objeto)) == [objeto, 'lixo', objeto]
+    # Objeto formatado em várias linhas, sozinho ou em sequência
+    assert transacoes_de(json.dumps(objeto, indent=2)) == [objeto]
+    assert transacoes_de(json.dumps(objeto, indent=2) + '\n' + json.dumps(objeto, indent=4)) == [objeto, objeto]
+    with pytest.raises(ArquivoInvalido):
+        transacoes_de('{\n  "id": "abc",\n  "quantidade": \n')
+
+
+def test_erro_de_sintaxe_aplica_as_transacoes_anteriores(app):
+    produto = um_produto(app)
+    inicial = estoque(app, produto.id)
+    texto = '[' + ', '.join([json.dumps({'id': str(produto.id), 'quantidade': 1})] * 3) + ', {"id": ]'
+    mensagens = list()
+    with app.app_context():
+        with pytest.raises(ArquivoInvalido):
+            processa_transacoes(le_transacoes(io.BytesIO(texto.encode('utf-8'))),
+                                mensagens.append, tamanho_lote=10)
+    assert len(mensagens) == 3
+    assert estoque(app, produto.id) == inicial + 3
+
+
+def test_tarefa_com_erro_relata_e_remove_a_entrada(app):
+    produto = um_produto(app)
+    tarefa = tarefas.cria('compravenda')
+    tarefa.arquivo('entrada').write_text('[' + json.dumps({'id': str(produto.id), 'quantidade': 1}) + ', x]',
+                                         encoding='utf-8')
+    tarefas.submete(tarefa, executa_compravenda, 10)
+    limite = time.monotonic() + 10
+    while tarefa.estado.get('situacao') in ('pendente', 'executando') and time.monotonic() < limite:
+        time.sleep(0.05)
+    assert tarefa.estado['situacao'] == 'erro'
+    assert tarefa.estado['aplicadas'] == 1
+    assert not tarefa.arquivo('entrada').exists()
+    relatorio = tarefa.arquivo('relatorio.csv').read_text(encoding='utf-8').splitlines()
+    assert relatorio[1].startswith('1,aplicada') and relatorio[2].startswith('2,erro')
@@ -0,0 +1,73 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+import sqlalchemy as sa
+
+from src.models.produto import Produto
+from src.modules import db
+
+URL = '/admin/produto/listajson'
+
+
+def nomes_no_banco(app) -> list[str]:
+    with app.app_context():
+        return db.session.execute(sa.select(Produto.nome).order_by(Produto.nome, Produto.id)).scalars().all()
+
+
+def nomes_exportados(formato: str, dados: bytes) -> list[str]:
+    texto = dados.decode('utf-8')
+    if formato == 'json':
+        return [registro['nome'] for registro in json.loads(texto)]
+    if formato == 'ndjson':
+        return [json.loads(linha)['nome'] for linha in texto.splitlines()]
+    return [registro['nome'] for registro in csv.DictReader(io.StringIO(texto))]
+
+
+@pytest.mark.parametrize('formato', ['json', 'ndjson', 'csv'])
+@pytest.mark.parametrize('comprimido', [False, True])
+def test_formatos(app, admin, formato, comprimido):
+    cabecalhos = {'Accept-Encoding': 'gzip'} if comprimido else {}
+    resposta = admin.get(f"{URL}?formato={formato}", headers=cabecalhos)
+    assert resposta.status_code == 200
+    dados = resposta.get_data()
+    if comprimido:
+        assert resposta.content_encoding == 'gzip'
+        dados = gzip.decompress(dados)
+    assert nomes_exportados(formato, dados) == nomes_no_banco(app)
+
+
+def test_formato_invalido(admin):
+    assert admin.get(f"{URL}?formato=xml").status_code == 400
+
+
+def altera(app, **valores) -> None:
+    # UPDATE fora do ORM, no mesmo segundo da exportação
+    with app.app_context():
+        produto_id = db.session.execute(sa.select(Produto.id).order_by(Produto.nome).limit(1)).scalar_one()
+        db.session.execute(sa.update(Produto).where(Produto.id == produto_id).values(**valores))
+        db.session.commit()
+
+
+@pytest.mark.parametrize('valores', [{'nome': 'AAA Renomeado'}, {'estoque': 12345}])
+def test_304_ate_o_catalogo_mudar(app, admin, valores):
+    # Uma alteração logo antes da exportação: a próxima cai, em geral, no mesmo segundo
+    altera(app, preco=1)
+    primeira = admin.get(URL)
+    assert primeira.status_code == 200 and primeira.get_etag()[0]
+    etag = primeira.get_etag()[0]
+    segunda = admin.get(URL, headers={'If-None-Match': f'"{etag}"'})
+    assert segunda.status_code == 304 and segunda.get_data() == b''
+    altera(app, **valores)
+    terceira = admin.get(URL, headers={'If-None-Match': f'"{etag}"'})
+    assert terceira.status_code == 200 and terceira.get_etag()[0] != etag
+    assert nomes_exportados('json', terceira.get_data()) == nomes_no_banco(app)
+
+
+def test_etag_depende_do_formato_e_da_compressao(admin):
+    etags = {admin.get(f"{URL}?formato={formato}", headers=cabecalhos).get_etag()[0]
+             for formato in ('json', 'ndjson', 'csv')
+             for cabecalhos in ({}, {'Accept-Encoding': 'gzip'})}
+    assert len(etags) == 6
@@ -0,0 +1,102 @@
+import io
+import time
+import uuid
+
+import sqlalchemy as sa
+from flask import Flask
+from PIL import Image
+
+from src.models.produto import Produto
+from src.modules import db, blobstore, tarefas
+from src.services.fotos import processa_foto
+from src.services.imagens import formato_de_saida, miniatura, MIME_DOS_FORMATOS
+from src.services.thumbnail_cache import ThumbnailCache
+
+
+def imagem(formato: str, cor: str, **opcoes) -> bytes:
+    saida = io.BytesIO()
+    Image.new('RGB', (320, 240), cor).save(saida, format=formato, **opcoes)
+    return saida.getvalue()
+
+
+def um_produto(app) -> Produto:
+    with app.app_context():
+        produto = db.session.execute(sa.select(Produto).order_by(Produto.nome).limit(1)).scalar_one()
+        db.session.expunge(produto)
+        return produto
+
+
+def foto(app, produto_id) -> tuple[str | None, bytes | None]:
+    with app.app_context():
+        produto = db.session.get(Produto, produto_id)
+        return produto.foto_mime, blobstore.le(produto.foto_hash) if produto.foto_hash else None
+
+
+def test_foto_mpo_e_aceita_e_gravada_sem_as_imagens_adicionais(app, admin):
+    produto = um_produto(app)
+    # Duas imagens no mesmo arquivo, como as fotos de muitos celulares
+    mpo = imagem('MPO', 'red', save_all=True, append_images=[Image.new('RGB', (320, 240), 'blue')])
+    resposta = admin.post(f"/admin/produto/edit/{produto.id}",
+                          data={'nome': produto.nome, 'preco': '1.00', 'categoria': str(produto.categoria_id),
+                                'ativo': 'y', 'foto_raw': (io.BytesIO(mpo), 'foto.jpg')},
+                          content_type='multipart/form-data')
+    assert resposta.status_code == 302
+    limite = time.monotonic() + 10
+    while foto(app, produto.id)[0] is None and time.monotonic() < limite:
+        time.sleep(0.05)
+    mime, dados = foto(app, produto.id)
+    formato = formato_de_saida(app.config['IMAGEM_FORMATOS'])
+    assert mime == MIME_DOS_FORMATOS[formato]
+    gravada = Image.open(io.BytesIO(dados))
+    assert gravada.format == formato and getattr(gravada, 'n_frames', 1) == 1
+    assert gravada.convert('RGB').getpixel((10, 10))[0] > 200
+
+
+def test_miniatura_de_mpo_e_jpeg():
+    mpo = imagem('MPO', 'red', save_all=True, append_images=[Image.new('RGB', (320, 240), 'blue')])
+    dados, mime = miniatura(mpo, 64)
+    assert mime == 'image/jpeg' and Image.open(io.BytesIO(dados)).format == 'JPEG'
+
+
+def processa(app, produto_id, sequencia: int, dados: bytes):
+    with app.app_context():
+        tarefa = tarefas.cria('foto', produto=str(produto_id), sequencia=sequencia)
+        tarefa.arquivo('entrada').write_bytes(dados)
+        processa_foto(tarefa, produto_id, sequencia, dimensao_maxima=1600, formatos=['PNG'], qualidade=80)
+        db.session.remove()
+        return tarefa.estado
+
+
+def test_envio_mais_antigo_terminando_depois_nao_grava_a_foto(app):
+    produto = um_produto(app)
+    with app.app_context():
+        antigo = Produto.proxima_sequencia_de_foto(produto.id)
+        recente = Produto.proxima_sequencia_de_foto(produto.id)
+        db.session.commit()
+    assert processa(app, produto.id, recente, imagem('PNG', 'blue')).get('mime') == 'image/png'
+    assert processa(app, produto.id, antigo, imagem('PNG', 'red'))['situacao'] == 'descartada'
+    assert Image.open(io.BytesIO(foto(app, produto.id)[1])).getpixel((10, 10)) == (0, 0, 255)
+
+
+def test_remocao_da_foto_descarta_envios_pendentes(app, admin):
+    produto = um_produto(app)
+    with app.app_context():
+        sequencia = Produto.proxima_sequencia_de_foto(produto.id)
+        db.session.commit()
+    resposta = admin.post(f"/admin/produto/edit/{produto.id}",
+                          data={'nome': produto.nome, 'preco': '1.00', 'categoria': str(produto.categoria_id),
+                                'ativo': 'y', 'remover_imagem': 'y'})
+    assert resposta.status_code == 302
+    assert processa(app, produto.id, sequencia, imagem('PNG', 'red'))['situacao'] == 'descartada'
+    assert foto(app, produto.id) == (None, None)
+
+
+def test_regravar_a_mesma_miniatura_nao_conta_o_espaco_duas_vezes(tmp_path):
+    cache = ThumbnailCache(Flask(__name__, instance_path=str(tmp_path)))
+    produto_id = uuid.uuid4()
+    for _ in range(3):
+        cache.grava(produto_id, 64, 'abc', b'x' * 100)
+    cache.grava(produto_id, 64, 'abc', b'x' * 40)
+    assert cache._ocupado == 40
+    cache.invalida(produto_id)
+    assert cache._ocupado == 0
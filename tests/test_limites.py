@@ -0,0 +1,30 @@
+import pytest
+
+from tests.conftest import cria_app
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    return cria_app(tmp_path_factory.mktemp('instance'),
+                    RATE_LIMIT_ATIVO=True, PROXIES_CONFIAVEIS=1,
+                    RATE_LIMITS={'login_ip': [100, 300], 'login_email': [3, 900]})
+
+
+def tenta(app, ip: str, senha: str, email: str = 'admin@admin.com.br'):
+    cliente = app.test_client()
+    return cliente.post('/admin/user/login', data={'email': email, 'password': senha},
+                        headers={'X-Forwarded-For': ip})
+
+
+def test_logins_corretos_nao_gastam_fichas(app):
+    for _ in range(5):
+        resposta = tenta(app, '10.1.0.1', '123')
+        assert resposta.status_code == 302 and resposta.headers['Location'] == '/index'
+
+
+def test_tentativas_erradas_bloqueiam_apenas_o_ip_de_origem(app):
+    for _ in range(3):
+        assert tenta(app, '10.2.0.1', 'errada').headers['Location'] == '/admin/user/login'
+    assert tenta(app, '10.2.0.1', '123').status_code == 429
+    # O mesmo usuário continua entrando a partir de outro IP
+    assert tenta(app, '10.2.0.2', '123').headers['Location'] == '/index'
@@ -0,0 +1,66 @@
+import pytest
+
+
+def consultas_da_pagina(admin, contador, url: str) -> int:
+    contador.sentencas.clear()
+    with contador.ativo():
+        resposta = admin.get(url)
+    assert resposta.status_code == 200
+    return contador.total
+
+
+@pytest.mark.parametrize('url', [
+    '/admin/produto/?pp={pp}',
+    '/admin/produto/?pp={pp}&page=2',
+    '/admin/produto/?pp={pp}&modo=cursor',
+    '/admin/categoria/?pp={pp}',
+    '/admin/categoria/?pp={pp}&modo=cursor',
+])
+def test_consultas_nao_dependem_do_tamanho_da_pagina(admin, contador, url):
+    # A primeira requisição preenche os caches (usuário autenticado, contagens por versão)
+    admin.get(url.format(pp=2))
+    pequena = consultas_da_pagina(admin, contador, url.format(pp=2))
+    grande = consultas_da_pagina(admin, contador, url.format(pp=8))
+    assert pequena == grande, contador.sentencas
+
+
+@pytest.mark.parametrize('url, esperadas', [
+    # Página, total e as versões consultadas pelos caches (escolhas de categoria, contagens)
+    ('/admin/produto/?pp=8', 4),
+    ('/admin/categoria/?pp=8', 3),
+])
+def test_quantidade_de_consultas_por_pagina(admin, contador, url, esperadas):
+    admin.get(url)
+    assert consultas_da_pagina(admin, contador, url) == esperadas, contador.sentencas
+
+
+@pytest.mark.parametrize('url', ['/admin/produto/', '/admin/categoria/'])
+@pytest.mark.parametrize('modo', ['pagina', 'cursor'])
+@pytest.mark.parametrize('pp', [0, -1])
+def test_tamanho_de_pagina_invalido_mostra_um_item(admin, url, modo, pp):
+    resposta = admin.get(f"{url}?pp={pp}&modo={modo}")
+    assert resposta.status_code == 200
+    assert resposta.text.count('/edit/') == 1
+
+
+def primeiro_produto(app):
+    from src.models.produto import Produto
+    from src.modules import db
+    with app.app_context():
+        produto = db.session.execute(Produto.seleciona('listagem').order_by(Produto.nome).limit(1)).scalar_one()
+        return produto.id, produto.categoria.nome
+
+
+@pytest.mark.parametrize('acao', ['edit', 'remove'])
+def test_edicao_e_remocao_leem_o_produto_em_uma_consulta(app, admin, contador, acao):
+    produto_id, categoria = primeiro_produto(app)
+    url = f"/admin/produto/{acao}/{produto_id}"
+    admin.get(url)
+    contador.sentencas.clear()
+    with contador.ativo():
+        resposta = admin.get(url)
+    assert resposta.status_code == 200
+    assert sum('FROM produtos' in sentenca for sentenca in contador.sentencas) == 1, contador.sentencas
+    assert all('foto_base64' not in sentenca for sentenca in contador.sentencas)
+    if acao == 'remove':
+        assert categoria in resposta.text
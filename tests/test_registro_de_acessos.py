@@ -0,0 +1,65 @@
+import datetime
+
+import sqlalchemy as sa
+
+from src.models.acesso import Acesso
+from src.models.usuario import User
+from src.modules import db, esquema, registro_de_acessos
+
+AGORA = datetime.datetime(2026, 1, 10, 12, 0, 0)
+
+
+def acessos_de(usuario_id) -> list[tuple[datetime.datetime, str | None]]:
+    return [tuple(linha) for linha in db.session.execute(sa.select(Acesso.dta_acesso, Acesso.ip).
+                                                         where(Acesso.usuario_id == usuario_id).
+                                                         order_by(Acesso.dta_acesso.desc()))]
+
+
+def test_retencao_mantem_os_dois_ultimos_acessos_de_cada_usuario(app, monkeypatch):
+    with app.app_context():
+        inativo = User.get_by_email('user@user.com.br').id
+        ativo = User.get_by_email('admin@admin.com.br').id
+        db.session.execute(sa.delete(Acesso))
+        dias = registro_de_acessos.retencao_dias
+        antigos = [AGORA - datetime.timedelta(days=dias + n) for n in (1, 2, 3, 4)]
+        recentes = [AGORA - datetime.timedelta(days=n) for n in (1, 2, 3)]
+        db.session.execute(sa.insert(Acesso), [{'usuario_id': inativo, 'dta_acesso': dta, 'ip': None}
+                                               for dta in antigos] +
+                           [{'usuario_id': ativo, 'dta_acesso': dta, 'ip': None}
+                            for dta in recentes + antigos])
+        db.session.commit()
+
+        monkeypatch.setattr(registro_de_acessos, '_agora', lambda: AGORA)
+        registro_de_acessos.remove_expirados()
+        db.session.commit()
+
+        # Quem não entra há mais tempo que a retenção continua com os dois últimos acessos
+        assert [dta for dta, _ in acessos_de(inativo)] == antigos[:2]
+        # Quem entrou há pouco fica só com os acessos dentro da retenção
+        assert [dta for dta, _ in acessos_de(ativo)] == recentes
+
+
+def test_atualizacao_copia_os_acessos_das_colunas_antigas(app):
+    with app.app_context():
+        usuario = User.get_by_email('user@user.com.br').id
+        outro = User.get_by_email('admin@admin.com.br').id
+        db.session.execute(sa.delete(Acesso))
+        db.session.execute(sa.insert(Acesso), [{'usuario_id': outro, 'dta_acesso': AGORA, 'ip': '10.0.0.9'}])
+        db.session.commit()
+        # Banco criado por uma versão anterior: os dois últimos acessos ficavam em colunas de usuarios
+        with db.engine.begin() as conexao:
+            for coluna, tipo in (('dta_ultimo_acesso', 'DATETIME'), ('dta_acesso_atual', 'DATETIME'),
+                                 ('ip_ultimo_acesso', 'VARCHAR(64)'), ('ip_acesso_atual', 'VARCHAR(64)')):
+                conexao.exec_driver_sql(f"ALTER TABLE usuarios ADD COLUMN {coluna} {tipo}")
+            conexao.exec_driver_sql("UPDATE usuarios SET dta_acesso_atual = '2025-05-02 10:00:00.000000', "
+                                    "ip_acesso_atual = '10.0.0.2', dta_ultimo_acesso = '2025-05-01 09:00:00.000000', "
+                                    "ip_ultimo_acesso = '10.0.0.1'")
+
+        assert 'acessos: último e penúltimo acesso das colunas antigas de usuarios' in esquema.atualiza()
+        assert acessos_de(usuario) == [(datetime.datetime(2025, 5, 2, 10), '10.0.0.2'),
+                                       (datetime.datetime(2025, 5, 1, 9), '10.0.0.1')]
+        # Quem já tinha acessos registrados não recebe os das colunas antigas
+        assert acessos_de(outro) == [(AGORA, '10.0.0.9')]
+        # Repetir a atualização não duplica os acessos
+        esquema.atualiza()
+        assert len(acessos_de(usuario)) == 2
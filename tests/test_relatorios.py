@@ -0,0 +1,28 @@
+import sqlalchemy as sa
+
+from tests.conftest import cria_app, entra
+
+URL = '/admin/produto/em_falta?pdf=1'
+
+
+def test_relatorio_de_outro_banco_nao_e_reaproveitado(tmp_path):
+    # Dois bancos novos, na mesma versão de dados, gravando relatórios na mesma pasta
+    from src.modules import db, versoes
+    relatorios = tmp_path / 'relatorios'
+    etags = list()
+    for nome in ('primeiro', 'segundo'):
+        instancia = tmp_path / nome
+        instancia.mkdir()
+        app = cria_app(instancia, RELATORIOS_DIR=str(relatorios))
+        with app.app_context():
+            db.session.execute(sa.text(f"UPDATE {versoes.TABELA} SET versao = 1 WHERE nome = 'produtos_em_falta'"))
+            db.session.commit()
+        cliente = app.test_client()
+        entra(cliente)
+        resposta = cliente.get(URL)
+        assert resposta.status_code == 200 and resposta.data.startswith(b'%PDF')
+        etags.append(resposta.headers['ETag'])
+        # Mesmo banco, mesma versão: o arquivo gravado é enviado
+        assert cliente.get(URL).headers['ETag'] == etags[-1]
+    assert etags[0] != etags[1]
+    assert len(list(relatorios.glob('produtos_em_falta-*.pdf'))) == 1
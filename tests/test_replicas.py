@@ -0,0 +1,63 @@
+import sqlite3
+
+import pytest
+import sqlalchemy as sa
+
+from src.models.usuario import User
+from src.modules import db
+from tests.conftest import cria_app, entra
+
+NOME_NA_REPLICA = 'Nome só na réplica'
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    # Dois arquivos SQLite: o banco principal e uma cópia dele, usada como réplica
+    instancia = tmp_path_factory.mktemp('instance')
+    replica = instancia / 'replica.sqlite3'
+    app = cria_app(instancia, BANCO_REPLICAS=[f"sqlite:///{replica}"])
+    with sqlite3.connect(instancia / 'application_db.sqlite3') as origem, sqlite3.connect(replica) as destino:
+        origem.backup(destino)
+    with sqlite3.connect(replica) as conexao:
+        conexao.execute("UPDATE usuarios SET nome = ? WHERE email_normalizado = 'user@user.com.br'",
+                        (NOME_NA_REPLICA,))
+    return app
+
+
+@pytest.fixture
+def admin(app):
+    cliente = app.test_client()
+    entra(cliente)
+    # O próprio login pode ter gravado (registro de acessos, papéis): começa sem fixação
+    with cliente.session_transaction() as sessao:
+        sessao.pop('_principal_ate', None)
+    return cliente
+
+
+def usuario_comum_id(app):
+    with app.app_context():
+        return db.session.execute(sa.select(User.id).where(User.email_normalizado == 'user@user.com.br')).scalar_one()
+
+
+def test_views_somente_leitura_consultam_a_replica(admin):
+    for _ in range(2):
+        assert NOME_NA_REPLICA in admin.get('/admin/user/management').text
+
+
+def test_get_que_grava_fixa_o_usuario_no_principal(app, admin):
+    resposta = admin.get(f"/admin/user/flip_active/{usuario_comum_id(app)}")
+    assert resposta.status_code == 302 and resposta.headers['Location'].endswith('/admin/user/management')
+    assert NOME_NA_REPLICA not in admin.get('/admin/user/management').text
+    # Os demais usuários continuam lendo a réplica
+    outro = app.test_client()
+    entra(outro)
+    with outro.session_transaction() as sessao:
+        sessao.pop('_principal_ate', None)
+    assert NOME_NA_REPLICA in outro.get('/admin/user/management').text
+
+
+def test_post_que_nao_grava_nao_fixa_o_usuario(admin):
+    # Sem arquivo enviado: nada é gravado
+    resposta = admin.post('/admin/produto/compravenda', data={})
+    assert resposta.status_code == 302 and resposta.headers['Location'].endswith('/admin/produto/compravenda')
+    assert NOME_NA_REPLICA in admin.get('/admin/user/management').text
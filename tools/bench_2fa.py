@@ -0,0 +1,92 @@
+"""
+Custo do cadastro e do uso do segundo fator de autenticação: o código QR de
+provisionamento (versão fixa, SVG, em cache por URI) contra a geração
+anterior (busca da versão, imagem PIL, PNG), a verificação do código TOTP
+com o objeto reaproveitado contra um objeto novo a cada chamada, e as
+requisições de enable_2fa e get2fa medidas pelo cliente de teste.
+
+    python -m tools.bench_2fa --repeticoes 200
+"""
+import argparse
+import io
+from base64 import b64encode
+
+import pyotp
+from qrcode import QRCode
+
+from tools.comum import app_temporaria, mede, resumo
+
+EMAIL = 'admin@admin.com.br'
+
+
+def qr_anterior(uri: str) -> str:
+    # User.get_b64encoded_qr_totp_uri antes do cache
+    qr = QRCode(version=1, box_size=10, border=5)
+    qr.add_data(uri, optimize=0)
+    qr.make(fit=True)
+    img = qr.make_image(fill_color='black', back_color='white')
+    buffered = io.BytesIO()
+    img.save(buffered)
+    return b64encode(buffered.getvalue()).decode('utf-8')
+
+
+def verifica_anterior(otp_secret: str, token: str) -> bool:
+    return pyotp.TOTP(otp_secret).verify(token, valid_window=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeticoes', type=int, default=200)
+    args = parser.parse_args()
+    n = args.repeticoes
+
+    with app_temporaria() as app:
+        from src.models.usuario import User, _qr_svg_b64, _totp
+        from src.modules import db
+
+        with app.app_context():
+            usuario = User.get_by_email(EMAIL)
+            usuario.otp_secret = pyotp.random_base32()
+            usuario.usa_2fa = False
+            db.session.commit()
+            usuario_id, otp_secret = usuario.id, usuario.otp_secret
+            with app.test_request_context():
+                uri = usuario.get_totp_uri
+
+        print(f"Código QR de provisionamento ({len(uri)} caracteres na URI), {n} repetições")
+        print(f"  {'anterior (PNG)':<24} {resumo(mede(lambda: qr_anterior(uri), n))}")
+        print(f"  {'SVG, sem cache':<24} {resumo(mede(lambda: _qr_svg_b64.__wrapped__(uri), n))}")
+        print(f"  {'SVG, em cache':<24} {resumo(mede(lambda: _qr_svg_b64(uri), n))}")
+
+        token = pyotp.TOTP(otp_secret).now()
+        print(f"\nVerificação do código TOTP, {n * 100} repetições")
+        print(f"  {'TOTP novo':<24} {resumo(mede(lambda: verifica_anterior(otp_secret, token), n * 100))}")
+        print(f"  {'TOTP reaproveitado':<24} "
+              f"{resumo(mede(lambda: _totp(otp_secret).verify(token, valid_window=1), n * 100))}")
+
+        cliente = app.test_client()
+        resposta = cliente.post('/admin/user/login', data={'email': EMAIL, 'password': '123'})
+        assert resposta.status_code == 302, resposta.status_code
+
+        def cadastro():
+            resposta = cliente.get('/admin/user/enable_2fa/')
+            assert resposta.status_code == 200, resposta.status_code
+
+        print(f"\nRequisições, {n} repetições")
+        print(f"  {'GET enable_2fa':<24} {resumo(mede(cadastro, n))}")
+
+        with app.app_context():
+            db.session.get(User, usuario_id).usa_2fa = True
+            db.session.commit()
+
+        def segundo_fator():
+            # Cliente novo a cada vez: get2fa redireciona quem já está autenticado
+            resposta = app.test_client().post(f"/admin/user/get2fa/{usuario_id}",
+                                              data={'codigo': pyotp.TOTP(otp_secret).now()})
+            assert resposta.status_code == 302 and '/get2fa/' not in resposta.headers['Location']
+
+        print(f"  {'POST get2fa':<24} {resumo(mede(segundo_fator, n))}")
+
+
+if __name__ == '__main__':
+    main()
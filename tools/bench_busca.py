@@ -0,0 +1,75 @@
+"""
+Latência da busca por nome de produto: índice FTS5 contra o filtro ilike
+(LIKE '%texto%', que percorre a tabela inteira), em um catálogo grande.
+Mede a página e o total, como na listagem. Os resultados não são idênticos:
+o ilike não ignora acentos e procura o texto inteiro, não cada palavra.
+
+    python -m tools.bench_busca --produtos 1000000
+"""
+import argparse
+import random
+import uuid
+
+import sqlalchemy as sa
+
+from tools.comum import app_temporaria, mede, resumo
+
+PALAVRAS = ['arroz', 'feijão', 'açúcar', 'café', 'leite', 'sabão', 'água', 'óleo', 'macarrão', 'farinha',
+            'biscoito', 'detergente', 'suco', 'molho', 'tomate', 'queijo', 'manteiga', 'pão', 'sal', 'vinagre']
+MARCAS = ['Bom Preço', 'Da Casa', 'Estrela', 'Tropical', 'Serrana', 'Boa Vista', 'Primor', 'Aurora']
+TERMOS = ['cafe', 'agua mineral', 'macarrao estrela', 'sabao', 'queijo serrana 500', 'xyz inexistente']
+
+
+def popula(quantidade: int, lote: int = 20000) -> None:
+    from src.models.categoria import Categoria
+    from src.models.produto import Produto
+    from src.modules import db
+    categorias = db.session.execute(sa.select(Categoria.id)).scalars().all()
+    aleatorio = random.Random(42)
+    for inicio in range(0, quantidade, lote):
+        linhas = [{'id': uuid.uuid4(),
+                   'nome': f"{aleatorio.choice(PALAVRAS).capitalize()} {aleatorio.choice(PALAVRAS)} "
+                           f"{aleatorio.choice(MARCAS)} {aleatorio.randrange(50, 5000)}",
+                   'preco': aleatorio.randrange(100, 10000) / 100,
+                   'estoque': aleatorio.randrange(-5, 100),
+                   'ativo': True,
+                   'possui_foto': False,
+                   'categoria_id': aleatorio.choice(categorias)}
+                  for _ in range(min(lote, quantidade - inicio))]
+        db.session.execute(sa.insert(Produto.__table__), linhas)
+        db.session.commit()
+        print(f"\r{inicio + len(linhas)} produtos inseridos", end='', flush=True)
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--produtos', type=int, default=1_000_000)
+    parser.add_argument('--repeticoes', type=int, default=20)
+    parser.add_argument('--por-pagina', type=int, default=20)
+    args = parser.parse_args()
+
+    with app_temporaria() as app, app.app_context():
+        from src.models.produto import Produto
+        from src.modules import db, busca
+        popula(args.produtos)
+
+        def pagina_fts(termo: str):
+            sentenca, relevancia = busca.filtra(Produto.seleciona('listagem'), Produto, termo)
+            db.session.execute(sentenca.order_by(relevancia, Produto.nome).limit(args.por_pagina)).all()
+            db.session.execute(sa.select(sa.func.count()).select_from(sentenca.subquery())).scalar_one()
+
+        def pagina_ilike(termo: str):
+            sentenca = Produto.seleciona('listagem').filter(Produto.nome.ilike(f"%{termo}%"))
+            db.session.execute(sentenca.order_by(Produto.nome).limit(args.por_pagina)).all()
+            db.session.execute(sa.select(sa.func.count()).select_from(sentenca.subquery())).scalar_one()
+
+        print(f"{args.produtos} produtos, página de {args.por_pagina} mais o total, {args.repeticoes} repetições")
+        for termo in TERMOS:
+            print(f"\n\"{termo}\"")
+            print(f"  fts5   {resumo(mede(lambda: pagina_fts(termo), args.repeticoes))}")
+            print(f"  ilike  {resumo(mede(lambda: pagina_ilike(termo), args.repeticoes))}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Latência e pico de memória (RSS) da geração de miniaturas: imagens.miniatura
+(draft do JPEG, reduce e filtro escolhido pela redução) contra a
+implementação anterior de Produto.thumbnail e contra a decodificação da foto
+inteira antes da redução, em fotos JPEG de vários tamanhos.
+
+    python -m tools.bench_miniaturas --repeticoes 20
+
+Cada combinação roda em um processo próprio, para que o pico de RSS de uma
+não contamine a medida da outra. O RSS informado é o acréscimo ao pico do
+processo depois de ler a foto, lido de VmHWM em /proc/self/status: o
+ru_maxrss de um processo recém-criado herda o pico do processo pai
+"""
+import argparse
+import io
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from PIL import Image
+
+from tools.comum import mede, resumo
+
+DIMENSOES = ((640, 480), (1600, 1200), (4000, 3000), (6000, 4000))
+
+
+def anterior(dados: bytes, max_size: int) -> bytes:
+    # Produto.thumbnail antes do cache de miniaturas, sem o acesso ao banco
+    saida = io.BytesIO()
+    entrada = Image.open(io.BytesIO(dados))
+    formato = entrada.format
+    (largura, altura) = entrada.size
+    fator_escala = max(max_size / largura, max_size / altura)
+    novo_tamanho = (int(largura * fator_escala), int(altura * fator_escala))
+    entrada.thumbnail(novo_tamanho)
+    entrada.save(saida, format=formato)
+    return saida.getvalue()
+
+
+def decodificada(dados: bytes, max_size: int) -> bytes:
+    # Foto decodificada na resolução original: o load() antes do thumbnail() impede o draft
+    saida = io.BytesIO()
+    entrada = Image.open(io.BytesIO(dados))
+    formato = entrada.format
+    entrada.load()
+    entrada.thumbnail((max_size, max_size))
+    entrada.save(saida, format=formato)
+    return saida.getvalue()
+
+
+def atual(dados: bytes, max_size: int) -> bytes:
+    from src.services.imagens import miniatura
+    return miniatura(dados, max_size)[0]
+
+
+IMPLEMENTACOES = {'decodificada': decodificada, 'anterior': anterior, 'atual': atual}
+
+
+def foto(largura: int, altura: int) -> bytes:
+    # Ruído sobre um degradê: comprime como uma foto, e não como uma cor lisa
+    degrade = Image.linear_gradient('L').resize((largura, altura))
+    ruido = Image.effect_noise((largura, altura), 40)
+    imagem = Image.merge('RGB', (degrade, ruido, Image.blend(degrade, ruido, 0.5)))
+    saida = io.BytesIO()
+    imagem.save(saida, format='JPEG', quality=90)
+    return saida.getvalue()
+
+
+def pico_rss() -> int:
+    # Em KiB
+    try:
+        with open('/proc/self/status', encoding='ascii') as status:
+            for linha in status:
+                if linha.startswith('VmHWM:'):
+                    return int(linha.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def executa(implementacao: str, arquivo: str, max_size: int, repeticoes: int) -> None:
+    # Processo filho: mede uma combinação e devolve o resultado em JSON
+    dados = Path(arquivo).read_bytes()
+    funcao = IMPLEMENTACOES[implementacao]
+    if implementacao == 'atual':
+        import src.services.imagens  # noqa: F401  (importação fora da medida de memória)
+    antes = pico_rss()
+    resultado = funcao(dados, max_size)
+    rss = pico_rss() - antes
+    largura, altura = Image.open(io.BytesIO(resultado)).size
+    duracoes = mede(lambda: funcao(dados, max_size), repeticoes)
+    print(json.dumps({'duracoes': duracoes, 'rss': rss, 'largura': largura, 'altura': altura}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeticoes', type=int, default=20)
+    parser.add_argument('--tamanhos', type=int, nargs='+', default=[64, 128])
+    parser.add_argument('--filho', nargs=3, metavar=('IMPLEMENTACAO', 'ARQUIVO', 'MAX_SIZE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.filho:
+        implementacao, arquivo, max_size = args.filho
+        executa(implementacao, arquivo, int(max_size), args.repeticoes)
+        return
+
+    with tempfile.TemporaryDirectory(prefix='labprog-') as diretorio:
+        for largura, altura in DIMENSOES:
+            arquivo = Path(diretorio) / f"{largura}x{altura}.jpg"
+            arquivo.write_bytes(foto(largura, altura))
+            print(f"\n{largura}x{altura} ({arquivo.stat().st_size // 1024} KiB)")
+            for max_size in args.tamanhos:
+                for implementacao in IMPLEMENTACOES:
+                    saida = subprocess.run([sys.executable, '-m', 'tools.bench_miniaturas',
+                                            '--repeticoes', str(args.repeticoes),
+                                            '--filho', implementacao, str(arquivo), str(max_size)],
+                                           check=True, capture_output=True, text=True).stdout
+                    medida = json.loads(saida)
+                    print(f"  {max_size:>4} {implementacao:<12} {medida['largura']:>4}x{medida['altura']:<4} "
+                          f"{resumo(medida['duracoes'])}   RSS +{medida['rss'] / 1024:7.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Custo por verificação de papéis: requisito compilado em máscara de bits
+(compila_requisito) contra o percurso dos nomes, como era feito antes, em
+requisitos com cada vez mais cláusulas E/OU.
+
+    python -m tools.bench_papeis --papeis 32
+"""
+import argparse
+import random
+import timeit
+
+from tools.comum import app_temporaria
+
+
+def por_nomes(papeis_do_usuario: frozenset[str], *papeis_necessarios) -> bool:
+    # Verificação anterior: percorre as cláusulas comparando nomes
+    for papel in papeis_necessarios:
+        if isinstance(papel, (list, tuple)):
+            if not any(nome in papeis_do_usuario for nome in papel):
+                return False
+        elif papel not in papeis_do_usuario:
+            return False
+    return True
+
+
+def requisito(do_usuario: list[str], outros: list[str], clausulas: int, alternativas: int,
+              aleatorio: random.Random) -> tuple:
+    # Requisito que o usuário atende, com o papel dele por último em cada
+    # alternativa: o pior caso, em que todas as cláusulas são avaliadas
+    partes = list()
+    for i in range(clausulas):
+        if i % 2:
+            partes.append(tuple(aleatorio.sample(outros, alternativas - 1)) + (aleatorio.choice(do_usuario),))
+        else:
+            partes.append(aleatorio.choice(do_usuario))
+    return tuple(partes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--papeis', type=int, default=32)
+    parser.add_argument('--verificacoes', type=int, default=200_000)
+    args = parser.parse_args()
+
+    with app_temporaria() as app, app.app_context():
+        from src.models.usuario import Role
+        from src.modules import db
+        from src.role_management import compila_requisito
+        nomes = [f"Papel{i:02d}" for i in range(args.papeis)]
+        for nome in nomes:
+            db.session.add(Role(nome))
+        db.session.commit()
+        Role.atribui_bits()
+        bits = Role.mapa_de_bits()
+
+        aleatorio = random.Random(42)
+        papeis_do_usuario = frozenset(aleatorio.sample(nomes, args.papeis // 2))
+        mascara = 0
+        for nome in papeis_do_usuario:
+            mascara |= 1 << bits[nome]
+
+        print(f"{args.papeis} papéis, usuário com {len(papeis_do_usuario)}, {args.verificacoes} verificações")
+        print(f"{'cláusulas':>10} {'alternativas':>13} {'nomes (ns)':>12} {'bits (ns)':>10}")
+        for clausulas, alternativas in ((1, 1), (2, 2), (4, 3), (8, 4), (16, 6), (32, 8)):
+            necessarios = requisito(sorted(papeis_do_usuario), sorted(set(nomes) - papeis_do_usuario),
+                                    clausulas, alternativas, aleatorio)
+            compilado = compila_requisito(*necessarios)
+            assert compilado.atendido_por(mascara) and por_nomes(papeis_do_usuario, *necessarios)
+            tempo_nomes = timeit.timeit(lambda: por_nomes(papeis_do_usuario, *necessarios),
+                                        number=args.verificacoes)
+            tempo_bits = timeit.timeit(lambda: compilado.atendido_por(mascara), number=args.verificacoes)
+            print(f"{clausulas:>10} {alternativas:>13} {tempo_nomes * 1e9 / args.verificacoes:>12.0f} "
+                  f"{tempo_bits * 1e9 / args.verificacoes:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
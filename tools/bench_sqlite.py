@@ -0,0 +1,101 @@
+"""
+Vazão de leituras concorrentes enquanto uma thread faz escritas em lote, com
+o perfil SQLite (WAL, PRAGMAs e engine de leitura separado) e sem ele
+(journal padrão, leituras pelo engine principal).
+
+    python -m tools.bench_sqlite --produtos 100000 --leitores 4 --segundos 10
+
+Cada leitura é a primeira página da listagem de produtos mais a contagem dos
+produtos em falta. A escrita altera o estoque de um lote de produtos por
+transação, como a compra e venda. Leituras que falham ("database is locked")
+são contadas à parte
+"""
+import argparse
+import threading
+import time
+
+import sqlalchemy as sa
+
+from tools.bench_busca import popula
+from tools.comum import app_temporaria, resumo
+
+
+def executa(perfil_ativo: bool, args) -> None:
+    with app_temporaria(SQLITE_PERFIL_ATIVO=perfil_ativo,
+                        SQLITE_LEITURA_POOL=args.leitores, SQLITE_LEITURA_OVERFLOW=0) as app, app.app_context():
+        from src.models.produto import Produto
+        from src.modules import db, perfil_sqlite
+        popula(args.produtos)
+        escrita = db.engine
+        leitura = perfil_sqlite.engine_de_leitura if perfil_ativo else db.engine
+        with escrita.connect() as conexao:
+            modo = conexao.exec_driver_sql("PRAGMA journal_mode").scalar_one()
+            ids = conexao.execute(sa.select(Produto.id).order_by(Produto.id)).scalars().all()
+
+        pagina = sa.select(Produto.id, Produto.nome, Produto.preco, Produto.estoque). \
+            order_by(Produto.nome, Produto.id).limit(20)
+        em_falta = sa.select(sa.func.count()).select_from(Produto).where(Produto.estoque <= sa.literal_column('0'))
+        incrementa = sa.update(Produto.__table__). \
+            where(Produto.id == sa.bindparam('produto_id')). \
+            values(estoque=Produto.estoque + 1)
+
+        fim = time.monotonic() + args.segundos
+        duracoes: list[float] = list()
+        falhas = {'leitura': 0, 'escrita': 0}
+        lotes = [0]
+        lock = threading.Lock()
+
+        def leitor():
+            while time.monotonic() < fim:
+                inicio = time.perf_counter()
+                try:
+                    with leitura.connect() as conexao:
+                        conexao.execute(pagina).all()
+                        conexao.execute(em_falta).scalar_one()
+                except sa.exc.OperationalError:
+                    with lock:
+                        falhas['leitura'] += 1
+                    continue
+                with lock:
+                    duracoes.append((time.perf_counter() - inicio) * 1000)
+
+        def escritor():
+            posicao = 0
+            while time.monotonic() < fim:
+                lote = ids[posicao:posicao + args.lote] or ids[:args.lote]
+                posicao = (posicao + args.lote) % len(ids)
+                try:
+                    with escrita.begin() as conexao:
+                        conexao.execute(incrementa, [{'produto_id': produto_id} for produto_id in lote])
+                except sa.exc.OperationalError:
+                    falhas['escrita'] += 1
+                    continue
+                lotes[0] += 1
+
+        threads = [threading.Thread(target=escritor)] + \
+                  [threading.Thread(target=leitor) for _ in range(args.leitores)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        print(f"\nPerfil {'ativo' if perfil_ativo else 'inativo'} (journal_mode={modo})")
+        print(f"  leituras  {len(duracoes) / args.segundos:8.1f}/s   {resumo(duracoes) if duracoes else '-'}   "
+              f"falhas {falhas['leitura']}")
+        print(f"  escritas  {lotes[0] / args.segundos:8.1f} lotes de {args.lote}/s   falhas {falhas['escrita']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--produtos', type=int, default=100_000)
+    parser.add_argument('--leitores', type=int, default=4)
+    parser.add_argument('--segundos', type=float, default=10)
+    parser.add_argument('--lote', type=int, default=1000)
+    args = parser.parse_args()
+    print(f"{args.produtos} produtos, {args.leitores} leitores e 1 escritor por {args.segundos:g} s")
+    for perfil_ativo in (False, True):
+        executa(perfil_ativo, args)
+
+
+if __name__ == '__main__':
+    main()
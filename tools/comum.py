@@ -0,0 +1,52 @@
+import contextlib
+import json
+import logging
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Iterator
+
+from flask import Flask
+
+RAIZ = Path(__file__).resolve().parents[1]
+
+
+@contextlib.contextmanager
+def app_temporaria(**configuracao) -> Iterator[Flask]:
+    """
+    Aplicação com pasta instance e banco temporários, criada a partir de
+    config.sample.json, sem envio de emails e sem limite de taxa
+    """
+    from src import create_app
+    config = json.loads((RAIZ / 'instance' / 'config.sample.json').read_text(encoding='utf-8'))
+    config.update({'MAIL_BACKEND': 'locmem', 'EMAIL_DESPACHO_ATIVO': False, 'RATE_LIMIT_ATIVO': False,
+                   'WTF_CSRF_ENABLED': False})
+    config.update(configuracao)
+    with tempfile.TemporaryDirectory(prefix='labprog-') as diretorio:
+        instancia = Path(diretorio)
+        (instancia / 'config.bench.json').write_text(json.dumps(config), encoding='utf-8')
+        (instancia / config.get('SQLITE_DB_NAME', 'application_db.sqlite3')).touch()
+        logging.disable(logging.INFO)
+        try:
+            app = create_app('config.bench.json', instance_path=str(instancia))
+        finally:
+            logging.disable(logging.NOTSET)
+        app.logger.setLevel(logging.WARNING)
+        yield app
+
+
+def mede(funcao: Callable[[], object], repeticoes: int) -> list[float]:
+    # Duração de cada chamada, em milissegundos
+    duracoes = list()
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        duracoes.append((time.perf_counter() - inicio) * 1000)
+    return duracoes
+
+
+def resumo(duracoes: list[float]) -> str:
+    ordenadas = sorted(duracoes)
+    p95 = ordenadas[min(len(ordenadas) - 1, int(len(ordenadas) * 0.95))]
+    return f"mediana {statistics.median(ordenadas):8.2f} ms   p95 {p95:8.2f} ms   máx {ordenadas[-1]:8.2f} ms"